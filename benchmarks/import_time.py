@@ -0,0 +1,145 @@
+"""Measures the time taken to import each subcommand's module, and to
+start the CLI, each in a fresh process.
+
+Reports the cumulative import time of each module with the slowest
+packages it imports, and exits with an error if any of these or the CLI
+startup exceeds its budget, so that heavy dependencies (scikit-learn, scipy,
+boto3, distutils) creeping back into module-level imports are noticed.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import subprocess
+import sys
+from tabulate import tabulate
+import timeit
+
+
+# budgets in milliseconds, generous enough for slow machines
+budgets = {
+    'kameris.__main__': 100,
+    'kameris.subcommands.classify': 400,
+    'kameris.subcommands.run_job': 600,
+    'kameris.subcommands.serve': 600,
+    'kameris.subcommands.summarize': 300,
+    'kameris.utils.launcher_utils': 100
+}
+# for python -m kameris --help, including interpreter startup
+help_budget = 250
+
+
+def parse_importtime(output, module):
+    """Returns the cumulative import time in ms of module, and of each
+    top-level package imported while importing it, from the output of
+    python -X importtime."""
+
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # nested imports are indented by two more spaces per level
+        depth = len(name) - len(name.lstrip(' '))
+        entries.append((depth, name.strip(), int(cumulative) / 1000))
+
+    # imports are listed after the ones they trigger
+    for index in reversed(range(len(entries))):
+        depth, name, module_time = entries[index]
+        if name == module:
+            break
+    else:
+        return None, {}
+    packages = {}
+    for nested_depth, name, package_time in reversed(entries[:index]):
+        if nested_depth <= depth:
+            break
+        if '.' not in name:
+            packages[name] = max(packages.get(name, 0), package_time)
+    return module_time, packages
+
+
+def time_import(module, repeats):
+    """Returns the lowest time in ms to import module in a fresh process,
+    and the times of the packages it imported during the fastest run. Falls
+    back to wall-clock time, with no packages, if -X importtime isn't
+    supported."""
+
+    best_time, best_packages = None, {}
+    for _ in range(repeats):
+        start_time = timeit.default_timer()
+        process = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        _, stderr = process.communicate()
+        wall_time = (timeit.default_timer() - start_time) * 1000
+        if process.returncode != 0:
+            raise RuntimeError(
+                'importing {} failed:\n{}'.format(module, stderr)
+            )
+        elapsed, packages = parse_importtime(stderr, module)
+        if elapsed is None:
+            elapsed = wall_time
+        if best_time is None or elapsed < best_time:
+            best_time, best_packages = elapsed, packages
+    return best_time, best_packages
+
+
+def time_help(repeats):
+    """Returns the lowest wall-clock time in ms of python -m kameris
+    --help."""
+
+    times = []
+    for _ in range(repeats):
+        start_time = timeit.default_timer()
+        subprocess.check_call([sys.executable, '-m', 'kameris', '--help'],
+                              stdout=subprocess.PIPE)
+        times.append((timeit.default_timer() - start_time) * 1000)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5,
+                        help='number of slowest imported packages to show')
+    parser.add_argument('--no-budgets', action='store_true',
+                        help="don't fail when a budget is exceeded")
+    args = parser.parse_args()
+
+    rows = []
+    over_budget = []
+    for module in sorted(budgets):
+        elapsed, packages = time_import(module, args.repeats)
+        slowest = sorted(
+            ((t, name) for name, t in packages.items()
+             if name != 'kameris'),
+            reverse=True
+        )[:args.top]
+        rows.append([module, elapsed, budgets[module],
+                     ', '.join('{} ({:.0f})'.format(name, t)
+                               for t, name in slowest)])
+        if elapsed > budgets[module]:
+            over_budget.append(module)
+
+    print(tabulate(rows, headers=[
+        'module', 'import (ms)', 'budget (ms)', 'slowest imports (ms)'
+    ], floatfmt='.1f'))
+    help_time = time_help(args.repeats)
+    print('\npython -m kameris --help: {:.1f} ms (including interpreter '
+          'startup), budget {} ms'.format(help_time, help_budget))
+    if help_time > help_budget:
+        over_budget.append('python -m kameris --help')
+
+    if over_budget and not args.no_budgets:
+        print('\nover budget: ' + ', '.join(over_budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
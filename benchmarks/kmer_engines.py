@@ -0,0 +1,141 @@
+"""Compares the native CGR binary, run once or in shards, with the
+in-process NumPy engine for computing k-mer counts.
+
+Times each engine on synthetic FASTA files for a range of file counts,
+sequence lengths and values of k, including process startup and file
+output, and checks that both give identical output files. Uses an existing
+directory of FASTA files instead if one is given.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import argparse
+from backports import tempfile
+import filecmp
+import logging
+import numpy as np
+import os
+import subprocess
+from tabulate import tabulate
+import timeit
+
+from kameris.job_steps import backend
+
+
+def write_synthetic_fasta(directory, num_files, seq_length):
+    for i in range(num_files):
+        letters = np.random.choice(list('ACGT'), size=seq_length)
+        with open(os.path.join(directory, '{:08}.fasta'.format(i)),
+                  'w') as outfile:
+            outfile.write('>sequence {}\n'.format(i))
+            for start in range(0, seq_length, 60):
+                outfile.write(''.join(letters[start:start+60]) + '\n')
+
+
+def time_engine(fasta_dir, output_file, k, engine, n_jobs, repeats,
+                shards=1):
+    options = {
+        'fasta_output_dir': fasta_dir,
+        'output_file': output_file,
+        'k': k,
+        'bits_per_element': 32,
+        'mode': 'counts',
+        'disable_avx': False,
+        'engine': engine,
+        'n_jobs': n_jobs,
+        'shards': shards
+    }
+    times = []
+    for _ in range(repeats):
+        start_time = timeit.default_timer()
+        try:
+            backend.run_backend_kmers(options, {})
+        except subprocess.CalledProcessError:
+            # the binary keeps all CGRs in memory, so it can run out
+            return None
+        times.append(timeit.default_timer() - start_time)
+    return min(times)
+
+
+def run_benchmark(fasta_dir, k, n_jobs, repeats):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        native_file = os.path.join(temp_dir, 'native.mm-repr')
+        sharded_file = os.path.join(temp_dir, 'sharded.mm-repr')
+        numpy_file = os.path.join(temp_dir, 'numpy.mm-repr')
+        native_time = time_engine(fasta_dir, native_file, k, 'native', 1,
+                                  repeats)
+        sharded_time = time_engine(fasta_dir, sharded_file, k, 'native', 1,
+                                   repeats, shards=n_jobs)
+        numpy_time = time_engine(fasta_dir, numpy_file, k, 'numpy', 1,
+                                 repeats)
+        threaded_time = time_engine(fasta_dir, numpy_file, k, 'numpy',
+                                    n_jobs, repeats)
+        identical = (native_time is not None and
+                     sharded_time is not None and
+                     filecmp.cmp(native_file, sharded_file, shallow=False) and
+                     filecmp.cmp(native_file, numpy_file, shallow=False))
+    return native_time, sharded_time, numpy_time, threaded_time, identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fasta-dir', help='existing directory of FASTA '
+                                            'files to use')
+    parser.add_argument('--files', type=int, nargs='+', default=[1, 100,
+                                                                 2000])
+    parser.add_argument('--lengths', type=int, nargs='+',
+                        default=[1000, 10000, 1000000])
+    parser.add_argument('--k', type=int, nargs='+', default=[4, 7, 10])
+    parser.add_argument('--n-jobs', type=int, default=4,
+                        help='number of threads and of native shards')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--max-total-length', type=int, default=10**8,
+                        help='skip synthetic cases with more letters')
+    args = parser.parse_args()
+
+    # the native engine logs its progress
+    logging.getLogger('kameris').setLevel(logging.WARNING)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.fasta_dir:
+            cases = [('given', '', args.fasta_dir)]
+        else:
+            np.random.seed(0)
+            cases = []
+            for num_files in args.files:
+                for seq_length in args.lengths:
+                    if num_files * seq_length > args.max_total_length:
+                        continue
+                    fasta_dir = os.path.join(temp_dir, '{}-{}'.format(
+                        num_files, seq_length
+                    ))
+                    os.mkdir(fasta_dir)
+                    write_synthetic_fasta(fasta_dir, num_files, seq_length)
+                    cases.append((num_files, seq_length, fasta_dir))
+
+        for num_files, seq_length, fasta_dir in cases:
+            for k in args.k:
+                (native_time, sharded_time, numpy_time, threaded_time,
+                 identical) = run_benchmark(fasta_dir, k, args.n_jobs,
+                                            args.repeats)
+                speedup = (native_time / min(numpy_time, threaded_time)
+                           if native_time is not None else None)
+                rows.append([
+                    num_files, seq_length, k, native_time, sharded_time,
+                    numpy_time, threaded_time, speedup, identical
+                ])
+
+    print(tabulate(rows, headers=[
+        'files', 'length', 'k', 'native (s)',
+        'native, {} shards (s)'.format(args.n_jobs), 'numpy (s)',
+        'numpy, {} threads (s)'.format(args.n_jobs), 'speedup', 'identical'
+    ], floatfmt='.4f', missingval='-'))
+    if any(row[3] is None or row[4] is None for row in rows):
+        print('- means the native binary failed, usually by running out of '
+              'memory')
+
+
+if __name__ == '__main__':
+    main()
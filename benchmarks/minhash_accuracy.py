@@ -0,0 +1,109 @@
+"""Compares MinHash distances with the exact Mash distances they estimate.
+
+For each sketch size, times computing the sketches and all pairwise
+distances, and reports the error and correlation of the estimates against
+the distances from the exact Jaccard index of the sequences' k-mers, on a
+random sample of pairs. Uses synthetic sequences, mutated from a few
+ancestors at a range of rates, unless a directory of FASTA files is given.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import numpy as np
+from tabulate import tabulate
+import timeit
+
+from kameris.job_steps import _cgr, _hashed_kmers, _minhash
+
+
+def synthetic_sequences(num_sequences, num_clades, seq_length):
+    ancestors = np.random.randint(4, size=(num_clades, seq_length))
+    sequences = []
+    for i in range(num_sequences):
+        sequence = ancestors[i % num_clades].astype(np.uint8)
+        mutated = np.random.rand(seq_length) < np.random.choice(
+            [0.001, 0.01, 0.03, 0.1]
+        )
+        sequence[mutated] = np.random.randint(4, size=mutated.sum())
+        sequences.append(sequence)
+    return sequences
+
+
+def mash_distance(jaccard, k):
+    if jaccard == 0:
+        return 1
+    return min(1, -np.log(2 * jaccard / (1 + jaccard)) / k)
+
+
+def exact_distances(sequences, pairs, k):
+    kmers = [np.unique(_hashed_kmers.kmer_hashes(s, k, canonical=True))
+             for s in sequences]
+    results = []
+    for i, j in pairs:
+        num_shared = len(np.intersect1d(kmers[i], kmers[j],
+                                        assume_unique=True))
+        num_total = len(kmers[i]) + len(kmers[j]) - num_shared
+        results.append(mash_distance(num_shared / max(num_total, 1), k))
+    return np.array(results)
+
+
+def run_benchmark(sequences, pairs, exact, k, size):
+    start_time = timeit.default_timer()
+    sketches = np.array([_minhash.sketch(s, k, size) for s in sequences])
+    sketch_time = timeit.default_timer() - start_time
+
+    start_time = timeit.default_timer()
+    dists = np.zeros((len(sequences), len(sequences)), dtype=np.float32)
+    for i, row in enumerate(_minhash.iter_distance_rows(sketches, k)):
+        dists[i, i+1:] = row
+    dists_time = timeit.default_timer() - start_time
+
+    estimates = dists[pairs[:, 0], pairs[:, 1]]
+    errors = np.abs(estimates - exact)
+    # pairs sharing no sampled k-mers all get the capped distance of 1
+    close = exact < 0.2
+    return [size, sketch_time, dists_time, errors.mean(),
+            np.percentile(errors, 99), errors[close].mean() if close.any()
+            else np.nan, np.corrcoef(estimates, exact)[0, 1]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fasta-dir', help='directory of FASTA files')
+    parser.add_argument('--sequences', type=int, default=500)
+    parser.add_argument('--clades', type=int, default=5)
+    parser.add_argument('--seq-length', type=int, default=10000)
+    parser.add_argument('--k', type=int, default=21)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 300, 1000, 3000])
+    parser.add_argument('--pairs', type=int, default=2000,
+                        help='number of pairs compared with exact distances')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    if args.fasta_dir:
+        sequences = [_cgr.read_sequence(f)
+                     for f in _cgr.fasta_files(args.fasta_dir)]
+    else:
+        sequences = synthetic_sequences(args.sequences, args.clades,
+                                        args.seq_length)
+    pairs = np.random.randint(len(sequences), size=(args.pairs, 2))
+    pairs = pairs[pairs[:, 0] < pairs[:, 1]]
+    exact = exact_distances(sequences, pairs, args.k)
+    print('{} sequences, {} pairs, k = {}'.format(
+        len(sequences), len(pairs), args.k
+    ))
+
+    rows = [run_benchmark(sequences, pairs, exact, args.k, size)
+            for size in args.sizes]
+    print(tabulate(rows, headers=[
+        'sketch size', 'sketches (s)', 'distances (s)', 'mean error',
+        '99th pct error', 'mean error (d < 0.2)', 'correlation'
+    ], floatfmt='.4f'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Compares loading models saved in the memory-mappable model format with
+loading models saved with joblib, as done before it.
+
+Reports load time, first prediction time and the increase in resident
+memory after each, measured in a fresh process. Uses a model trained on
+synthetic features unless an existing model file is given.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import argparse
+from backports import tempfile
+import json
+import numpy as np
+import os
+import psutil
+import subprocess
+import sys
+from tabulate import tabulate
+import timeit
+
+import sklearn
+from sklearn.decomposition import TruncatedSVD
+from sklearn.externals import joblib
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from kameris.utils import model_utils
+
+
+def synthetic_model(num_points, num_features, num_classes):
+    features = np.random.rand(num_points, num_features)
+    point_classes = np.random.randint(num_classes, size=num_points)
+    predictor = Pipeline([
+        ('scaler', StandardScaler(with_mean=False)),
+        ('dim_reducer', TruncatedSVD(n_components=num_features // 10)),
+        ('classifier', SVC(kernel='linear'))
+    ])
+    predictor.fit(features, point_classes)
+    return {
+        'sklearn_version': sklearn.__version__,
+        'generation_options': {'mode': 'frequencies', 'k': 0,
+                               'bits_per_element': 16},
+        'predictor': predictor
+    }
+
+
+def measure_load(model_filename, num_features):
+    """Runs in a fresh process, printing the measurements as JSON."""
+
+    process = psutil.Process()
+    start_rss = process.memory_info().rss
+    start_time = timeit.default_timer()
+    with open(model_filename, 'rb') as model_file:
+        model_data = model_utils.load_model(model_file)
+    load_end_time = timeit.default_timer()
+    load_rss = process.memory_info().rss
+    model_data['predictor'].predict(np.random.rand(1, num_features))
+    predict_end_time = timeit.default_timer()
+
+    print(json.dumps({
+        'load_time': load_end_time - start_time,
+        'predict_time': predict_end_time - load_end_time,
+        'load_rss_increase': load_rss - start_rss,
+        'predict_rss_increase': process.memory_info().rss - start_rss
+    }))
+
+
+def run_measurement(model_filename, num_features):
+    output = subprocess.check_output([
+        sys.executable, __file__, '--measure', model_filename,
+        '--features', str(num_features)
+    ])
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', help='existing model file to convert')
+    parser.add_argument('--points', type=int, default=2000)
+    parser.add_argument('--features', type=int, default=4**6)
+    parser.add_argument('--classes', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure_load(args.measure, args.features)
+        return
+
+    if args.model:
+        model_data = model_utils.load_model(args.model)
+        num_features = model_data['predictor'].steps[0][1].scale_.shape[0]
+    else:
+        np.random.seed(0)
+        model_data = synthetic_model(args.points, args.features,
+                                     args.classes)
+        num_features = args.features
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        joblib_filename = os.path.join(temp_dir, 'joblib.mm-model')
+        joblib.dump(model_data, joblib_filename)
+        new_filename = os.path.join(temp_dir, 'new.mm-model')
+        model_utils.save_model(new_filename, model_data)
+
+        rows = []
+        for name, filename in [('joblib', joblib_filename),
+                               ('memory-mapped', new_filename)]:
+            results = [run_measurement(filename, num_features)
+                       for _ in range(args.repeats)]
+            rows.append([
+                name, os.path.getsize(filename) / 1024**2,
+                min(r['load_time'] for r in results),
+                min(r['predict_time'] for r in results),
+                min(r['load_rss_increase'] for r in results) / 1024**2,
+                min(r['predict_rss_increase'] for r in results) / 1024**2
+            ])
+
+    # memory-mapped arrays only count towards RSS once they're used, and are
+    #   then shared with other processes using the same model
+    print(tabulate(rows, headers=[
+        'format', 'size (MB)', 'load (s)', 'first predict (s)',
+        'RSS after load (MB)', 'RSS after predict (MB)'
+    ], floatfmt='.4f'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Compares classification with single and double precision features.
+
+Reports cross-validated accuracy, preprocessing and classifier times, and
+the memory used by the features for each precision. Uses synthetic k-mer
+frequencies unless a features file (.mm-repr) and metadata file are given,
+for example from the output of a job.
+"""
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals)
+
+import argparse
+import json
+import numpy as np
+import random
+from tabulate import tabulate
+import timeit
+
+from kameris.job_steps import classify
+from kameris.job_steps._classifiers import classifier_spec
+from kameris.utils import file_formats
+
+
+def synthetic_features(num_points, num_classes, k, seq_length):
+    num_features = 4**k
+    # each class has its own k-mer distribution, close to a shared one so
+    #   that classes overlap
+    base_profile = np.random.dirichlet(np.ones(num_features))
+    class_profiles = np.random.dirichlet(base_profile * num_features * 500,
+                                         size=num_classes)
+    point_classes = np.random.randint(num_classes, size=num_points)
+    features = np.empty((num_points, num_features))
+    for i, point_class in enumerate(point_classes):
+        features[i] = np.random.multinomial(
+            seq_length, class_profiles[point_class]
+        ) / seq_length
+    return features, point_classes.astype(str)
+
+
+def run_benchmark(features, point_classes, classifier_names, precision,
+                  validation_count, seed):
+    options = {
+        'precision': precision,
+        'validation_count': validation_count,
+        'classifiers': classifier_names
+    }
+    features = np.asarray(features).astype(precision)
+    num_features = classify.avg_num_nonzero_entries(features)
+    unique_classes = np.unique(point_classes)
+
+    random.seed(seed)
+    np.random.seed(seed)
+    folds = classify.validation_folds(point_classes, options)
+
+    results = {name: {'accuracy': 0, 'train_time': 0, 'test_time': 0}
+               for name in classifier_names}
+    preprocess_time = 0
+    for fold_seed, train_indexes, test_indexes in folds:
+        np.random.seed(fold_seed)
+        start_time = timeit.default_timer()
+        fold_data = classify.preprocess_fold(
+            features, 'features', train_indexes, test_indexes, num_features,
+            options
+        )
+        preprocess_time += timeit.default_timer() - start_time
+
+        for name in classifier_names:
+            np.random.seed(fold_seed)
+            stats = classify.classification_run(
+                classify.make_classifier_factory(classifier_spec(name),
+                                                 options),
+                fold_data, features, point_classes, unique_classes,
+                train_indexes, test_indexes, options
+            )
+            # times in stats include preprocessing, which is counted apart
+            results[name]['accuracy'] += (stats['topN_results']['top1']
+                                          ['accuracy'] / len(folds))
+            results[name]['train_time'] += (stats['train_time'] -
+                                            fold_data['fit_time'])
+            results[name]['test_time'] += (stats['test_time'] -
+                                           fold_data['transform_time'])
+
+    return features.nbytes, preprocess_time, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--features', help='.mm-repr features file')
+    parser.add_argument('--metadata', help='metadata file for --features')
+    parser.add_argument('--points', type=int, default=2000)
+    parser.add_argument('--classes', type=int, default=5)
+    parser.add_argument('--k', type=int, default=7)
+    parser.add_argument('--seq-length', type=int, default=10000)
+    parser.add_argument('--validation-count', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--classifiers', nargs='+',
+                        default=['linear-svm', 'logistic-regression',
+                                 'nearest-centroid-mean'])
+    args = parser.parse_args()
+
+    if args.features:
+        features = file_formats.read_repr_matrix(args.features, mmap=False)
+        with open(args.metadata, 'r') as infile:
+            point_classes = np.array([x['group'] for x in json.load(infile)])
+    else:
+        np.random.seed(args.seed)
+        features, point_classes = synthetic_features(
+            args.points, args.classes, args.k, args.seq_length
+        )
+    print('{} points, {} features'.format(*features.shape))
+
+    rows = []
+    for precision in ['float64', 'float32']:
+        nbytes, preprocess_time, results = run_benchmark(
+            features, point_classes, args.classifiers, precision,
+            args.validation_count, args.seed
+        )
+        rows.append([precision, '', nbytes / 1024**2, preprocess_time, '',
+                     '', ''])
+        for name in args.classifiers:
+            rows.append(['', name, '', '', results[name]['accuracy'],
+                         results[name]['train_time'],
+                         results[name]['test_time']])
+
+    print(tabulate(rows, headers=[
+        'precision', 'classifier', 'features (MB)', 'preprocess (s)',
+        'accuracy', 'train (s)', 'test (s)'
+    ], floatfmt='.4f'))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+from kameris.job_steps import lazy_module_names
+from kameris.subcommands import subcommands
 from kameris.utils.platform_utils import platform_name
 
 
@@ -11,9 +13,9 @@ a = Analysis(['kameris.py'],
              ],
              hiddenimports=[
                  'sklearn.neighbors.typedefs', 'sklearn.neighbors.quad_tree', 'sklearn.tree._utils',
-                 'scipy._lib.messagestream',
-                 'kameris.subcommands.run_job', 'kameris.subcommands.summarize'
-             ],
+                 'scipy._lib.messagestream'
+             ] + ['kameris.subcommands.' + subcommand['module_name']
+                  for subcommand in subcommands.values()] + lazy_module_names(),
              hookspath=[],
              runtime_hooks=[],
              excludes=[],
@@ -1,15 +1,32 @@
 from __future__ import absolute_import, division, unicode_literals
 
-from . import backend
-from . import classify
-from . import mds
-from . import selection
-
-
-step_runners = {
-    'classify': classify.run_classify_step,
-    'distances': backend.run_backend_dists,
-    'kmers': backend.run_backend_kmers,
-    'mds': mds.run_mds_step,
-    'select': selection.run_select_step
+import importlib
+import six
+
+
+# step modules are only imported when a step of their type runs, since some
+#   import heavy dependencies
+_step_runner_names = {
+    'classify': ('classify', 'run_classify_step'),
+    'distances': ('backend', 'run_backend_dists'),
+    'kmers': ('backend', 'run_backend_kmers'),
+    'mds': ('mds', 'run_mds_step'),
+    'select': ('selection', 'run_select_step')
 }
+
+
+def step_runner(step_type):
+    module_name, func_name = _step_runner_names[step_type]
+    module = importlib.import_module('.' + module_name, __name__)
+    return getattr(module, func_name)
+
+
+def lazy_module_names():
+    """Returns the names of the modules which are only imported by name when
+    needed, which PyInstaller can't find by itself."""
+
+    from ._classifiers import classifier_module_names
+
+    step_modules = {'{}.{}'.format(__name__, module_name)
+                    for module_name, _ in six.itervalues(_step_runner_names)}
+    return sorted(step_modules) + classifier_module_names()
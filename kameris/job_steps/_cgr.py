@@ -0,0 +1,365 @@
+from __future__ import absolute_import, division, unicode_literals
+
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import os
+
+from ..utils import process_utils
+
+
+# an in-process version of the CGR computation done by the generation_cgr
+#   binary, giving identical output
+# letters are C=0, G=1, A=2, T=3: the high bit of each letter goes in the
+#   row and the low bit in the column, with the first letter of a k-mer in
+#   the lowest bit
+
+_invalid_code = 255
+_letter_codes = np.full(256, _invalid_code, dtype=np.uint8)
+for _code, _letter in enumerate(bytearray(b'CGAT')):
+    _letter_codes[_letter] = _code
+
+# limits on the size of the count matrix and of the sequences of a batch
+_max_batch_counts = 2**22
+_max_batch_bytes = 2**24
+# sparse CGRs have at most as many entries as their sequences have letters,
+#   so their number per batch only needs a loose limit
+_max_sparse_batch_size = 1024
+
+# with 'auto' precision, k-mer features for k at least this use single
+#   precision, since there are at least 4^k features per point
+float32_min_k = 8
+
+
+def fasta_files(directory):
+    """Returns the paths of the files in directory, in the order the CGR
+    binary processes them."""
+
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+            if os.path.isfile(os.path.join(directory, f))]
+
+
+def sequence_codes(lines):
+    """Returns the letter codes of the first sequence in the given lines of
+    FASTA (as bytes), as read by the CGR binary: lines are stripped, header
+    and blank lines before the sequence are skipped, and the sequence ends at
+    the next header or blank line. Returns None if there is no sequence."""
+
+    sequence_lines = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith(b'>'):
+            if sequence_lines:
+                break
+            continue
+        sequence_lines.append(line)
+    if not sequence_lines:
+        return None
+
+    return _letter_codes[np.frombuffer(b''.join(sequence_lines),
+                                       dtype=np.uint8)]
+
+
+def read_sequence(filename):
+    """Returns the letter codes of the first sequence in a FASTA file."""
+
+    with open(filename, 'rb') as infile:
+        codes = sequence_codes(infile)
+    if codes is None:
+        raise ValueError('no sequence found in ' + filename)
+    return codes
+
+
+def read_records(infile):
+    """Yields the name (the first word of the header) and letter codes of
+    each record in a multi-FASTA file opened in binary mode, each record
+    being read like a file of its own. Records without a sequence have None
+    as codes."""
+
+    name = None
+    lines = []
+    for line in infile:
+        if line.lstrip().startswith(b'>'):
+            if name is not None or lines:
+                yield name or '', sequence_codes(lines)
+            header = line.strip()[1:].split()
+            name = header[0].decode('utf-8', 'replace') if header else ''
+            lines = []
+        else:
+            lines.append(line)
+    if name is not None or lines:
+        yield name or '', sequence_codes(lines)
+
+
+def max_batch_size(k, sparse_output=False, num_features=None):
+    """Returns the number of sequences whose CGRs (or other features, with
+    num_features per sequence instead of 4^k) may be computed together while
+    keeping memory use bounded, as dense or sparse matrices."""
+
+    if sparse_output:
+        return _max_sparse_batch_size
+    return max(1, _max_batch_counts // (num_features or 4**k))
+
+
+def _invalid_prefix(num_invalid):
+    prefix = np.zeros(num_invalid, dtype=np.uint8)
+    if num_invalid:
+        prefix[-1] = 3
+    return prefix
+
+
+def _valid_codes(codes, k):
+    # letters other than ACGT are skipped, except that the binary counts any
+    #   in the first k-1 positions as a prefix of C...CT
+    num_invalid_prefix = int(np.count_nonzero(codes[:k-1] == _invalid_code))
+    codes = codes[codes != _invalid_code]
+    if num_invalid_prefix:
+        codes = np.concatenate([_invalid_prefix(num_invalid_prefix), codes])
+    return codes
+
+
+def cgr_counts(sequences_codes, k, bits_per_element, sparse_output=False):
+    """Returns the CGRs of sequences given by their letter codes, as a
+    matrix with one row per sequence. If sparse_output is True, it is a CSR
+    matrix, which takes memory proportional to the sequences' length rather
+    than to 4^k."""
+
+    sequences_codes = [_valid_codes(codes, k) for codes in sequences_codes]
+    num_cells = 4**k
+    num_kmers = [max(len(codes) - k + 1, 0) for codes in sequences_codes]
+
+    codes = np.concatenate(sequences_codes)
+    num_windows = len(codes) - k + 1
+    if num_windows > 0:
+        # each letter's bits, at its position in the cell index
+        letter_bits = (((codes >> 1).astype(np.int64) << k) |
+                       (codes & 1).astype(np.int64))
+        cells = np.zeros(num_windows, dtype=np.int64)
+        for i in range(k):
+            cells |= letter_bits[i:i+num_windows] << i
+
+        # only keep windows inside a sequence, and offset cells to each
+        #   sequence's row
+        starts = np.cumsum([0] + [len(c) for c in sequences_codes[:-1]])
+        sequence_indexes = np.repeat(np.arange(len(sequences_codes)),
+                                     num_kmers)
+        window_indexes = (np.repeat(starts - np.cumsum([0] + num_kmers[:-1]),
+                                    num_kmers) +
+                          np.arange(sum(num_kmers)))
+        cells = cells[window_indexes] + sequence_indexes * num_cells
+    else:
+        cells = np.zeros(0, dtype=np.int64)
+
+    # counts wrap around like in the binary
+    dtype = np.uint16 if bits_per_element == 16 else np.uint32
+    if not sparse_output:
+        counts = np.bincount(cells,
+                             minlength=len(sequences_codes) * num_cells)
+        return counts.astype(dtype).reshape(len(sequences_codes), num_cells)
+
+    import scipy.sparse as sparse
+
+    cells, counts = np.unique(cells, return_counts=True)
+    counts = counts.astype(dtype)
+    cells = cells[counts != 0]
+    counts = counts[counts != 0]
+    indptr = np.searchsorted(cells // num_cells,
+                             np.arange(len(sequences_codes) + 1))
+    return sparse.csr_matrix((counts, cells % num_cells, indptr),
+                             shape=(len(sequences_codes), num_cells))
+
+
+def sequence_ends(codes, k):
+    """Returns the parts of a sequence, given by its letter codes, needed
+    besides its CGR at k to derive its CGRs at lower values of k with
+    derive_cgrs: its first k-1 letter codes, its first k-2 valid letter
+    codes, and the last k-1 letter codes it has when computing its CGR at
+    k."""
+
+    valid_codes = _valid_codes(codes, k)
+    return (codes[:k-1], codes[codes != _invalid_code][:k-2],
+            valid_codes[max(len(valid_codes) - (k-1), 0):])
+
+
+def _add_boundary_kmers(counts, ends, from_k, to_k):
+    # counts the to_k-mers in the last from_k-1 letters of each sequence,
+    #   which aren't the start of a from_k-mer
+    is_sparse = not isinstance(counts, np.ndarray)
+    counts = counts + cgr_counts([tail for _, _, tail in ends], to_k, 32,
+                                 is_sparse)
+
+    # the prefix counted in place of invalid letters at the start of a
+    #   sequence depends on k, so swap to_k-mers starting in it for the right
+    #   ones
+    swapped_rows = []
+    removed_heads = []
+    added_heads = []
+    for i, (head_codes, valid_head_codes, _) in enumerate(ends):
+        from_invalid = int(np.count_nonzero(head_codes == _invalid_code))
+        to_invalid = int(np.count_nonzero(head_codes[:to_k-1] ==
+                                          _invalid_code))
+        if from_invalid != to_invalid:
+            swapped_rows.append(i)
+            removed_heads.append(np.concatenate([
+                _invalid_prefix(from_invalid), valid_head_codes[:to_k-1]
+            ]))
+            added_heads.append(np.concatenate([
+                _invalid_prefix(to_invalid), valid_head_codes[:to_k-1]
+            ]))
+    if swapped_rows:
+        swaps = (cgr_counts(added_heads, to_k, 32, is_sparse)
+                 .astype(np.int64) -
+                 cgr_counts(removed_heads, to_k, 32, is_sparse))
+        if is_sparse:
+            import scipy.sparse as sparse
+
+            swaps = swaps.tocoo()
+            counts = counts + sparse.csr_matrix((
+                swaps.data, (np.asarray(swapped_rows)[swaps.row], swaps.col)
+            ), shape=counts.shape)
+        else:
+            counts[swapped_rows] += swaps
+    return counts
+
+
+def _marginal_counts(cgrs, from_k, k):
+    # sums sparse CGRs over the last from_k-k letters of each from_k-mer,
+    #   which are the highest bits of its row and column
+    import scipy.sparse as sparse
+
+    mask = 2**k - 1
+    indexes = cgrs.indices.astype(np.int64)
+    counts = sparse.csr_matrix((
+        cgrs.data.astype(np.int64),
+        (((indexes >> from_k) & mask) << k) | (indexes & mask),
+        # copied, since summing duplicates changes it in place
+        cgrs.indptr.copy()
+    ), shape=(cgrs.shape[0], 4**k))
+    counts.sum_duplicates()
+    return counts
+
+
+def _wrap_counts(counts, bits_per_element):
+    # counts wrap around like in the binary
+    dtype = np.uint16 if bits_per_element == 16 else np.uint32
+    if isinstance(counts, np.ndarray):
+        return (counts % 2**bits_per_element).astype(dtype)
+    counts = counts.tocsr()
+    counts.data %= 2**bits_per_element
+    counts.eliminate_zeros()
+    return counts.astype(dtype)
+
+
+def derive_cgrs(cgrs, ends, from_k, to_k_values, bits_per_element):
+    """Returns a dict with the CGRs at each of to_k_values, which are at most
+    from_k, of sequences given by their CGRs at from_k (rows of cgrs) and
+    their sequence_ends at from_k, identical to computing them directly.
+    cgrs may be dense or CSR, and the results are of the same kind."""
+
+    dtype = np.uint16 if bits_per_element == 16 else np.uint32
+    is_sparse = not isinstance(cgrs, np.ndarray)
+    results = {}
+    counts = cgrs
+    for k in range(from_k, min(to_k_values) - 1, -1):
+        if k < from_k and not is_sparse:
+            # summing over the last letter of each (k+1)-mer, which is the
+            #   highest bit of its row and column, counts the k-mers starting
+            #   at each position but the last
+            counts = counts.reshape(cgrs.shape[0], 2, 2**k, 2, 2**k).sum(
+                axis=(1, 3), dtype=np.int64
+            ).reshape(cgrs.shape[0], 4**k)
+        if k not in to_k_values:
+            continue
+        elif k == from_k:
+            results[k] = cgrs.astype(dtype)
+        else:
+            if is_sparse:
+                counts = _marginal_counts(cgrs, from_k, k)
+            results[k] = _wrap_counts(
+                _add_boundary_kmers(counts, ends, from_k, k), bits_per_element
+            )
+    return results
+
+
+def resolve_precision(precision, k=None, dtype=None):
+    """Returns the numpy dtype name to use for features given the 'precision'
+    option, the value of k used to generate them and their current dtype, if
+    known."""
+
+    if precision != 'auto':
+        return precision
+    elif (k is not None and k >= float32_min_k) or dtype == np.float32:
+        return 'float32'
+    else:
+        return 'float64'
+
+
+def frequencies(cgrs, precision):
+    """Normalizes each CGR (row of cgrs, which may be dense or CSR) to sum
+    to 1. CGRs of sequences with no k-mers are left as all zeros."""
+
+    if isinstance(cgrs, np.ndarray):
+        # counts are integers, so only empty rows have sums below 1
+        sums = np.maximum(cgrs.sum(axis=1, keepdims=True), 1)
+        return (cgrs/sums).astype(precision)
+
+    # divides each entry by its row's sum, giving the same values as for
+    #   dense CGRs
+    cgrs = cgrs.tocsr()
+    row_lengths = np.diff(cgrs.indptr)
+    sums = np.bincount(np.repeat(np.arange(cgrs.shape[0]), row_lengths),
+                       weights=cgrs.data, minlength=cgrs.shape[0])
+    result = cgrs.astype(precision)
+    result.data = (cgrs.data / np.repeat(sums, row_lengths)).astype(precision)
+    return result
+
+
+def _batches(filenames, max_files):
+    batch = []
+    batch_bytes = 0
+    for filename in filenames:
+        file_bytes = os.path.getsize(filename)
+        if batch and (len(batch) == max_files or
+                      batch_bytes + file_bytes > _max_batch_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(filename)
+        batch_bytes += file_bytes
+    if batch:
+        yield batch
+
+
+def map_file_batches(func, filenames, max_files, n_jobs=1):
+    """Yields func(batch), in order, for consecutive batches of at most
+    max_files of the given files, whose sequences together take bounded
+    memory, computed by n_jobs threads."""
+
+    batches = _batches(filenames, max_files)
+    if n_jobs > 1:
+        pool = ThreadPool(n_jobs)
+        # only a few batches ahead, since results may be large
+        batch_results = process_utils.ordered_results(pool, func, batches,
+                                                      2 * n_jobs)
+    else:
+        pool = None
+        batch_results = (func(batch) for batch in batches)
+
+    try:
+        for result in batch_results:
+            yield result
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def iter_cgrs(filenames, k, bits_per_element, n_jobs=1, sparse_output=False):
+    """Yields the CGRs of files, in order, as matrices with one row per file
+    (CSR if sparse_output is True). Files are processed in batches, by n_jobs
+    threads."""
+
+    def batch_cgrs(batch):
+        return cgr_counts([read_sequence(f) for f in batch], k,
+                          bits_per_element, sparse_output)
+
+    return map_file_batches(batch_cgrs, filenames,
+                            max_batch_size(k, sparse_output), n_jobs)
@@ -0,0 +1,132 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import hashlib
+import logging
+import numpy as np
+import os
+import scipy.sparse as sparse
+import zipfile
+
+from ..utils import fs_utils
+
+
+def sequence_key(codes):
+    """Returns the cache key of a sequence given by its letter codes, which
+    determine all of its CGRs."""
+
+    return hashlib.sha1(codes.tobytes()).hexdigest()
+
+
+class CGRCache(object):
+    """CGR counts of sequences saved as .npz files of their nonzero entries
+    in a directory, by sequence_key, k and bits per element, so they can be
+    reused by other experiments and jobs. MinHash sketches are saved there
+    too, as .npy files.
+    When the files take more than max_size bytes, the least recently used
+    ones are deleted by evict."""
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def _filename(self, key, k, bits_per_element):
+        return os.path.join(self.directory,
+                            'k{}-{}bit'.format(k, bits_per_element), key[:2],
+                            key + '.npz')
+
+    def _sketch_filename(self, key, k, size):
+        return os.path.join(self.directory,
+                            'minhash-k{}-{}'.format(k, size), key[:2],
+                            key + '.npy')
+
+    def contains(self, key, k, bits_per_element):
+        return os.path.exists(self._filename(key, k, bits_per_element))
+
+    def load(self, key, k, bits_per_element):
+        """Returns the CGR counts of a sequence as a 1 by 4^k CSR matrix, or
+        None if they aren't in the cache (or the file is unreadable)."""
+
+        filename = self._filename(key, k, bits_per_element)
+        try:
+            with np.load(filename) as data:
+                indices = data['indices'].astype(np.int64)
+                counts = data['counts']
+            # the modification time is used to find the least recently used
+            #   files
+            os.utime(filename, None)
+        except (IOError, OSError, EOFError, ValueError, KeyError,
+                zipfile.BadZipfile):
+            return None
+        if (indices.shape != counts.shape or len(indices.shape) != 1 or
+                counts.dtype != np.dtype('uint{}'.format(bits_per_element)) or
+                (len(indices) and not 0 <= indices.min() <= indices.max() <
+                 4**k)):
+            return None
+        return sparse.csr_matrix((counts, indices, [0, len(indices)]),
+                                 shape=(1, 4**k))
+
+    def save(self, key, k, bits_per_element, cgr):
+        """Saves the CGR counts of a sequence, given as a 1 by 4^k CSR
+        matrix."""
+
+        filename = self._filename(key, k, bits_per_element)
+        fs_utils.mkdir_p(os.path.dirname(filename))
+        with fs_utils.atomic_write(filename, 'wb') as outfile:
+            np.savez(outfile, indices=cgr.indices.astype(
+                np.uint32 if k <= 16 else np.uint64
+            ), counts=cgr.data)
+
+    def load_sketch(self, key, k, size):
+        """Returns the MinHash sketch of a sequence, or None if it isn't in
+        the cache (or the file is unreadable)."""
+
+        filename = self._sketch_filename(key, k, size)
+        try:
+            result = np.load(filename)
+            os.utime(filename, None)
+        except (IOError, OSError, EOFError, ValueError):
+            return None
+        if result.shape != (size,) or result.dtype != np.uint64:
+            return None
+        return result
+
+    def save_sketch(self, key, k, size, result):
+        filename = self._sketch_filename(key, k, size)
+        fs_utils.mkdir_p(os.path.dirname(filename))
+        with fs_utils.atomic_write(filename, 'wb') as outfile:
+            np.save(outfile, result)
+
+    def evict(self):
+        """Deletes the least recently used files until the cache takes at
+        most max_size bytes."""
+
+        entries = []
+        total_size = 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(('.npz', '.npy')):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+        if total_size <= self.max_size:
+            return
+
+        num_evicted = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+            num_evicted += 1
+        logging.getLogger('kameris').info(
+            'evicted %s CGRs from the cache in %s', num_evicted,
+            self.directory
+        )
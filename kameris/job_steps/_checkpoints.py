@@ -0,0 +1,64 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import hashlib
+import json
+import logging
+import os
+
+from ..utils import fs_utils
+
+
+def file_sha1(filename, chunk_size=1024*1024):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Checkpoints(object):
+    """Finished results saved as JSON files in a directory, so that work can
+    be skipped when re-running.
+    Everything in the directory is discarded if fingerprint (which should
+    describe all the inputs of the work) differs from when it was saved."""
+
+    def __init__(self, directory, fingerprint, json_encoder=None):
+        self.directory = directory
+        self.json_encoder = json_encoder
+
+        # json round-trip so the comparison doesn't depend on types
+        fingerprint = json.loads(json.dumps(fingerprint, cls=json_encoder,
+                                            sort_keys=True))
+        manifest_file = os.path.join(directory, 'manifest.json')
+        if self._read(manifest_file) == fingerprint:
+            return
+
+        if os.path.isdir(directory):
+            logging.getLogger('kameris').info(
+                'inputs changed, discarding checkpoints in %s', directory
+            )
+            for filename in os.listdir(directory):
+                if filename.endswith('.json'):
+                    os.remove(os.path.join(directory, filename))
+        fs_utils.mkdir_p(directory)
+        self._write(manifest_file, fingerprint)
+
+    def _read(self, filename):
+        try:
+            with open(filename, 'r') as infile:
+                return json.load(infile)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self, filename, data):
+        with fs_utils.atomic_write(filename) as outfile:
+            json.dump(data, outfile, cls=self.json_encoder, sort_keys=True)
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def load(self, key):
+        return self._read(self._filename(key))
+
+    def save(self, key, data):
+        self._write(self._filename(key), data)
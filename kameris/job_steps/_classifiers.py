@@ -1,36 +1,44 @@
 from __future__ import absolute_import, division, unicode_literals
 
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.linear_model import LogisticRegression, SGDClassifier
-from sklearn.neighbors.nearest_centroid import NearestCentroid
-from sklearn.svm import SVC
+from functools import partial
+import importlib
+import six
 
-from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.naive_bayes import GaussianNB
-from sklearn.discriminant_analysis import (
-    LinearDiscriminantAnalysis, QuadraticDiscriminantAnalysis)
 
-from sklearn.neural_network import MLPClassifier
+def _create(module_name, class_name, *args, **kwargs):
+    # classes are only imported when used, since importing them all is slow
+    module = importlib.import_module(module_name, __package__)
+    return getattr(module, class_name)(*args, **kwargs)
+
+
+def _lazy(module_name, class_name, **params):
+    return partial(_create, module_name, class_name, **params)
 
 
 classifiers_by_name = {
-    '10-nearest-neighbors': lambda: KNeighborsClassifier(n_neighbors=10),
-    'nearest-centroid-mean': lambda: NearestCentroid(metric='euclidean'),
-    'nearest-centroid-median': lambda: NearestCentroid(metric='manhattan'),
-    'logistic-regression': LogisticRegression,
-    'sgd': SGDClassifier,
-    'linear-svm': lambda: SVC(kernel='linear'),
-    'quadratic-svm': lambda: SVC(kernel='poly', degree=2),
-    'cubic-svm': lambda: SVC(kernel='poly', degree=3),
-    'rbf-svm': lambda: SVC(kernel='rbf'),
-    'decision-tree': DecisionTreeClassifier,
-    'random-forest': RandomForestClassifier,
-    'adaboost': AdaBoostClassifier,
-    'gaussian-naive-bayes': GaussianNB,
-    'lda': LinearDiscriminantAnalysis,
-    'qda': QuadraticDiscriminantAnalysis,
-    'multilayer-perceptron': MLPClassifier
+    '10-nearest-neighbors': _lazy('sklearn.neighbors', 'KNeighborsClassifier',
+                                  n_neighbors=10),
+    'nearest-centroid-mean': _lazy('sklearn.neighbors.nearest_centroid',
+                                   'NearestCentroid', metric='euclidean'),
+    'nearest-centroid-median': _lazy('sklearn.neighbors.nearest_centroid',
+                                     'NearestCentroid', metric='manhattan'),
+    'logistic-regression': _lazy('sklearn.linear_model',
+                                 'LogisticRegression'),
+    'sgd': _lazy('sklearn.linear_model', 'SGDClassifier'),
+    'linear-svm': _lazy('sklearn.svm', 'SVC', kernel='linear'),
+    'liblinear-svm': _lazy('sklearn.svm', 'LinearSVC'),
+    'quadratic-svm': _lazy('sklearn.svm', 'SVC', kernel='poly', degree=2),
+    'cubic-svm': _lazy('sklearn.svm', 'SVC', kernel='poly', degree=3),
+    'rbf-svm': _lazy('sklearn.svm', 'SVC', kernel='rbf'),
+    'decision-tree': _lazy('sklearn.tree', 'DecisionTreeClassifier'),
+    'random-forest': _lazy('sklearn.ensemble', 'RandomForestClassifier'),
+    'adaboost': _lazy('sklearn.ensemble', 'AdaBoostClassifier'),
+    'gaussian-naive-bayes': _lazy('sklearn.naive_bayes', 'GaussianNB'),
+    'lda': _lazy('sklearn.discriminant_analysis',
+                 'LinearDiscriminantAnalysis'),
+    'qda': _lazy('sklearn.discriminant_analysis',
+                 'QuadraticDiscriminantAnalysis'),
+    'multilayer-perceptron': _lazy('sklearn.neural_network', 'MLPClassifier')
 
     # omitted classifiers:
     # 'gaussian-process': GaussianProcessClassifier,
@@ -39,4 +47,145 @@ classifiers_by_name = {
     #   always gives strange errors
 }
 
+# SVMs which share inner products computed once per fold instead of each
+#   evaluating their own kernel (the 'precomputed_kernels' option)
+kernel_classifiers_by_name = {
+    'linear-svm': _lazy('._kernels', 'KernelSVC', kernel='linear'),
+    'quadratic-svm': _lazy('._kernels', 'KernelSVC', kernel='poly',
+                           degree=2),
+    'cubic-svm': _lazy('._kernels', 'KernelSVC', kernel='poly', degree=3),
+    'rbf-svm': _lazy('._kernels', 'KernelSVC', kernel='rbf')
+}
+
 classifier_names = classifiers_by_name.keys()
+
+# the parameters of each class, as of the version of scikit-learn we depend
+#   on, so that specs can be checked without importing it
+_class_params = {
+    'KNeighborsClassifier': [
+        'n_neighbors', 'weights', 'algorithm', 'leaf_size', 'p', 'metric',
+        'metric_params', 'n_jobs'
+    ],
+    'NearestCentroid': ['metric', 'shrink_threshold'],
+    'LogisticRegression': [
+        'penalty', 'dual', 'tol', 'C', 'fit_intercept', 'intercept_scaling',
+        'class_weight', 'random_state', 'solver', 'max_iter', 'multi_class',
+        'verbose', 'warm_start', 'n_jobs'
+    ],
+    'SGDClassifier': [
+        'loss', 'penalty', 'alpha', 'l1_ratio', 'fit_intercept', 'max_iter',
+        'tol', 'shuffle', 'verbose', 'epsilon', 'n_jobs', 'random_state',
+        'learning_rate', 'eta0', 'power_t', 'class_weight', 'warm_start',
+        'average', 'n_iter'
+    ],
+    'SVC': [
+        'C', 'kernel', 'degree', 'gamma', 'coef0', 'shrinking', 'probability',
+        'tol', 'cache_size', 'class_weight', 'verbose', 'max_iter',
+        'decision_function_shape', 'random_state'
+    ],
+    'LinearSVC': [
+        'penalty', 'loss', 'dual', 'tol', 'C', 'multi_class', 'fit_intercept',
+        'intercept_scaling', 'class_weight', 'verbose', 'random_state',
+        'max_iter'
+    ],
+    'DecisionTreeClassifier': [
+        'criterion', 'splitter', 'max_depth', 'min_samples_split',
+        'min_samples_leaf', 'min_weight_fraction_leaf', 'max_features',
+        'random_state', 'max_leaf_nodes', 'min_impurity_decrease',
+        'min_impurity_split', 'class_weight', 'presort'
+    ],
+    'RandomForestClassifier': [
+        'n_estimators', 'criterion', 'max_depth', 'min_samples_split',
+        'min_samples_leaf', 'min_weight_fraction_leaf', 'max_features',
+        'max_leaf_nodes', 'min_impurity_decrease', 'min_impurity_split',
+        'bootstrap', 'oob_score', 'n_jobs', 'random_state', 'verbose',
+        'warm_start', 'class_weight'
+    ],
+    'AdaBoostClassifier': [
+        'base_estimator', 'n_estimators', 'learning_rate', 'algorithm',
+        'random_state'
+    ],
+    'GaussianNB': ['priors'],
+    'LinearDiscriminantAnalysis': [
+        'solver', 'shrinkage', 'priors', 'n_components', 'store_covariance',
+        'tol'
+    ],
+    'QuadraticDiscriminantAnalysis': [
+        'priors', 'reg_param', 'store_covariance', 'tol', 'store_covariances'
+    ],
+    'MLPClassifier': [
+        'hidden_layer_sizes', 'activation', 'solver', 'alpha', 'batch_size',
+        'learning_rate', 'learning_rate_init', 'power_t', 'max_iter',
+        'shuffle', 'random_state', 'tol', 'verbose', 'warm_start', 'momentum',
+        'nesterovs_momentum', 'early_stopping', 'validation_fraction',
+        'beta_1', 'beta_2', 'epsilon'
+    ],
+    'KernelSVC': [
+        'kernel', 'degree', 'gamma', 'coef0', 'C', 'tol', 'cache_size',
+        'class_weight', 'max_iter'
+    ]
+}
+
+
+def classifier_module_names():
+    """Returns the names of the modules classifiers are imported from, which
+    PyInstaller can't find by itself."""
+
+    names = set()
+    for factories in (classifiers_by_name, kernel_classifiers_by_name):
+        for factory in factories.values():
+            module_name = factory.args[0]
+            if module_name.startswith('.'):
+                module_name = __package__ + module_name
+            names.add(module_name)
+    return sorted(names)
+
+
+def classifier_spec(spec):
+    """Returns a classifier given in job options (either a name or a dict
+    with a name and optionally params and a label) as a dict with all of
+    name, params and label."""
+
+    if isinstance(spec, six.string_types):
+        spec = {'name': spec}
+    return {
+        'name': spec['name'],
+        'params': spec.get('params', {}),
+        'label': spec.get('label', spec['name'])
+    }
+
+
+def _factory(spec, precomputed_kernels):
+    if precomputed_kernels and spec['name'] in kernel_classifiers_by_name:
+        return kernel_classifiers_by_name[spec['name']]
+    elif spec['name'] in classifiers_by_name:
+        return classifiers_by_name[spec['name']]
+    else:
+        raise ValueError("Unknown classifier '{}'".format(spec['name']))
+
+
+def check_classifier_spec(spec, precomputed_kernels=False):
+    """Raises ValueError if the spec's classifier or any of its params don't
+    exist, without importing scikit-learn."""
+
+    class_name = _factory(spec, precomputed_kernels).args[1]
+    unknown_params = sorted(set(spec['params']) -
+                            set(_class_params[class_name]))
+    if unknown_params:
+        raise ValueError('unknown parameters for {}: {}'.format(
+            class_name, ', '.join(unknown_params)
+        ))
+
+
+def classifier_factory(spec, precomputed_kernels=False, n_jobs=None):
+    """Returns a function creating the classifier for the given spec.
+    n_jobs is set for classifiers supporting it, unless the spec sets it."""
+
+    factory = _factory(spec, precomputed_kernels)
+    params = dict(spec['params'])
+    if (n_jobs is not None and 'n_jobs' not in params and
+            'n_jobs' in factory().get_params()):
+        params['n_jobs'] = n_jobs
+    # fails early if any params are invalid
+    factory(**params)
+    return partial(factory, **params)
@@ -0,0 +1,190 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import copy
+import numpy as np
+from six.moves import range
+
+
+# LinearPredictor only depends on numpy, so that loading a model using it
+#   doesn't import scikit-learn
+
+# models with more features than this (k-mers for large k) aren't compiled,
+#   since the weights take a row per feature and are found a few features at
+#   a time
+_max_compiled_features = 4**9
+
+
+def _softmax(scores):
+    exp_scores = np.exp(scores - scores.max(axis=1)[:, np.newaxis])
+    return exp_scores / exp_scores.sum(axis=1)[:, np.newaxis]
+
+
+def _expit(scores):
+    # like scipy.special.expit, without overflow warnings
+    result = np.empty_like(scores)
+    positive = scores >= 0
+    result[positive] = 1 / (1 + np.exp(-scores[positive]))
+    exp_scores = np.exp(scores[~positive])
+    result[~positive] = exp_scores / (1 + exp_scores)
+    return result
+
+
+class LinearPredictor(object):
+    """A classifier computing scores as a single affine function of its
+    input, which can replace a pipeline of affine transformations followed
+    by a linear classifier.
+    decision is how scores give classes: 'binary' (one score, positive for
+    the second class), 'argmax' (one score per class) or 'ovo' (one score per
+    pair of classes, as in SVC). proba is how scores give probabilities:
+    None (not supported), 'ovr' or 'softmax'."""
+
+    def __init__(self, weights, bias, classes, decision, proba=None):
+        self.weights = weights
+        self.bias = bias
+        self.classes_ = classes
+        self.decision = decision
+        self.proba = proba
+
+    def decision_function(self, X):
+        # works for both dense and sparse X
+        return X.dot(self.weights) + self.bias
+
+    def predict(self, X):
+        scores = self.decision_function(X)
+        if self.decision == 'binary':
+            class_indexes = (scores[:, 0] > 0).astype(int)
+        elif self.decision == 'argmax':
+            class_indexes = scores.argmax(axis=1)
+        elif self.decision == 'ovo':
+            # same voting as libsvm, ties going to the first class
+            num_classes = len(self.classes_)
+            votes = np.zeros((scores.shape[0], num_classes), dtype=int)
+            pair_index = 0
+            for i in range(num_classes):
+                for j in range(i + 1, num_classes):
+                    positive = scores[:, pair_index] > 0
+                    votes[positive, i] += 1
+                    votes[~positive, j] += 1
+                    pair_index += 1
+            class_indexes = votes.argmax(axis=1)
+        return self.classes_[class_indexes]
+
+    @property
+    def predict_proba(self):
+        # so hasattr works like for scikit-learn classifiers
+        if self.proba is None:
+            raise AttributeError('probabilities are not available')
+        return self._predict_proba
+
+    def _predict_proba(self, X):
+        scores = self.decision_function(X)
+        if self.decision == 'binary':
+            if self.proba == 'softmax':
+                return _softmax(np.hstack([-scores, scores]))
+            positive = _expit(scores[:, 0])
+            return np.column_stack([1 - positive, positive])
+        elif self.proba == 'softmax':
+            return _softmax(scores)
+        else:
+            probs = _expit(scores)
+            return probs / probs.sum(axis=1)[:, np.newaxis]
+
+
+def _linear_scores(classifier):
+    # returns a function computing linear scores from the classifier's
+    #   input, and how they give classes, or None if there isn't one
+    from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+    from sklearn.linear_model import LogisticRegression, SGDClassifier
+    from sklearn.neighbors.nearest_centroid import NearestCentroid
+    from sklearn.svm import SVC, LinearSVC
+    from sklearn.utils.extmath import row_norms, safe_sparse_dot
+
+    from ._kernels import KernelSVC
+
+    num_classes = len(classifier.classes_)
+    if isinstance(classifier, (SVC, KernelSVC)):
+        if classifier.kernel != 'linear':
+            return None
+
+        # pairwise decision values are linear, but the default ones aren't
+        if isinstance(classifier, KernelSVC):
+            svc = copy.copy(classifier.svc_)
+            ovo_classifier = copy.copy(classifier)
+            ovo_classifier.svc_ = svc
+        else:
+            svc = ovo_classifier = copy.copy(classifier)
+        svc.decision_function_shape = 'ovo'
+        return (ovo_classifier.decision_function,
+                'ovo' if num_classes > 2 else 'binary')
+    elif isinstance(classifier, NearestCentroid):
+        if classifier.metric != 'euclidean':
+            return None
+
+        # the nearest centroid has the largest 2<x, c> - |c|^2
+        centroids = classifier.centroids_
+        sq_norms = row_norms(centroids, squared=True)
+        return (lambda X: 2 * safe_sparse_dot(X, centroids.T) - sq_norms,
+                'argmax')
+    elif isinstance(classifier, (LogisticRegression, SGDClassifier,
+                                 LinearSVC, LinearDiscriminantAnalysis)):
+        return (classifier.decision_function,
+                'binary' if num_classes == 2 else 'argmax')
+    else:
+        return None
+
+
+def compile_pipeline(pipeline, check_features):
+    """Returns a LinearPredictor equivalent to the given pipeline of affine
+    transformations ending in a linear classifier, or None if there isn't
+    one. The LinearPredictor is checked to give the same results as the
+    pipeline on check_features."""
+
+    import scipy.sparse as sparse
+
+    if check_features.shape[1] > _max_compiled_features:
+        return None
+    classifier = pipeline.steps[-1][1]
+    linear_scores = _linear_scores(classifier)
+    if linear_scores is None:
+        return None
+    scores_func, decision = linear_scores
+
+    def scores(X):
+        for _, step in pipeline.steps[:-1]:
+            X = step.transform(X)
+        if sparse.issparse(X):
+            X = X.toarray()
+        result = scores_func(X)
+        return result.reshape(result.shape[0], -1)
+
+    # since the whole pipeline is affine, the scores of the zero vector give
+    #   the bias, and those of each basis vector the weights
+    num_features = check_features.shape[1]
+    try:
+        bias = scores(np.zeros((1, num_features)))[0]
+        weights = np.empty((num_features, len(bias)))
+        batch_size = max(1, 2**22 // num_features)
+        for start in range(0, num_features, batch_size):
+            end = min(start + batch_size, num_features)
+            basis = sparse.eye(end - start, num_features, k=start,
+                               format='csr')
+            weights[start:end] = scores(basis) - bias
+    except (TypeError, ValueError):
+        # some steps don't accept sparse input
+        return None
+
+    compiled = LinearPredictor(weights, bias, classifier.classes_, decision)
+    if not np.array_equal(compiled.predict(check_features),
+                          pipeline.predict(check_features)):
+        return None
+    if hasattr(pipeline, 'predict_proba'):
+        expected_probs = pipeline.predict_proba(check_features)
+        for proba in ['ovr', 'softmax']:
+            compiled.proba = proba
+            if np.allclose(compiled.predict_proba(check_features),
+                           expected_probs, rtol=1e-4, atol=1e-6):
+                break
+        else:
+            return None
+
+    return compiled
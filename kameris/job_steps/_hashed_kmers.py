@@ -0,0 +1,109 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+
+from . import _cgr
+
+
+# k-mer features for values of k too large for CGRs: each k-mer is hashed to
+#   one of a fixed number of buckets, so memory and time don't depend on k
+# k-mers are packed two bits per letter in the same letter order as CGRs,
+#   which fits k up to 32 in 64 bits, and k-mers with letters other than
+#   ACGT are skipped
+
+_mix_multipliers = (np.uint64(0xbf58476d1ce4e5b9),
+                    np.uint64(0x94d049bb133111eb))
+
+
+def _packed_kmers(codes, k):
+    # builds windows of each power of 2 letters from windows of half as
+    #   many, and joins those making up k, so that this takes log(k) passes
+    packed = np.zeros(max(len(codes) - k + 1, 0), dtype=np.uint64)
+    windows = codes.astype(np.uint64)
+    size = 1
+    done = 0
+    while done < k:
+        if k & size:
+            packed |= windows[done:done+len(packed)] << np.uint64(2 * done)
+            done += size
+        if done < k:
+            windows = windows[:-size] | (windows[size:] << np.uint64(2 * size))
+            size *= 2
+    return packed
+
+
+def _mix(values):
+    # the splitmix64 finalizer, so that similar k-mers land in unrelated
+    #   buckets
+    values = values ^ (values >> np.uint64(30))
+    values *= _mix_multipliers[0]
+    values ^= values >> np.uint64(27)
+    values *= _mix_multipliers[1]
+    return values ^ (values >> np.uint64(31))
+
+
+def kmer_hashes(codes, k, canonical=False):
+    """Returns a 64-bit hash of each k-mer without other letters than ACGT in
+    a sequence given by its letter codes. If canonical is True, k-mers and
+    their reverse complements have the same hash."""
+
+    invalid = codes == _cgr._invalid_code
+    codes = np.where(invalid, 0, codes)
+    kmers = _packed_kmers(codes, k)
+    if canonical:
+        # complementing swaps C with G and A with T, whose codes differ in
+        #   the low bit
+        kmers = np.minimum(kmers, _packed_kmers((codes ^ 1)[::-1], k)[::-1])
+
+    num_invalid = np.concatenate([[0], np.cumsum(invalid)])
+    valid = num_invalid[k:] == num_invalid[:len(kmers)]
+    return _mix(kmers[valid])
+
+
+def kmer_buckets(codes, k, num_buckets, canonical=False):
+    """Returns the bucket of each k-mer of a sequence, as for kmer_hashes."""
+
+    return (kmer_hashes(codes, k, canonical) %
+            np.uint64(num_buckets)).astype(np.int64)
+
+
+def hashed_counts(sequences_codes, k, num_buckets, canonical=False,
+                  sparse_output=False):
+    """Returns the number of k-mers in each bucket for sequences given by
+    their letter codes, as a matrix with one row per sequence (CSR if
+    sparse_output is True)."""
+
+    buckets = [kmer_buckets(codes, k, num_buckets, canonical)
+               for codes in sequences_codes]
+    rows = np.repeat(np.arange(len(buckets)), [len(b) for b in buckets])
+    cells = (rows * num_buckets +
+             np.concatenate([np.zeros(0, dtype=np.int64)] + buckets))
+
+    if not sparse_output:
+        counts = np.bincount(cells, minlength=len(buckets) * num_buckets)
+        return counts.astype(np.uint32).reshape(len(buckets), num_buckets)
+
+    import scipy.sparse as sparse
+
+    cells, counts = np.unique(cells, return_counts=True)
+    indptr = np.searchsorted(cells // num_buckets,
+                             np.arange(len(buckets) + 1))
+    return sparse.csr_matrix((counts.astype(np.uint32),
+                              cells % num_buckets, indptr),
+                             shape=(len(buckets), num_buckets))
+
+
+def iter_hashed_counts(filenames, k, num_buckets, canonical=False, n_jobs=1,
+                       sparse_output=False):
+    """Yields the hashed_counts of files, in order, as matrices with one row
+    per file. Files are processed in batches, by n_jobs threads."""
+
+    def batch_counts(batch):
+        return hashed_counts([_cgr.read_sequence(f) for f in batch], k,
+                             num_buckets, canonical, sparse_output)
+
+    return _cgr.map_file_batches(
+        batch_counts, filenames,
+        _cgr.max_batch_size(k, sparse_output, num_features=num_buckets),
+        n_jobs
+    )
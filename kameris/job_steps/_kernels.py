@@ -0,0 +1,94 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.svm import SVC
+from sklearn.utils.extmath import row_norms, safe_sparse_dot
+
+
+class InnerProducts(object):
+    """The inner products between the rows of a feature matrix and the rows
+    of another one (by default, itself), from which any of the SVM kernels
+    can be derived element-wise."""
+
+    def __init__(self, rows, columns=None):
+        if columns is None:
+            columns = rows
+        self.columns = columns
+        self.num_dims = rows.shape[1]
+        self.products = safe_sparse_dot(rows, columns.T, dense_output=True)
+        self.row_sq_norms = row_norms(rows, squared=True)
+        self.column_sq_norms = (self.row_sq_norms if columns is rows
+                                else row_norms(columns, squared=True))
+
+    def kernel(self, kernel, degree, gamma, coef0):
+        if kernel == 'linear':
+            return self.products
+        elif kernel == 'poly':
+            return (gamma * self.products + coef0) ** degree
+        elif kernel == 'rbf':
+            sq_dists = (self.row_sq_norms[:, np.newaxis] +
+                        self.column_sq_norms[np.newaxis, :] -
+                        2 * self.products)
+            return np.exp(-gamma * np.maximum(sq_dists, 0))
+        else:
+            raise ValueError("Unknown kernel '{}'".format(kernel))
+
+
+class KernelSVC(BaseEstimator, ClassifierMixin):
+    """An SVC with a linear, polynomial or RBF kernel, which can be fit and
+    evaluated on InnerProducts so that SVCs with different kernels can share
+    them. It can also be used on plain features like a normal SVC.
+    Defaults are the same as SVC's."""
+
+    def __init__(self, kernel='rbf', degree=3, gamma=None, coef0=0.0, C=1.0,
+                 tol=1e-3, cache_size=200, class_weight=None, max_iter=-1):
+        self.kernel = kernel
+        self.degree = degree
+        self.gamma = gamma
+        self.coef0 = coef0
+        self.C = C
+        self.tol = tol
+        self.cache_size = cache_size
+        self.class_weight = class_weight
+        self.max_iter = max_iter
+
+    def _kernel(self, inner_products):
+        return inner_products.kernel(self.kernel, self.degree, self.gamma_,
+                                     self.coef0)
+
+    def fit(self, X, y):
+        if not isinstance(X, InnerProducts):
+            X = InnerProducts(X)
+        self.gamma_ = (1 / X.num_dims if self.gamma in {None, 'auto'}
+                       else self.gamma)
+
+        self.svc_ = SVC(kernel='precomputed', C=self.C, tol=self.tol,
+                        cache_size=self.cache_size,
+                        class_weight=self.class_weight,
+                        max_iter=self.max_iter)
+        self.svc_.fit(self._kernel(X), y)
+        self.classes_ = self.svc_.classes_
+        self.num_train_points_ = X.products.shape[0]
+        # only the support vectors are needed to evaluate the kernel later
+        self.support_vectors_ = X.columns[self.svc_.support_]
+        return self
+
+    def _test_kernel(self, X):
+        if isinstance(X, InnerProducts):
+            return self._kernel(X)
+
+        # the SVC expects a column for every training point, but only those
+        #   of the support vectors are used
+        kernel = np.zeros((X.shape[0], self.num_train_points_))
+        kernel[:, self.svc_.support_] = self._kernel(
+            InnerProducts(X, self.support_vectors_)
+        )
+        return kernel
+
+    def decision_function(self, X):
+        return self.svc_.decision_function(self._test_kernel(X))
+
+    def predict(self, X):
+        return self.svc_.predict(self._test_kernel(X))
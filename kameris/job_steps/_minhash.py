@@ -0,0 +1,93 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+import scipy.sparse as sparse
+from six.moves import range
+
+from . import _hashed_kmers
+from ..utils import process_utils
+
+
+# MinHash sketches for approximate distances between sequences, using one
+#   permutation hashing: the hash of each canonical k-mer picks a bin of the
+#   sketch, and each bin keeps the smallest hash falling in it
+# the Jaccard index of the k-mers of two sequences is estimated as the
+#   fraction of bins, among those not empty in both, with the same hash, and
+#   gives their Mash distance
+
+_empty = np.uint64(2**64 - 1)
+
+# limit on the number of distances computed at once
+_max_block_dists = 2**22
+
+
+def sketch(codes, k, size):
+    """Returns the MinHash sketch with size bins of a sequence given by its
+    letter codes, with empty bins set to the largest 64-bit value."""
+
+    hashes = np.unique(_hashed_kmers.kmer_hashes(codes, k, canonical=True))
+    bins = (hashes % np.uint64(size)).astype(np.int64)
+    # hashes are sorted, so the first one in each bin is its smallest
+    filled_bins, first_indexes = np.unique(bins, return_index=True)
+    result = np.full(size, _empty, dtype=np.uint64)
+    result[filled_bins] = hashes[first_indexes]
+    return result
+
+
+def _encode(sketches):
+    # encodes each sketch as a row of indicators of its (bin, hash) pairs and
+    #   another of its empty bins, so that the number of bins where two
+    #   sketches have the same hash, or are both empty, is a product of rows
+    num_sketches, size = sketches.shape
+    columns = np.empty(sketches.shape, dtype=np.int64)
+    num_columns = 0
+    for i in range(size):
+        values, columns[:, i] = np.unique(sketches[:, i], return_inverse=True)
+        columns[:, i] += num_columns
+        num_columns += len(values)
+
+    empty = sketches == _empty
+    rows = np.repeat(np.arange(num_sketches), size).reshape(sketches.shape)
+    matches = sparse.csr_matrix((
+        np.ones(np.count_nonzero(~empty), dtype=np.int32),
+        (rows[~empty], columns[~empty])
+    ), shape=(num_sketches, num_columns))
+    empties = sparse.csr_matrix(empty.astype(np.int32))
+    return matches, empties
+
+
+def _mash_distances(matches, empties, rows, columns, size, k):
+    shared = matches[rows].dot(matches[columns].T).toarray()
+    both_empty = empties[rows].dot(empties[columns].T).toarray()
+    jaccard = shared / np.maximum(size - both_empty, 1)
+    # distances are capped at 1, the distance of sequences sharing nothing
+    with np.errstate(divide='ignore'):
+        dists = -np.log(2 * jaccard / (1 + jaccard)) / k
+    return np.minimum(dists, 1).astype(np.float32)
+
+
+def iter_distance_rows(sketches, k, pool=None, max_pending=1):
+    """Yields, for each sketch in order, its Mash distances (as float32) to
+    the sketches after it, estimated from MinHash sketches of k-mers. Rows
+    are computed in blocks, in parallel if a thread pool is given."""
+
+    num_sketches, size = sketches.shape
+    matches, empties = _encode(sketches)
+    block_size = max(1, _max_block_dists // max(num_sketches, 1))
+    blocks = (slice(start, min(start + block_size, num_sketches))
+              for start in range(0, num_sketches, block_size))
+
+    def block_distances(rows):
+        # only the part of the matrix above the diagonal is needed
+        return rows.start, _mash_distances(
+            matches, empties, rows, slice(rows.start, None), size, k
+        )
+
+    if pool is not None:
+        results = process_utils.ordered_results(pool, block_distances,
+                                                blocks, max_pending)
+    else:
+        results = (block_distances(rows) for rows in blocks)
+    for start, dists in results:
+        for i, row in enumerate(dists):
+            yield row[i+1:]
@@ -0,0 +1,20 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+
+from sklearn.base import BaseEstimator, TransformerMixin
+
+
+class AsType(BaseEstimator, TransformerMixin):
+    """Casts features to the given dtype, without copying if they already
+    have it."""
+
+    def __init__(self, dtype='float32'):
+        self.dtype = dtype
+
+    def fit(self, X, y=None):
+        self.dtype_ = np.dtype(self.dtype)
+        return self
+
+    def transform(self, X):
+        return X.astype(self.dtype_, copy=False)
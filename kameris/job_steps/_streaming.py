@@ -0,0 +1,145 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+import scipy.sparse as sparse
+from six.moves import range
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import Pipeline
+from sklearn.utils.extmath import svd_flip
+
+
+# limit on the memory taken by the rows densified at once to update an
+#   IncrementalTruncatedSVD, as float64
+_max_dense_bytes = 2**27
+
+
+class BatchedRows(object):
+    """Some rows of a feature matrix, which are read (and normalized, if a
+    normalizer is given) a batch at a time instead of all at once.
+    Only the row indexes are stored, so instances are cheap to pickle."""
+
+    def __init__(self, indexes, batch_size, normalizer=None, columns=None):
+        self.indexes = np.asarray(indexes)
+        self.normalizer = normalizer
+        self.columns = columns
+
+        # near-equal batches, none smaller than batch_size (if possible)
+        num_batches = max(1, len(self.indexes) // batch_size)
+        self.batch_positions = np.array_split(
+            np.arange(len(self.indexes)), num_batches
+        )
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def batches(self, features, shuffle=False):
+        """Yields (positions, rows) for each batch, where positions are
+        indexes into self.indexes."""
+
+        order = range(len(self.batch_positions))
+        if shuffle:
+            order = np.random.permutation(len(self.batch_positions))
+
+        for i in order:
+            positions = self.batch_positions[i]
+            rows = features[self.indexes[positions]]
+            if self.columns is not None:
+                rows = rows[:, self.columns]
+            if self.normalizer is not None:
+                rows = self.normalizer.transform(rows)
+            yield positions, rows
+
+
+class IncrementalTruncatedSVD(BaseEstimator, TransformerMixin):
+    """Like TruncatedSVD, so without centering the data, but fitted a batch
+    at a time by keeping only the top singular vectors of the data seen so
+    far, which approximates the exact decomposition. Batches may be sparse,
+    and are densified a bounded number of rows at a time."""
+
+    def __init__(self, n_components=2):
+        self.n_components = n_components
+
+    def fit(self, X, y=None):
+        for attr in ('components_', 'singular_values_', 'n_samples_seen_'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+        return self.partial_fit(X)
+
+    def partial_fit(self, X, y=None):
+        if not hasattr(self, 'components_'):
+            self.components_ = np.zeros((0, X.shape[1]))
+            self.singular_values_ = np.zeros(0)
+            self.n_samples_seen_ = 0
+            self._sums = np.zeros(X.shape[1])
+            self._squares = np.zeros(X.shape[1])
+
+        chunk_size = max(1, _max_dense_bytes // (8 * X.shape[1]))
+        for start in range(0, X.shape[0], chunk_size):
+            chunk = X[start:start+chunk_size]
+            chunk = (chunk.toarray() if sparse.issparse(chunk) else
+                     np.asarray(chunk)).astype(np.float64)
+            self._sums += chunk.sum(axis=0)
+            self._squares += np.einsum('ij,ij->j', chunk, chunk)
+            self.n_samples_seen_ += chunk.shape[0]
+
+            # the previous components scaled by their singular values stand
+            #   in for all the data seen before
+            U, S, V = np.linalg.svd(np.vstack([
+                self.singular_values_[:, np.newaxis] * self.components_,
+                chunk
+            ]), full_matrices=False)
+            U, V = svd_flip(U, V, u_based_decision=False)
+            self.components_ = V[:self.n_components]
+            self.singular_values_ = S[:self.n_components]
+
+        # the variance of the projections, as in TruncatedSVD
+        mean = self._sums / self.n_samples_seen_
+        total_var = np.sum(self._squares / self.n_samples_seen_ - mean**2)
+        self.explained_variance_ = (
+            self.singular_values_**2 / self.n_samples_seen_ -
+            self.components_.dot(mean)**2
+        )
+        self.explained_variance_ratio_ = self.explained_variance_ / total_var
+        return self
+
+    def transform(self, X):
+        return X.dot(self.components_.T)
+
+
+def fit_normalizer(features, rows, normalizers):
+    """Fits the given (name, step) normalizers one batch at a time, with a
+    pass over the data for each step that learns from it, since the steps
+    before it have to be complete first."""
+
+    fitted = []
+    for name, step in normalizers:
+        if hasattr(step, 'partial_fit'):
+            for _, batch in rows.batches(features):
+                if fitted:
+                    batch = Pipeline(fitted).transform(batch)
+                step.partial_fit(batch)
+        else:
+            # other steps don't learn anything from the data
+            _, batch = next(rows.batches(features))
+            step.fit(Pipeline(fitted).transform(batch) if fitted else batch)
+        fitted.append((name, step))
+
+    return Pipeline(fitted)
+
+
+def partial_fit(classifier, features, rows, classes, epochs):
+    if not hasattr(classifier, 'partial_fit'):
+        raise RuntimeError('{} does not support streaming training'
+                           .format(type(classifier).__name__))
+
+    all_classes = np.unique(classes)
+    for _ in range(epochs):
+        for positions, batch in rows.batches(features, shuffle=True):
+            classifier.partial_fit(batch, classes[positions],
+                                   classes=all_classes)
+
+
+def predict(method, features, rows):
+    return np.concatenate([method(batch) for _, batch
+                           in rows.batches(features)])
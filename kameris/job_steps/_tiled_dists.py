@@ -0,0 +1,261 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import kameris_formats
+import multiprocessing
+import numpy as np
+import os
+import scipy.sparse as sparse
+import shutil
+from six.moves import range
+import timeit
+
+from . import _checkpoints
+from ..utils import file_formats, fs_utils
+
+
+# distances between the vectors of an mm-repr file, computed in square tiles
+#   of the upper triangle of the matrix, each from a single matrix product of
+#   two blocks of rows, so that only those blocks need to be in memory
+# tiles are written straight into memory-mapped mm-dist files, and finished
+#   ones are recorded so that an interrupted run can resume
+
+metrics = ('euclid', 'cosine', 'correlation')
+
+# limit on the memory taken by the two blocks of rows of a tile, as float64
+_max_tile_bytes = 2**28
+_max_tile_size = 2048
+
+# minimum number of seconds between saves of the finished tiles
+_checkpoint_interval = 10
+
+_value_type = np.dtype('<f4')
+
+# the header is the signature b'MMDIST\0', the value type and the size
+_dist_header_size = 16
+
+
+def default_tile_size(reader):
+    if reader.is_sparse:
+        # an index and a value per entry
+        row_size = 2 * max(reader.indptr[-1] / max(reader.count, 1), 1)
+    else:
+        row_size = reader.num_cols
+    return int(max(1, min(_max_tile_size,
+                          _max_tile_bytes // (2 * 8 * row_size))))
+
+
+def _float_rows(reader, start, stop):
+    return reader.rows(start, stop).astype(np.float64)
+
+
+def _row_stats(reader, chunk_size):
+    # the sum and sum of squares of each vector, which with the products of
+    #   vectors give all the metrics
+    sums = np.empty(reader.count)
+    squares = np.empty(reader.count)
+    for start in range(0, reader.count, chunk_size):
+        stop = min(start + chunk_size, reader.count)
+        rows = _float_rows(reader, start, stop)
+        if sparse.issparse(rows):
+            sums[start:stop] = np.asarray(rows.sum(axis=1)).ravel()
+            squares[start:stop] = np.asarray(
+                rows.multiply(rows).sum(axis=1)
+            ).ravel()
+        else:
+            sums[start:stop] = rows.sum(axis=1)
+            squares[start:stop] = np.einsum('ij,ij->i', rows, rows)
+    return sums, squares
+
+
+def _similarities(products, row_norms, col_norms):
+    # vectors of norm 0 are taken to be unrelated to all others
+    denominators = np.sqrt(np.outer(row_norms, col_norms))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(denominators > 0, products / denominators, 0)
+    return np.clip(result, -1, 1)
+
+
+def tile_distances(rows, columns, row_stats, col_stats, num_cols,
+                   metric_names):
+    """Returns a dict of the matrices of distances between two blocks of
+    vectors (as float64, dense or CSR) for each metric, given the sums and
+    sums of squares of the vectors as returned by _row_stats."""
+
+    products = rows.dot(columns.T)
+    if sparse.issparse(products):
+        products = products.toarray()
+    (row_sums, row_squares), (col_sums, col_squares) = row_stats, col_stats
+
+    results = {}
+    for metric in metric_names:
+        if metric == 'euclid':
+            squared = (row_squares[:, np.newaxis] +
+                       col_squares[np.newaxis, :] - 2 * products)
+            results[metric] = np.sqrt(np.maximum(squared, 0))
+        elif metric == 'cosine':
+            results[metric] = 1 - _similarities(products, row_squares,
+                                                col_squares)
+        elif metric == 'correlation':
+            # products and norms of the vectors minus their means
+            centered = products - np.outer(row_sums, col_sums) / num_cols
+            results[metric] = 1 - _similarities(
+                centered, row_squares - row_sums**2 / num_cols,
+                col_squares - col_sums**2 / num_cols
+            )
+        else:
+            raise ValueError('unknown metric ' + metric)
+    return results
+
+
+def _row_offset(row, size):
+    # where the distances after the diagonal of a row start in the upper
+    #   triangle stored by mm-dist files
+    return row * (size - 1) - row * (row - 1) // 2
+
+
+def _write_tile(output, dists, row_start, col_start, size):
+    for i in range(dists.shape[0]):
+        row = row_start + i
+        first = max(col_start, row + 1)
+        values = dists[i, first - col_start:]
+        if len(values):
+            offset = _row_offset(row, size) + first - row - 1
+            output[offset:offset+len(values)] = values
+
+
+def _create_output(filename, size):
+    # the writer only uses the matrix for its shape and type
+    matrix_type = np.broadcast_to(np.zeros(1, dtype=_value_type),
+                                  (size, size))
+    writer = kameris_formats.dist_writer(filename, matrix_type,
+                                         create_file=True)
+    with writer.file:
+        writer.file.truncate(writer.file.tell() + _value_type.itemsize *
+                             size * (size - 1) // 2)
+
+
+def _open_output(filename, size):
+    num_values = size * (size - 1) // 2
+    if os.path.getsize(filename) != (_dist_header_size +
+                                     _value_type.itemsize * num_values):
+        raise ValueError('wrong size for ' + filename)
+    # files with no distances can't be memory-mapped
+    if not num_values:
+        return np.zeros(0, dtype=_value_type)
+    return np.memmap(filename, dtype=_value_type, mode='r+',
+                     offset=_dist_header_size, shape=(num_values,))
+
+
+# state of each worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(input_file, output_files, stats, tile_size):
+    reader = file_formats.ReprRowsReader(input_file)
+    _worker.update({
+        'reader': reader,
+        'outputs': {metric: _open_output(filename, reader.count)
+                    for metric, filename in output_files.items()},
+        'stats': stats,
+        'tile_size': tile_size
+    })
+
+
+def _run_tile(tile):
+    index, row_block, col_block = tile
+    reader = _worker['reader']
+    tile_size = _worker['tile_size']
+    sums, squares = _worker['stats']
+
+    row_slice = slice(row_block * tile_size,
+                      min((row_block + 1) * tile_size, reader.count))
+    col_slice = slice(col_block * tile_size,
+                      min((col_block + 1) * tile_size, reader.count))
+    rows = _float_rows(reader, row_slice.start, row_slice.stop)
+    columns = (rows if col_slice == row_slice else
+               _float_rows(reader, col_slice.start, col_slice.stop))
+    results = tile_distances(
+        rows, columns, (sums[row_slice], squares[row_slice]),
+        (sums[col_slice], squares[col_slice]), reader.num_cols,
+        _worker['outputs'].keys()
+    )
+
+    for metric, output in _worker['outputs'].items():
+        _write_tile(output, results[metric].astype(_value_type),
+                    row_slice.start, col_slice.start, reader.count)
+        # the tile only counts as finished once it is written
+        if isinstance(output, np.memmap):
+            output.flush()
+    return index
+
+
+def compute_distances(input_file, output_files, tile_size=None, n_jobs=1,
+                      checkpoints_dir=None):
+    """Computes the distances between the vectors of an mm-repr file, dense
+    or sparse, for each metric in output_files, a dict of mm-dist files (of
+    float32 values) by metric. Tiles of tile_size by tile_size distances are
+    computed by n_jobs processes.
+    If checkpoints_dir is given, finished tiles are recorded there, so that
+    running again with the same input resumes from the unfinished ones."""
+
+    reader = file_formats.ReprRowsReader(input_file)
+    size = reader.count
+    if tile_size is None:
+        tile_size = default_tile_size(reader)
+    num_blocks = -(-size // tile_size)
+    tiles = [(i, j) for i in range(num_blocks) for j in range(i, num_blocks)]
+
+    # results are written to partial files, renamed when they are finished
+    partial_files = {metric: filename + '.partial'
+                     for metric, filename in output_files.items()}
+    done = set()
+    checkpoints = None
+    if checkpoints_dir:
+        checkpoints = _checkpoints.Checkpoints(checkpoints_dir, {
+            'input_sha1': _checkpoints.file_sha1(input_file),
+            'metrics': sorted(output_files),
+            'tile_size': tile_size
+        })
+        done = set(checkpoints.load('tiles') or [])
+    if done:
+        try:
+            for filename in partial_files.values():
+                _open_output(filename, size)
+        except (IOError, OSError, ValueError):
+            done = set()
+    if not done:
+        for filename in partial_files.values():
+            _create_output(filename, size)
+
+    stats = _row_stats(reader, tile_size)
+    pending = [(index, i, j) for index, (i, j) in enumerate(tiles)
+               if index not in done]
+    worker_args = (input_file, partial_files, stats, tile_size)
+    pool = None
+    if n_jobs > 1 and len(pending) > 1:
+        pool = multiprocessing.Pool(n_jobs, _init_worker, worker_args)
+        results = pool.imap_unordered(_run_tile, pending)
+    else:
+        _init_worker(*worker_args)
+        results = (_run_tile(tile) for tile in pending)
+
+    try:
+        last_save = timeit.default_timer()
+        for index in results:
+            done.add(index)
+            if (checkpoints and timeit.default_timer() - last_save >=
+                    _checkpoint_interval):
+                checkpoints.save('tiles', sorted(done))
+                last_save = timeit.default_timer()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        else:
+            _worker.clear()
+        if checkpoints and len(done) < len(tiles):
+            checkpoints.save('tiles', sorted(done))
+
+    for metric, filename in output_files.items():
+        fs_utils.replace_file(partial_files[metric], filename)
+    if checkpoints_dir:
+        shutil.rmtree(checkpoints_dir, ignore_errors=True)
@@ -1,16 +1,29 @@
 from __future__ import absolute_import, division, unicode_literals
 
+from backports import tempfile
+import collections
+import hashlib
+import json
 import kameris_formats
+import logging
+from multiprocessing.pool import ThreadPool
+import numpy as np
 import os
 import platform
-import x86cpu
+import scipy.sparse as sparse
+import shutil
+import six
 
-from . import _command
-from ..utils import job_utils
+from . import (_cgr, _cgr_cache, _checkpoints, _command, _hashed_kmers,
+               _minhash, _tiled_dists)
+from ..utils import file_formats, fs_utils, job_utils, process_utils
 from ..utils.platform_utils import platform_name
 
 
 def cpu_suffix(disable_avx):
+    # only needed to run the native binaries
+    import x86cpu
+
     if not disable_avx and x86cpu.cpuinfo.X86Info().supports_avx2:
         return 'avx2'
     else:
@@ -31,36 +44,544 @@ def binary_path(bin_name, disable_avx):
     ))
 
 
+def _value_type(options, k):
+    if options['mode'] in {'frequencies', 'hashed'}:
+        return _cgr.resolve_precision(options.get('precision', 'auto'), k)
+    else:
+        return 'uint16' if options['bits_per_element'] == 16 else 'uint32'
+
+
+def _run_numpy_kmers(options):
+    filenames = _cgr.fasta_files(options['fasta_output_dir'])
+    if not filenames:
+        raise Exception('no FASTA files found in ' +
+                        options['fasta_output_dir'])
+    value_type = _value_type(options, options['k'])
+    sparse_output = options.get('sparse', False)
+
+    with file_formats.ReprRowsWriter(options['output_file'], value_type,
+                                     4**options['k'], len(filenames),
+                                     sparse_output) as writer:
+        for cgrs in _cgr.iter_cgrs(filenames, options['k'],
+                                   options['bits_per_element'],
+                                   options.get('n_jobs', 1), sparse_output):
+            if options['mode'] == 'frequencies':
+                cgrs = _cgr.frequencies(cgrs, value_type)
+            writer.write(cgrs)
+
+
+def _run_hashed_kmers(options):
+    filenames = _cgr.fasta_files(options['fasta_output_dir'])
+    if not filenames:
+        raise Exception('no FASTA files found in ' +
+                        options['fasta_output_dir'])
+    value_type = _value_type(options, options['k'])
+    sparse_output = options.get('sparse', False)
+
+    with file_formats.ReprRowsWriter(options['output_file'], value_type,
+                                     options['num_buckets'], len(filenames),
+                                     sparse_output) as writer:
+        for counts in _hashed_kmers.iter_hashed_counts(
+                filenames, options['k'], options['num_buckets'],
+                options.get('canonical', False), options.get('n_jobs', 1),
+                sparse_output):
+            writer.write(_cgr.frequencies(counts, value_type))
+
+
+def _repr_writer(filename, value_type, rows, cols, count):
+    # the writer only uses the matrix for its shape and type
+    matrix_type = np.broadcast_to(np.zeros(1, dtype=value_type), (rows, cols))
+    return kameris_formats.repr_writer(filename, matrix_type, count,
+                                       create_file=True)
+
+
+def _shard_files(filenames, num_shards):
+    # splits files, keeping their order, into shards with about the same
+    #   total size, as a proxy for their number of bases
+    cumulative_sizes = np.cumsum([os.path.getsize(f) for f in filenames])
+    shards = []
+    start = 0
+    for i in range(1, num_shards):
+        target = cumulative_sizes[-1] * i / num_shards
+        # ends the shard after or before the file reaching the target,
+        #   whichever is closer to it
+        end = int(np.searchsorted(cumulative_sizes, target)) + 1
+        if (end > 1 and target - cumulative_sizes[end - 2] <
+                cumulative_sizes[end - 1] - target):
+            end -= 1
+        # every shard needs at least one file
+        end = min(max(end, start + 1), len(filenames) - (num_shards - i))
+        shards.append(filenames[start:end])
+        start = end
+    shards.append(filenames[start:])
+    return shards
+
+
+def _shard_cpus(num_shards):
+    # the binary starts a thread per CPU, so where supported (Linux) each
+    #   shard is restricted to its share of the CPUs to avoid oversubscribing
+    #   them
+    if not hasattr(os, 'sched_setaffinity'):
+        return [None] * num_shards
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < num_shards:
+        return [None] * num_shards
+    return [{int(c) for c in group}
+            for group in np.array_split(cpus, num_shards)]
+
+
+def _cgr_command(fasta_dir, output_file, options):
+    return '"{}" cgr "{}" "{}" {} {}'.format(
+        binary_path('generation_cgr', options['disable_avx']),
+        fasta_dir, output_file, options['k'], options['bits_per_element']
+    )
+
+
+def _run_sharded_kmers(options, num_shards):
+    filenames = _cgr.fasta_files(options['fasta_output_dir'])
+    if not filenames:
+        raise Exception('no FASTA files found in ' +
+                        options['fasta_output_dir'])
+    shards = _shard_files(filenames, min(num_shards, len(filenames)))
+    output_dir = os.path.dirname(os.path.abspath(options['output_file']))
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as temp_dir:
+        # link each shard's files into its own directory, with the same
+        #   names so the binary processes them in the same order
+        shard_outputs = []
+        commands = []
+        for i, shard in enumerate(shards):
+            shard_dir = os.path.join(temp_dir, 'shard{}'.format(i))
+            os.mkdir(shard_dir)
+            for filename in shard:
+                fs_utils.symlink(filename, os.path.join(
+                    shard_dir, os.path.basename(filename)
+                ))
+            shard_outputs.append(shard_dir + '.mm-repr')
+            commands.append(_cgr_command(shard_dir, shard_outputs[-1],
+                                         options))
+
+        def run_shard(args):
+            command, cpus = args
+            # on Linux this only restricts this thread, whose CPUs the
+            #   shard's process inherits
+            if cpus is not None:
+                os.sched_setaffinity(0, cpus)
+            _command.run_command_logged(command, shell=True)
+
+        pool = ThreadPool(len(shards))
+        try:
+            pool.map(run_shard, zip(commands, _shard_cpus(len(shards))))
+        finally:
+            pool.terminate()
+
+        # concatenate the shards' matrices, which follow their headers
+        reader = kameris_formats.repr_reader(shard_outputs[0])
+        reader.file.close()
+        writer = _repr_writer(options['output_file'], reader.value_type,
+                              reader.rows, reader.cols, len(filenames))
+        with writer.file:
+            for shard_output in shard_outputs:
+                shard_reader = kameris_formats.repr_reader(shard_output)
+                with shard_reader.file:
+                    shutil.copyfileobj(shard_reader.file, writer.file)
+
+
+def _rewrite_repr_file(filename, chunk_size, n_jobs, precision=None,
+                       sparse_output=False):
+    # converts CGR counts to frequencies (if precision is given) and/or to a
+    #   sparse file chunk by chunk, by n_jobs threads, into a temporary file
+    #   which then replaces the original, so memory use doesn't grow with the
+    #   number of CGRs
+    reader = kameris_formats.repr_reader(filename)
+    reader.file.close()
+
+    def convert(cgrs):
+        if sparse_output:
+            cgrs = sparse.csr_matrix(cgrs)
+        if precision is not None:
+            cgrs = _cgr.frequencies(cgrs, precision)
+        return cgrs
+
+    temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    pool = ThreadPool(n_jobs) if n_jobs > 1 else None
+    try:
+        with file_formats.ReprRowsWriter(
+                temp_filename, precision or reader.value_type,
+                int(reader.rows * reader.cols), reader.count,
+                sparse_output) as writer:
+            chunks = file_formats.iter_repr_chunks(filename, chunk_size)
+            if pool is not None:
+                chunks = process_utils.ordered_results(pool, convert,
+                                                       chunks, 2 * n_jobs)
+            else:
+                chunks = (convert(chunk) for chunk in chunks)
+            for chunk in chunks:
+                writer.write(chunk)
+        fs_utils.replace_file(temp_filename, filename)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+def _run_cached_kmers(options):
+    # only computes the CGRs of sequences whose counts aren't in the cache,
+    #   and then saves them there
+    cache_options = options['cgr_cache']
+    cache = _cgr_cache.CGRCache(cache_options['dir'],
+                                cache_options.get('max_size_mb', 10240) *
+                                1024**2)
+    k = options['k']
+    bits_per_element = options['bits_per_element']
+    filenames = _cgr.fasta_files(options['fasta_output_dir'])
+    if not filenames:
+        raise Exception('no FASTA files found in ' +
+                        options['fasta_output_dir'])
+    output_dir = os.path.dirname(os.path.abspath(options['output_file']))
+
+    with job_utils.log_step('looking up CGRs in the cache'):
+        keys = [_cgr_cache.sequence_key(_cgr.read_sequence(f))
+                for f in filenames]
+        cached = [cache.contains(key, k, bits_per_element) for key in keys]
+    misses = [f for f, is_cached in zip(filenames, cached) if not is_cached]
+    log = logging.getLogger('kameris')
+    log.info('CGR cache: %s of %s sequences found', len(filenames) -
+             len(misses), len(filenames))
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as temp_dir:
+        miss_cgrs = iter([])
+        if misses:
+            misses_dir = os.path.join(temp_dir, 'fasta')
+            os.mkdir(misses_dir)
+            for filename in misses:
+                fs_utils.symlink(filename, os.path.join(
+                    misses_dir, os.path.basename(filename)
+                ))
+            # the cache keeps sparse CGRs
+            misses_file = os.path.join(temp_dir, 'counts.mm-repr')
+            _run_kmers(dict(options, fasta_output_dir=misses_dir,
+                            output_file=misses_file, mode='counts',
+                            sparse=True, cgr_cache=None))
+            miss_cgrs = (chunk[i] for chunk in file_formats.iter_repr_chunks(
+                misses_file, _cgr.max_batch_size(k, sparse_output=True)
+            ) for i in range(chunk.shape[0]))
+
+        with job_utils.log_step('assembling CGRs'):
+            num_recomputed = 0
+            value_type = _value_type(options, k)
+            with file_formats.ReprRowsWriter(
+                    options['output_file'], value_type, 4**k,
+                    len(filenames), options.get('sparse', False)) as writer:
+                for filename, key, is_cached in zip(filenames, keys, cached):
+                    if is_cached:
+                        cgr = cache.load(key, k, bits_per_element)
+                        if cgr is None:
+                            # evicted since by another job, or unreadable
+                            num_recomputed += 1
+                            cgr = _cgr.cgr_counts([
+                                _cgr.read_sequence(filename)
+                            ], k, bits_per_element, sparse_output=True)
+                            cache.save(key, k, bits_per_element, cgr)
+                    else:
+                        cgr = next(miss_cgrs)
+                        cache.save(key, k, bits_per_element, cgr)
+                    if options['mode'] == 'frequencies':
+                        cgr = _cgr.frequencies(cgr, value_type)
+                    writer.write(cgr)
+            if num_recomputed:
+                log.info('CGR cache: recomputed %s sequences which could '
+                         'not be read from the cache', num_recomputed)
+
+    cache.evict()
+
+
+def _run_kmers(options):
+    if options['mode'] == 'hashed':
+        with job_utils.log_step('computing hashed k-mers'):
+            _run_hashed_kmers(options)
+        return
+
+    if options.get('cgr_cache'):
+        _run_cached_kmers(options)
+        return
+
+    if options.get('engine', 'native') == 'numpy':
+        with job_utils.log_step('computing CGRs'):
+            _run_numpy_kmers(options)
+        return
+
+    num_shards = options.get('shards', 1)
+    if num_shards > 1:
+        with job_utils.log_step('computing CGRs in {} shards'.format(
+                num_shards)):
+            _run_sharded_kmers(options, num_shards)
+    else:
+        _command.run_command_step({
+            'command': _cgr_command(options['fasta_output_dir'],
+                                    options['output_file'], options)
+        }, {})
+
+    # convert counts to frequencies and the binary's dense output to a
+    #   sparse file if desired
+    normalize = options['mode'] == 'frequencies'
+    sparse_output = options.get('sparse', False)
+    if normalize or sparse_output:
+        if not normalize:
+            step_name = 'converting CGRs to a sparse matrix'
+        elif sparse_output:
+            step_name = 'frequency-normalizing CGRs into a sparse matrix'
+        else:
+            step_name = 'frequency-normalizing CGRs'
+        with job_utils.log_step(step_name):
+            _rewrite_repr_file(
+                options['output_file'], _cgr.max_batch_size(options['k']),
+                options.get('n_jobs', 1),
+                _value_type(options, options['k']) if normalize else None,
+                sparse_output
+            )
+
+
+def _derived_filename(output_file, k):
+    # where CGRs derived for another experiment are kept until it runs
+    directory, name = os.path.split(output_file)
+    return os.path.join(directory, 'derived-k{}-{}'.format(k, name))
+
+
+def _sequences_sha1(fasta_dir):
+    digest = hashlib.sha1()
+    for filename in _cgr.fasta_files(fasta_dir):
+        digest.update(os.path.basename(filename).encode('utf-8') + b'\0')
+        digest.update(_checkpoints.file_sha1(filename).encode('ascii'))
+    return digest.hexdigest()
+
+
+def _derived_stamp(options, k, sequences_sha1):
+    # describes what CGRs derived for an experiment were computed from, so
+    #   that stale ones from an earlier run aren't used
+    return {
+        'k': k,
+        'mode': options['mode'],
+        'bits_per_element': options['bits_per_element'],
+        'value_type': str(np.dtype(_value_type(options, k))),
+        'sparse': options.get('sparse', False),
+        'sequences_sha1': sequences_sha1
+    }
+
+
+def _read_derived_stamp(derived_file):
+    try:
+        with open(derived_file + '.json', 'r') as infile:
+            return json.load(infile)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _run_derived_kmers(options, other_k_values):
+    # computes CGRs once at the largest value of k needed for this and other
+    #   experiments using the same sequences, and derives the others from
+    #   them
+    outputs = collections.defaultdict(list)
+    outputs[options['k']].append(options['output_file'])
+    for k in other_k_values:
+        outputs[k].append(_derived_filename(options['output_file'], k))
+    max_k = max(outputs)
+    filenames = _cgr.fasta_files(options['fasta_output_dir'])
+    output_dir = os.path.dirname(os.path.abspath(options['output_file']))
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as temp_dir:
+        counts_file = os.path.join(temp_dir, 'counts.mm-repr')
+        _run_kmers(dict(options, k=max_k, mode='counts',
+                        output_file=counts_file))
+
+        with job_utils.log_step('deriving CGRs for k = {}'.format(
+                ', '.join(str(k) for k in sorted(outputs)))):
+            ends = [_cgr.sequence_ends(_cgr.read_sequence(f), max_k)
+                    for f in filenames]
+
+            # outputs are only moved into place once complete, since other
+            #   experiments use them if they exist
+            precisions = {}
+            writers = {}
+            for k in outputs:
+                value_type = _value_type(options, k)
+                if options['mode'] == 'frequencies':
+                    precisions[k] = value_type
+                writers[k] = file_formats.ReprRowsWriter(
+                    os.path.join(temp_dir, 'k{}.mm-repr'.format(k)),
+                    value_type, 4**k, len(filenames),
+                    options.get('sparse', False)
+                )
+
+            chunk_size = _cgr.max_batch_size(max_k,
+                                             options.get('sparse', False))
+            try:
+                for i, chunk in enumerate(file_formats.iter_repr_chunks(
+                        counts_file, chunk_size)):
+                    chunk_ends = ends[i*chunk_size:(i+1)*chunk_size]
+                    derived = _cgr.derive_cgrs(chunk, chunk_ends, max_k,
+                                               list(writers),
+                                               options['bits_per_element'])
+                    for k, writer in six.iteritems(writers):
+                        cgrs = derived[k]
+                        if k in precisions:
+                            cgrs = _cgr.frequencies(cgrs, precisions[k])
+                        writer.write(cgrs)
+            finally:
+                for writer in six.itervalues(writers):
+                    writer.close()
+
+            for k, k_outputs in six.iteritems(outputs):
+                for i, output in enumerate(k_outputs[1:]):
+                    copy_name = '{}.{}'.format(writers[k].file.name, i)
+                    shutil.copyfile(writers[k].file.name, copy_name)
+                    fs_utils.replace_file(copy_name, output)
+                fs_utils.replace_file(writers[k].file.name, k_outputs[0])
+
+            sequences_sha1 = _sequences_sha1(options['fasta_output_dir'])
+            for k, k_outputs in six.iteritems(outputs):
+                for output in k_outputs:
+                    if output != options['output_file']:
+                        with fs_utils.atomic_write(output + '.json') as \
+                                outfile:
+                            json.dump(_derived_stamp(options, k,
+                                                     sequences_sha1), outfile)
+
+
 def run_backend_kmers(options, exp_options):
-    _command.run_command_step({
-        'command': '"{}" cgr "{}" "{}" {} {}'.format(
-                        binary_path('generation_cgr', options['disable_avx']),
-                        options['fasta_output_dir'], options['output_file'],
-                        options['k'], options['bits_per_element'])
-    }, {})
-
-    # convert counts to frequencies if desired
-    if options['mode'] == 'frequencies':
-        with job_utils.log_step('frequency-normalizing CGRs'):
-            reader = kameris_formats.repr_reader(options['output_file'])
-            cgrs = []
-            for i in range(reader.count):
-                cgr = reader.read_matrix(i)
-                cgrs.append(cgr/cgr.sum())
-
-            writer = kameris_formats.repr_writer(
-                options['output_file'], cgrs[0], len(cgrs), create_file=True
+    # use CGRs derived by an earlier experiment with the same sequences, if
+    #   there are any
+    if 'derived_from_dir' in options:
+        derived_file = _derived_filename(os.path.join(
+            options['derived_from_dir'],
+            os.path.basename(options['output_file'])
+        ), options['k'])
+        if os.path.exists(derived_file):
+            if _read_derived_stamp(derived_file) == _derived_stamp(
+                    options, options['k'],
+                    _sequences_sha1(options['fasta_output_dir'])):
+                with job_utils.log_step('using CGRs derived by experiment '
+                                        "'{}'".format(os.path.basename(
+                                            options['derived_from_dir']
+                                        ))):
+                    fs_utils.replace_file(derived_file,
+                                          options['output_file'])
+                    os.remove(derived_file + '.json')
+                return
+            logging.getLogger('kameris').warning(
+                'ignoring CGRs derived by experiment %s, which were computed '
+                'with other options or sequences',
+                os.path.basename(options['derived_from_dir'])
             )
-            for cgr in cgrs:
-                writer.write_matrix(cgr)
-            writer.file.close()
+
+    if options.get('derive_k_values'):
+        _run_derived_kmers(options, options['derive_k_values'])
+    else:
+        _run_kmers(options)
+
+
+def _minhash_sketches(options, filenames):
+    # sketches are saved in the CGR cache, if there is one
+    k = options.get('sketch_k', 21)
+    size = options.get('sketch_size', 1000)
+    cache = None
+    if options.get('cgr_cache'):
+        cache_options = options['cgr_cache']
+        cache = _cgr_cache.CGRCache(cache_options['dir'],
+                                    cache_options.get('max_size_mb', 10240) *
+                                    1024**2)
+
+    def batch_sketches(batch):
+        results = []
+        for filename in batch:
+            codes = _cgr.read_sequence(filename)
+            if cache is None:
+                results.append(_minhash.sketch(codes, k, size))
+                continue
+            key = _cgr_cache.sequence_key(codes)
+            result = cache.load_sketch(key, k, size)
+            if result is None:
+                result = _minhash.sketch(codes, k, size)
+                cache.save_sketch(key, k, size, result)
+            results.append(result)
+        return results
+
+    # sketches are small, so batches only need to be small enough for
+    #   threads to share the work
+    sketches = np.empty((len(filenames), size), dtype=np.uint64)
+    start = 0
+    for results in _cgr.map_file_batches(batch_sketches, filenames, 64,
+                                         options.get('n_jobs', 1)):
+        sketches[start:start+len(results)] = results
+        start += len(results)
+    if cache is not None:
+        cache.evict()
+    return sketches
+
+
+def _run_minhash_dists(options):
+    filenames = _cgr.fasta_files(options['fasta_output_dir'])
+    if not filenames:
+        raise Exception('no FASTA files found in ' +
+                        options['fasta_output_dir'])
+    with job_utils.log_step('computing MinHash sketches'):
+        sketches = _minhash_sketches(options, filenames)
+
+    with job_utils.log_step('computing MinHash distances'):
+        # the writer only uses the matrix for its shape and type
+        matrix_type = np.broadcast_to(np.zeros(1, dtype=np.float32),
+                                      (len(filenames), len(filenames)))
+        writer = kameris_formats.dist_writer(
+            options['output_prefix'] + '-minhash.mm-dist', matrix_type,
+            create_file=True
+        )
+        n_jobs = options.get('n_jobs', 1)
+        pool = ThreadPool(n_jobs) if n_jobs > 1 else None
+        try:
+            with writer.file:
+                for row in _minhash.iter_distance_rows(
+                        sketches, options.get('sketch_k', 21), pool,
+                        2 * n_jobs):
+                    writer.file.write(row.tobytes())
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+
+def _run_tiled_dists(options, metrics):
+    with job_utils.log_step('computing {} distances in tiles'.format(
+                                ', '.join(metrics))):
+        # finished tiles are saved next to the outputs, so that re-running
+        #   with the same input can resume
+        checkpoints_dir = None
+        if options.get('checkpoint', True):
+            checkpoints_dir = options['output_prefix'] + '.checkpoints'
+        _tiled_dists.compute_distances(
+            options['input_file'],
+            {metric: '{}-{}.mm-dist'.format(options['output_prefix'], metric)
+             for metric in metrics},
+            options.get('tile_size'), options.get('n_jobs', 1),
+            checkpoints_dir
+        )
 
 
 def run_backend_dists(options, exp_options):
-    _command.run_command_step({
-        'command': '"{}" "{}" "{}" {}'.format(
-                        binary_path('generation_dists',
-                                    options['disable_avx']),
-                        options['input_file'], options['output_prefix'],
-                        ','.join(options['distances']))
-    }, {})
+    # MinHash distances are computed in-process, from the sequences, and
+    #   those which are matrix products in-process, in tiles
+    binary_distances = [d for d in options['distances']
+                        if d in {'manhat', 'info'}]
+    tiled_distances = [d for d in options['distances']
+                       if d in _tiled_dists.metrics]
+    if binary_distances:
+        _command.run_command_step({
+            'command': '"{}" "{}" "{}" {}'.format(
+                            binary_path('generation_dists',
+                                        options['disable_avx']),
+                            options['input_file'], options['output_prefix'],
+                            ','.join(binary_distances))
+        }, {})
+    if tiled_distances:
+        _run_tiled_dists(options, tiled_distances)
+    if 'minhash' in options['distances']:
+        _run_minhash_dists(options)
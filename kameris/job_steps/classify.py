@@ -1,37 +1,54 @@
 from __future__ import absolute_import, division, unicode_literals
 
 from collections import defaultdict
+import hashlib
 import json
 import logging
 import kameris_formats
+import multiprocessing
 import numpy as np
 import os
+import random
 import scipy.sparse as sparse
 from six import iteritems
-from six.moves import range, zip
-import stopit
+from six.moves import range
 import timeit
 
 import sklearn
 from sklearn.decomposition import TruncatedSVD
-from sklearn.externals import joblib
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 
-from ._classifiers import classifiers_by_name
-from ..utils import job_utils
+from . import _checkpoints, _compiled, _streaming
+from ._cgr import resolve_precision
+from ._classifiers import (
+    classifier_factory, classifier_spec, kernel_classifiers_by_name)
+from ._kernels import InnerProducts, KernelSVC
+from ._precision import AsType
+from ..utils import file_formats, job_utils, model_utils, process_utils
 
 
 def avg_num_nonzero_entries(features):
-    return int(sum(np.count_nonzero(f) for f in features) / len(features))
+    if sparse.issparse(features):
+        num_nonzero = features.count_nonzero()
+    else:
+        num_nonzero = np.count_nonzero(features)
+    return int(num_nonzero / features.shape[0])
 
 
-def build_pipeline(classifier_factory, num_features, options):
-    normalize_features = not options.get('skip_normalization', False)
+def num_reduced_components(num_features, options):
     dim_reduce_fraction = options.get('dim_reduce_fraction', 0.1)
+    return int(np.ceil(num_features * dim_reduce_fraction))
+
+
+def build_normalizers(num_features, options, streaming=False):
+    normalize_features = not options.get('skip_normalization', False)
+    precision = options.get('precision', 'float64')
 
     # setup normalizers if needed
     normalizers = []
+    if precision != 'float64':
+        normalizers.append(('precision', AsType(precision)))
     if normalize_features:
         # scale each feature dimension to unit variance
         # note mean scaling won't work with sparse vectors
@@ -40,62 +57,212 @@ def build_pipeline(classifier_factory, num_features, options):
         normalizers.append(('scaler', StandardScaler(with_mean=False)))
 
         # reduce dimensionality to some fraction of its original
-        normalizers.append(
-            ('dim_reducer',
-             TruncatedSVD(n_components=int(
-                np.ceil(num_features * dim_reduce_fraction)
-             )))
+        # streaming fits an approximation, a batch at a time
+        num_components = num_reduced_components(num_features, options)
+        if streaming:
+            dim_reducer = _streaming.IncrementalTruncatedSVD(num_components)
+        else:
+            dim_reducer = TruncatedSVD(n_components=num_components)
+        normalizers.append(('dim_reducer', dim_reducer))
+        if precision != 'float64':
+            # the SVD always gives double precision results
+            normalizers.append(('reduced_precision', AsType(precision)))
+
+    return normalizers
+
+
+def uses_precomputed_kernels(options):
+    return (options.get('precomputed_kernels', False) and
+            not options.get('streaming', False) and
+            any(classifier_spec(spec)['name'] in kernel_classifiers_by_name
+                for spec in options['classifiers']))
+
+
+def classifier_threads(options):
+    # split the thread budget between all the classifiers running at once
+    if 'thread_budget' not in options:
+        return None
+    return max(1, options['thread_budget'] // (
+        options.get('parallel_classifiers', 1) * options.get('n_jobs', 1)
+    ))
+
+
+def make_classifier_factory(spec, options):
+    return classifier_factory(spec,
+                              options.get('precomputed_kernels', False),
+                              classifier_threads(options))
+
+
+def _fold_data(normalizer, test_indexes, **fold_data):
+    # folds only keep how much variance the dimensionality reduction kept,
+    #   since their normalizers can be large, and only the full data's is
+    #   needed, for the saved models
+    if test_indexes is None:
+        fold_data['normalizer'] = normalizer
+    if normalizer and 'dim_reducer' in normalizer.named_steps:
+        fold_data['reduced_variance_ratio'] = np.sum(
+            normalizer.named_steps['dim_reducer'].explained_variance_ratio_
         )
+    return fold_data
+
+
+def preprocess_fold_streaming(features, features_mode, train_indexes,
+                              test_indexes, num_features, options):
+    start_time = timeit.default_timer()
+    if isinstance(train_indexes, slice):
+        train_indexes = np.arange(features.shape[0])[train_indexes]
+    columns = train_indexes if features_mode == 'dists' else None
+
+    # fit normalizers one batch at a time
+    batch_size = options.get('streaming_batch_size', 1000)
+    train_features = _streaming.BatchedRows(train_indexes, batch_size,
+                                            columns=columns)
+    normalizer = None
+    normalizers = build_normalizers(num_features, options, streaming=True)
+    if normalizers:
+        normalizer = _streaming.fit_normalizer(features, train_features,
+                                               normalizers)
+        train_features.normalizer = normalizer
+    fit_end_time = timeit.default_timer()
+
+    # batches are transformed as they're used, so there's no transform time
+    test_features = None
+    if test_indexes is not None:
+        test_features = _streaming.BatchedRows(test_indexes, batch_size,
+                                               normalizer, columns)
+
+    return _fold_data(normalizer, test_indexes,
+                      train_features=train_features,
+                      test_features=test_features,
+                      fit_time=fit_end_time - start_time, transform_time=0)
+
+
+def preprocess_fold(features, features_mode, train_indexes, test_indexes,
+                    num_features, options):
+    if options.get('streaming', False):
+        return preprocess_fold_streaming(features, features_mode,
+                                         train_indexes, test_indexes,
+                                         num_features, options)
+
+    start_time = timeit.default_timer()
+
+    # split training and testing feature vectors
+    if features_mode == 'dists':
+        features = features[:, train_indexes]
+    train_features = features[train_indexes]
+
+    # fit normalizers
+    normalizers = build_normalizers(num_features, options)
+    normalizer = Pipeline(normalizers) if normalizers else None
+    if normalizer:
+        train_features = normalizer.fit_transform(train_features)
+    train_inner_products = None
+    if uses_precomputed_kernels(options):
+        train_inner_products = InnerProducts(train_features)
+    fit_end_time = timeit.default_timer()
+
+    # transform test features
+    test_features = None
+    test_inner_products = None
+    if test_indexes is not None:
+        test_features = features[test_indexes]
+        if normalizer:
+            test_features = normalizer.transform(test_features)
+        if train_inner_products:
+            test_inner_products = InnerProducts(test_features, train_features)
+
+    fold_data = _fold_data(
+        normalizer, test_indexes, train_features=train_features,
+        test_features=test_features, fit_time=fit_end_time - start_time,
+        transform_time=timeit.default_timer() - fit_end_time
+    )
+    if train_inner_products:
+        fold_data['inner_products'] = (train_inner_products,
+                                       test_inner_products)
+    return fold_data
+
+
+def classifier_inputs(classifier, fold_data):
+    # SVMs with precomputed kernels get the fold's inner products instead of
+    #   the features themselves
+    if 'inner_products' in fold_data and isinstance(classifier, KernelSVC):
+        return fold_data['inner_products']
+    return fold_data['train_features'], fold_data['test_features']
+
+
+def fit_classifier(classifier, features, train_features, train_classes,
+                   options):
+    if isinstance(train_features, _streaming.BatchedRows):
+        _streaming.partial_fit(classifier, features, train_features,
+                               train_classes,
+                               options.get('streaming_epochs', 1))
+    else:
+        classifier.fit(train_features, train_classes)
+
 
-    return Pipeline(normalizers + [('classifier', classifier_factory())])
+def predict_with(method, features, test_features):
+    if isinstance(test_features, _streaming.BatchedRows):
+        return _streaming.predict(method, features, test_features)
+    else:
+        return method(test_features)
 
 
-def classification_run(classifier_factory, features, point_classes,
-                       unique_classes, train_indexes, test_indexes, options):
+def classification_run(classifier_factory, fold_data, features,
+                       point_classes, unique_classes, train_indexes,
+                       test_indexes, options):
     num_test_points = len(test_indexes)
     train_classes = point_classes[train_indexes]
     test_realclasses = point_classes[test_indexes]
 
-    # split training and testing feature vectors
-    train_features = [features[i] for i in train_indexes]
-    test_features = [features[i] for i in test_indexes]
-    if sparse.issparse(train_features[0]):
-        train_features = sparse.vstack(train_features, format='csr')
-        test_features = sparse.vstack(test_features, format='csr')
-
     # train model
-    pipeline = build_pipeline(classifier_factory,
-                              avg_num_nonzero_entries(features), options)
+    classifier = classifier_factory()
+    train_features, test_features = classifier_inputs(classifier, fold_data)
     start_time = timeit.default_timer()
-    pipeline.fit(train_features, train_classes)
+    fit_classifier(classifier, features, train_features, train_classes,
+                   options)
     train_end_time = timeit.default_timer()
 
-    # run predictions and compute rankings
-    if hasattr(pipeline, 'predict_proba'):
-        test_expprobs = pipeline.predict_proba(test_features)
+    # run predictions and find the rank of the real class for each point
+    if hasattr(classifier, 'predict_proba'):
+        test_expprobs = predict_with(classifier.predict_proba, features,
+                                     test_features)
         test_end_time = timeit.default_timer()
 
-        num_topN = len(pipeline.classes_) - 1
-        test_expclasses_ranked = [[c for (p, c) in
-                                   sorted(zip(test_expprobs[i],
-                                              pipeline.classes_),
-                                          reverse=True)]
-                                  for i in range(num_test_points)]
-        test_expclasses = [c[0] for c in test_expclasses_ranked]
+        # rank classes by decreasing probability, breaking ties by
+        #   decreasing class (same as sorting (probability, class) pairs)
+        num_classes = len(classifier.classes_)
+        test_ranked_indexes = (num_classes - 1) - np.argsort(
+            -test_expprobs[:, ::-1], axis=1, kind='mergesort'
+        )
+        test_expclasses = classifier.classes_[test_ranked_indexes[:, 0]]
+
+        # classes missing from the training set are never predicted, so
+        #   they get a rank past the end
+        real_indexes = np.minimum(
+            np.searchsorted(classifier.classes_, test_realclasses),
+            num_classes - 1
+        )
+        real_is_known = classifier.classes_[real_indexes] == test_realclasses
+        test_realranks = np.where(
+            real_is_known,
+            np.argmax(test_ranked_indexes == real_indexes[:, np.newaxis],
+                      axis=1),
+            num_classes
+        )
+        num_topN = num_classes - 1
     else:
-        test_expclasses = pipeline.predict(test_features)
+        test_expclasses = predict_with(classifier.predict, features,
+                                       test_features)
         test_end_time = timeit.default_timer()
 
+        test_realranks = (test_expclasses != test_realclasses).astype(int)
         num_topN = 1
-        test_expclasses_ranked = [[c] for c in test_expclasses]
 
     # separate top-N results
+    test_indexes = np.asarray(test_indexes)
     topN_results = {}
     for n in range(1, num_topN+1):
-        misclassified_indexes = [test_indexes[i] for i in
-                                 range(num_test_points) if
-                                 test_realclasses[i] not in
-                                 test_expclasses_ranked[i][:n]]
+        misclassified_indexes = test_indexes[test_realranks >= n].tolist()
         topN_results['top{}'.format(n)] = {
             'misclassified_indexes': misclassified_indexes,
             'accuracy': 1 - (len(misclassified_indexes)/num_test_points)
@@ -107,20 +274,18 @@ def classification_run(classifier_factory, features, point_classes,
             test_realclasses, test_expclasses, labels=unique_classes
         ),
         'topN_results': topN_results,
-        'train_time': train_end_time - start_time,
-        'test_time': test_end_time - train_end_time
+        'train_time': fold_data['fit_time'] + train_end_time - start_time,
+        'test_time': (fold_data['transform_time'] + test_end_time -
+                      train_end_time)
     }
-    if hasattr(pipeline, 'n_iter_'):
-        stats['iterations'] = pipeline.n_iter_
-    if 'dim_reducer' in pipeline.named_steps:
-        stats['reduced_variance_ratio'] = np.sum(
-            pipeline.named_steps['dim_reducer'].explained_variance_ratio_
-        )
+    if hasattr(classifier, 'n_iter_'):
+        stats['iterations'] = np.mean(classifier.n_iter_)
+    if 'reduced_variance_ratio' in fold_data:
+        stats['reduced_variance_ratio'] = fold_data['reduced_variance_ratio']
     return stats
 
 
-def crossvalidation_run(classifier_factory, features, features_mode,
-                        point_classes, unique_classes, options):
+def validation_folds(point_classes, options):
     # perform validation group splitting
     validation_count = options['validation_count']
     num_points = len(point_classes)
@@ -138,6 +303,98 @@ def crossvalidation_run(classifier_factory, features, features_mode,
         validation_indexes = np.array_split(np.random.permutation(num_points),
                                             validation_count)
 
+    # each fold gets its own seed so results don't depend on which worker
+    #   process runs it
+    return [
+        (random.getrandbits(32),
+         np.setdiff1d(np.arange(num_points), test_indexes),
+         test_indexes)
+        for test_indexes in validation_indexes
+    ]
+
+
+# state shared with fold workers, set once per worker by _init_fold_worker
+#   so the (possibly large) features aren't re-sent for every fold
+_fold_context = {}
+
+
+def _init_fold_worker(context):
+    _fold_context.update(context)
+
+
+def _preprocess_fold(fold_index):
+    fold_seed, train_indexes, test_indexes = _fold_context['folds'][fold_index]
+    np.random.seed(fold_seed)
+
+    return preprocess_fold(
+        _fold_context['features'], _fold_context['features_mode'],
+        train_indexes, test_indexes, _fold_context['num_features'],
+        _fold_context['options']
+    )
+
+
+def _run_fold(fold_index):
+    fold_seed, train_indexes, test_indexes = _fold_context['folds'][fold_index]
+    spec = _fold_context['classifier_spec']
+    seed = _fold_context['classifier_seed']
+    checkpoints = _fold_context['checkpoints']
+    checkpoint_key = fold_checkpoint_key(spec, fold_index)
+
+    stats = load_checkpoint(checkpoints, checkpoint_key, spec, seed)
+    if stats is not None:
+        stats['confusion_matrix'] = np.array(stats['confusion_matrix'])
+        return stats
+
+    fold_data = _fold_context['preprocessed'][fold_index]
+    if fold_data is None:
+        fold_data = _preprocess_fold(fold_index)
+
+    np.random.seed(fold_seed)
+    stats = classification_run(
+        make_classifier_factory(spec, _fold_context['options']),
+        fold_data, _fold_context['features'], _fold_context['point_classes'],
+        _fold_context['unique_classes'], train_indexes, test_indexes,
+        _fold_context['options']
+    )
+
+    if checkpoints:
+        checkpoints.save(checkpoint_key,
+                         {'spec': spec, 'seed': seed, 'data': stats})
+    return stats
+
+
+def run_folds(fold_func, context, n_jobs, fold_indexes=None):
+    if fold_indexes is None:
+        fold_indexes = list(range(len(context['folds'])))
+    n_jobs = min(n_jobs, len(fold_indexes))
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs, _init_fold_worker, (context,))
+        try:
+            # map preserves fold order, so merging is the same as serially
+            return pool.map(fold_func, fold_indexes)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        # keep the global RNG as it would be after running in other processes
+        rng_state = np.random.get_state()
+        _init_fold_worker(context)
+        try:
+            return [fold_func(i) for i in fold_indexes]
+        finally:
+            _fold_context.clear()
+            np.random.set_state(rng_state)
+
+
+def crossvalidation_run(spec, seed, context):
+    validation_count = len(context['folds'])
+
+    # train classifier on each fold
+    all_stats = run_folds(_run_fold,
+                          dict(context, classifier_spec=spec,
+                               classifier_seed=seed),
+                          context['options'].get('n_jobs', 1))
+
     # setup storage for accuracy/stats
     totals = defaultdict(int)
     topN_totals = defaultdict(lambda: {
@@ -145,20 +402,8 @@ def crossvalidation_run(classifier_factory, features, features_mode,
         'misclassified_indexes': set()
     })
 
-    # train classifier and update stats
-    for test_indexes in validation_indexes:
-        train_indexes = list(set(range(num_points)).difference(test_indexes))
-
-        if features_mode == 'dists':
-            real_features = features[:, train_indexes]
-        else:
-            real_features = features
-
-        stats = classification_run(
-            classifier_factory, real_features, point_classes, unique_classes,
-            train_indexes, test_indexes, options
-        )
-
+    # update stats
+    for stats in all_stats:
         totals['confusion_matrix'] += stats['confusion_matrix']
         totals['train_time'] += stats['train_time']
         totals['test_time'] += stats['test_time']
@@ -174,7 +419,7 @@ def crossvalidation_run(classifier_factory, features, features_mode,
 
     # compute and return summary stats
     final_stats = {
-        'classes': unique_classes,
+        'classes': context['unique_classes'],
         'confusion_matrix': totals['confusion_matrix'],
         'train_time': totals['train_time'] / validation_count,
         'test_time': totals['test_time'] / validation_count
@@ -196,6 +441,72 @@ def crossvalidation_run(classifier_factory, features, features_mode,
     return final_stats
 
 
+def model_filename(output_file, classifier_name):
+    return os.path.join(
+        os.path.dirname(output_file),
+        '{}_{}.mm-model'.format(
+            os.path.splitext(os.path.basename(output_file))[0],
+            classifier_name
+        )
+    )
+
+
+num_compile_check_points = 1000
+
+
+def _run_classifier(spec, seed, context):
+    random.seed(seed)
+    np.random.seed(seed)
+    options = context['options']
+    # n_jobs alone doesn't stop BLAS from starting a thread per core
+    if classifier_threads(options) is not None:
+        process_utils.limit_threads(classifier_threads(options))
+
+    # compute cross-validation results
+    results = crossvalidation_run(spec, seed, context)
+
+    # save the model file
+    if context['save_models']:
+        # train the model
+        full_data = context['full_preprocessed'] or preprocess_fold(
+            context['features'], context['features_mode'], slice(None), None,
+            context['num_features'], options
+        )
+        classifier = make_classifier_factory(spec, options)()
+        fit_classifier(classifier, context['features'],
+                       classifier_inputs(classifier, full_data)[0],
+                       context['point_classes'], options)
+
+        normalizer = full_data['normalizer']
+        pipeline = Pipeline((normalizer.steps if normalizer else []) +
+                            [('classifier', classifier)])
+
+        # save the model
+        model_data = {
+            'sklearn_version': sklearn.__version__,
+            'generation_options': options['generation_options'],
+            'predictor': pipeline
+        }
+
+        # linear models can be collapsed into a single matrix product, which
+        #   is checked against the pipeline on some of the training points
+        compiled = _compiled.compile_pipeline(
+            pipeline, context['features'][:num_compile_check_points]
+        )
+        if compiled is not None:
+            model_data['compiled_predictor'] = compiled
+
+        model_utils.save_model(
+            model_filename(options['output_file'], spec['label']), model_data
+        )
+
+    if context['checkpoints']:
+        context['checkpoints'].save(classifier_checkpoint_key(spec),
+                                    {'spec': spec, 'seed': seed,
+                                     'data': results})
+    return results
+
+
 class NumpyJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.integer):
@@ -208,10 +519,278 @@ class NumpyJSONEncoder(json.JSONEncoder):
             return super(NumpyJSONEncoder, self).default(obj)
 
 
-def run_classify_step(options, exp_options):
+# options which don't affect results, so they may change between a run and
+#   one resuming it from checkpoints
+_resource_options = {
+    'classifiers', 'racing', 'save_model', 'checkpoint', 'timeout',
+    'memory_limit', 'n_jobs', 'parallel_classifiers', 'thread_budget',
+    'validation_split_classes'
+}
+
+
+def checkpoint_fingerprint(options):
+    return {
+        'features_sha1': _checkpoints.file_sha1(options['features_file']),
+        'metadata_sha1': _checkpoints.file_sha1(options['metadata_file']),
+        'options': {k: v for k, v in iteritems(options)
+                    if k not in _resource_options}
+    }
+
+
+def folds_sha1(folds):
+    # the training indexes are implied by the testing ones
+    digest = hashlib.sha1()
+    for fold_seed, _, test_indexes in folds:
+        digest.update(str(fold_seed).encode('ascii'))
+        digest.update(np.asarray(test_indexes, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def fold_checkpoint_key(spec, fold_index):
+    return '{}.fold{}'.format(spec['label'], fold_index)
+
+
+def classifier_checkpoint_key(spec):
+    return '{}.results'.format(spec['label'])
+
+
+def load_checkpoint(checkpoints, key, spec, seed):
+    if not checkpoints:
+        return None
+
+    # results only count if the classifier hasn't been changed since
+    saved = checkpoints.load(key)
+    if (saved is None or saved['spec'] != json.loads(json.dumps(spec)) or
+            saved.get('seed') != seed):
+        return None
+    return saved['data']
+
+
+def classifier_seed(base_seed, spec):
+    # depends only on the classifier's label, so that adding or reordering
+    #   classifiers doesn't change the results of the others
+    digest = hashlib.sha1('{}:{}'.format(base_seed, spec['label'])
+                          .encode('utf-8'))
+    return int(digest.hexdigest()[:8], 16)
+
+
+def build_context(features, features_mode, point_classes, options,
+                  save_models, checkpoints=None):
+    # folds are shared by all classifiers
+    folds = validation_folds(point_classes, options)
+    if checkpoints:
+        checkpoints = _checkpoints.Checkpoints(
+            checkpoints['directory'],
+            dict(checkpoints['fingerprint'], folds_sha1=folds_sha1(folds)),
+            NumpyJSONEncoder
+        )
+
+    return {
+        'features': features,
+        'features_mode': features_mode,
+        'num_features': avg_num_nonzero_entries(features),
+        'point_classes': point_classes,
+        'unique_classes': np.unique(point_classes),
+        'folds': folds,
+        'preprocessed': [None] * len(folds),
+        'full_preprocessed': None,
+        'save_models': save_models,
+        'checkpoints': checkpoints,
+        'options': options
+    }
+
+
+def _preprocess_shared(context, fold_indexes, full_seed):
+    n_jobs = context['options'].get('n_jobs', 1)
+    if 'thread_budget' in context['options']:
+        process_utils.limit_threads(
+            max(1, context['options']['thread_budget'] // n_jobs)
+        )
+    preprocessed = run_folds(_preprocess_fold, context, n_jobs, fold_indexes)
+    full_preprocessed = None
+    if context['save_models']:
+        np.random.seed(full_seed)
+        full_preprocessed = preprocess_fold(
+            context['features'], context['features_mode'], slice(None), None,
+            context['num_features'], context['options']
+        )
+    return preprocessed, full_preprocessed
+
+
+def run_classifiers(specs, context):
     log = logging.getLogger('kameris.classify')
-    classifier_names = options['classifiers']
-    save_model = options.get('save_model', True)
+    options = context['options']
+    checkpoints = context['checkpoints']
+    base_seed = random.getrandbits(32)
+    seeds = [classifier_seed(base_seed, spec) for spec in specs]
+    full_preprocess_seed = random.getrandbits(32)
+
+    # skip classifiers (and folds) finished in a previous run
+    results = {}
+    remaining = []
+    for spec, seed in zip(specs, seeds):
+        saved = load_checkpoint(checkpoints,
+                                classifier_checkpoint_key(spec), spec, seed)
+        model_missing = context['save_models'] and not os.path.exists(
+            model_filename(options['output_file'], spec['label'])
+        )
+        if saved is not None and not model_missing:
+            log.info("classifier '%s' already finished, skipping",
+                     spec['label'])
+            results[spec['label']] = saved
+        else:
+            remaining.append((spec, seed))
+    remaining_folds = [
+        i for i in range(len(context['folds'])) if any(
+            load_checkpoint(checkpoints, fold_checkpoint_key(spec, i),
+                            spec, seed) is None
+            for spec, seed in remaining
+        )
+    ]
+
+    # preprocessing and each classifier run in their own processes so that
+    #   they can really be stopped if they run too long or use too much memory
+    limits = {
+        'timeout': options.get('timeout', 600),
+        'memory_limit': options.get('memory_limit') and
+        options['memory_limit'] * 1024 * 1024
+    }
+    parallel_classifiers = options.get('parallel_classifiers', 1)
+
+    # fit normalizers (and compute inner products) once per fold and for the
+    #   final models, since it's the same for every classifier
+    # if this fails, each classifier preprocesses for itself instead
+    if remaining and (build_normalizers(context['num_features'], options) or
+                      uses_precomputed_kernels(options)):
+        with job_utils.log_step('preprocessing features'):
+            (_, result, failure), = process_utils.run_killable([(
+                'preprocessing', _preprocess_shared,
+                (context, remaining_folds, full_preprocess_seed)
+            )], **limits)
+        if failure is None:
+            preprocessed, context['full_preprocessed'] = result
+            for i, fold_data in zip(remaining_folds, preprocessed):
+                context['preprocessed'][i] = fold_data
+        else:
+            log.warning('*** shared preprocessing failed: %s, preprocessing '
+                        'for each classifier instead', failure['message'])
+
+    # run classifiers and obtain results
+    tasks = [
+        (spec['label'], _run_classifier, (spec, seed, context))
+        for spec, seed in remaining
+    ]
+    if tasks:
+        log.info('running %d classifiers, up to %d at a time',
+                 len(tasks), parallel_classifiers)
+
+    num_finished = 0
+    for label, result, failure in process_utils.run_killable(
+            tasks, max_workers=parallel_classifiers, **limits):
+        num_finished += 1
+        step_text = "classifier '{}' ({}/{})".format(
+            label, num_finished, len(tasks)
+        )
+        if failure is None:
+            log.info('finished %s', step_text)
+            results[label] = result
+        else:
+            log.warning('*** %s failed: %s, skipping', step_text,
+                        failure['message'])
+            results[label] = {'failure': failure}
+    return results
+
+
+def stratified_sample(point_classes, fraction, min_per_class=1):
+    sample = []
+    for point_class in np.unique(point_classes):
+        class_indexes = np.where(point_classes == point_class)[0]
+        num_samples = min(len(class_indexes), max(
+            min_per_class, int(round(len(class_indexes) * fraction))
+        ))
+        sample.append(np.random.permutation(class_indexes)[:num_samples])
+    return np.sort(np.concatenate(sample))
+
+
+def run_racing(specs, features, features_mode, point_classes, options,
+               checkpoints=None):
+    racing_options = options['racing']
+    keep_fraction = racing_options.get('keep_fraction', 0.5)
+    fraction = racing_options.get('initial_fraction', 0.1)
+
+    # evaluate on growing subsamples, keeping only the best classifiers each
+    #   time, until the sample would be the whole dataset
+    stages = defaultdict(list)
+    remaining = list(specs)
+    stage_num = 0
+    while fraction < 1 and len(remaining) > 1:
+        # every class gets at least a point per fold, so no fold is empty
+        sample = stratified_sample(point_classes, fraction,
+                                   options['validation_count'])
+        stage_options = options.copy()
+        if 'validation_split_classes' in options:
+            stage_options['validation_split_classes'] = \
+                options['validation_split_classes'][sample]
+            # folds are made of whole groups, so there have to be enough
+            if (len(np.unique(stage_options['validation_split_classes'])) <
+                    options['validation_count']):
+                fraction /= keep_fraction
+                continue
+
+        stage_desc = 'racing stage {} ({} classifiers, {} points)'.format(
+            stage_num + 1, len(remaining), len(sample)
+        )
+        with job_utils.log_step(stage_desc, start_stars=True):
+            if features_mode == 'dists':
+                stage_features = features[np.ix_(sample, sample)]
+            else:
+                stage_features = features[sample]
+
+            stage_checkpoints = checkpoints and dict(
+                checkpoints, directory=os.path.join(
+                    checkpoints['directory'],
+                    'racing-stage{}'.format(stage_num)
+                )
+            )
+            results = run_classifiers(remaining, build_context(
+                stage_features, features_mode, point_classes[sample],
+                stage_options, save_models=False,
+                checkpoints=stage_checkpoints
+            ))
+
+        # failed classifiers rank last; ties keep the original order
+        labels = [spec['label'] for spec in remaining]
+        accuracies = {label: results[label]['top1']['accuracy']
+                      if 'top1' in results[label] else -1
+                      for label in labels}
+        num_kept = max(1, int(np.ceil(len(labels) * keep_fraction)))
+        kept = set(sorted(labels, key=lambda label: -accuracies[label])
+                   [:num_kept])
+
+        for name in labels:
+            stage = {
+                'stage': stage_num,
+                'num_points': len(sample),
+                'advanced': name in kept
+            }
+            if 'failure' in results[name]:
+                stage['failure'] = results[name]['failure']
+            else:
+                stage['accuracy'] = accuracies[name]
+                stage['train_time'] = results[name]['train_time']
+            stages[name].append(stage)
+
+        remaining = [spec for spec in remaining if spec['label'] in kept]
+        fraction /= keep_fraction
+        stage_num += 1
+
+    return remaining, stages
+
+
+def run_classify_step(options, exp_options):
+    specs = [classifier_spec(spec) for spec in options['classifiers']]
+    save_models = ('generation_options' in options and
+                   options.get('save_model', True))
 
     # import features
     features_filename = options['features_file']
@@ -220,11 +799,8 @@ def run_classify_step(options, exp_options):
                                   .read_matrix(options['features_file'])
         features_mode = 'dists'
     elif features_filename.endswith('.mm-repr'):
-        features = []
-        reader = kameris_formats.repr_reader(options['features_file'])
-        for i in range(reader.count):
-            features.append(reader.read_matrix(i, flatten=True))
-
+        # memory-mapped, so folds and worker processes share the same pages
+        features = file_formats.read_repr_matrix(options['features_file'])
         features_mode = 'features'
     else:
         raise Exception("Unknown type for file '{}'".format(features_filename))
@@ -233,65 +809,54 @@ def run_classify_step(options, exp_options):
     with open(options['metadata_file'], 'r') as infile:
         metadata = json.load(infile)
     point_classes = np.array([x['group'] for x in metadata])
-    unique_classes = np.unique(point_classes)
     if 'validation_split_by' in options:
         options['validation_split_classes'] = np.array([
             x[options['validation_split_by']] for x in metadata
         ])
 
-    # run classifiers and obtain results
+    # single precision halves memory use and speeds up most of the math
+    options['precision'] = resolve_precision(
+        options.get('precision', 'auto'),
+        options.get('generation_options', {}).get('k'), features.dtype
+    )
+
+    # seed numpy from the job's seed so folds (and so checkpoints) are
+    #   reproducible
+    np.random.seed(random.getrandbits(32))
+
+    # finished folds and classifiers are saved next to the output file, so
+    #   that re-running with the same inputs can resume
+    checkpoints = None
+    if options.get('checkpoint', True):
+        checkpoints = {
+            'directory': os.path.splitext(options['output_file'])[0] +
+            '.checkpoints',
+            'fingerprint': checkpoint_fingerprint(options)
+        }
+
+    # if racing, drop the worst classifiers early using subsamples
+    racing_stages = {}
+    final_specs = specs
+    if 'racing' in options:
+        final_specs, racing_stages = run_racing(
+            specs, features, features_mode, point_classes, options,
+            checkpoints
+        )
+
+    # run classifiers on the full dataset
+    final_results = run_classifiers(final_specs, build_context(
+        features, features_mode, point_classes, options, save_models,
+        checkpoints
+    ))
+
     results = {}
-    for i, classifier_name in enumerate(classifier_names):
-        with job_utils.log_step(
-                 "classifier '{}' ({}/{})".format(classifier_name, i+1,
-                                                  len(classifier_names))):
-            timeout = options.get('timeout', 600)
-            try:
-                with stopit.ThreadingTimeout(seconds=timeout,
-                                             swallow_exc=False):
-                    classifier_factory = classifiers_by_name[classifier_name]
-
-                    # compute cross-validation results
-                    results[classifier_name] = crossvalidation_run(
-                        classifier_factory, features, features_mode,
-                        point_classes, unique_classes, options
-                    )
-
-                    # save the model file
-                    if 'generation_options' in options and save_model:
-                        # train the model
-                        pipeline = build_pipeline(
-                            classifier_factory,
-                            avg_num_nonzero_entries(features), options
-                        )
-                        pipeline.fit(features, point_classes)
-
-                        # save the model
-                        model_data = {
-                            'sklearn_version': sklearn.__version__,
-                            'generation_options':
-                                options['generation_options'],
-                            'predictor': pipeline
-                        }
-                        model_file = os.path.join(
-                            os.path.dirname(options['output_file']),
-                            '{}_{}.mm-model'.format(
-                                os.path.splitext(
-                                    os.path.basename(options['output_file'])
-                                )[0],
-                                classifier_name
-                            )
-                        )
-                        joblib.dump(model_data, model_file)
-            except stopit.TimeoutException:
-                log.warning(
-                    '*** classifier run timed out after ~%d seconds, skipping',
-                    timeout
-                )
-            except Exception as e:
-                log.warning(
-                    "*** classifier run failed with error '%s', skipping", e
-                )
+    for name in (spec['label'] for spec in specs):
+        results[name] = final_results.get(name, {})
+        if name in racing_stages:
+            results[name]['racing_stages'] = racing_stages[name]
+            if name not in final_results:
+                results[name]['eliminated_at_stage'] = \
+                    racing_stages[name][-1]['stage']
 
     # write results
     with open(options['output_file'], 'w') as outfile:
@@ -19,6 +19,13 @@ def argparse_check_dir(path):
         return path
 
 
+def argparse_check_input(path):
+    if path != '-' and not os.path.exists(path):
+        raise argparse.ArgumentTypeError(path + ' does not exist')
+    else:
+        return path
+
+
 def run_job_setup_args(parser):
     parser.add_argument('job_file', help='job description YAML file')
     parser.add_argument('settings_file', help='program settings YAML file')
@@ -45,8 +52,10 @@ def summarize_setup_args(parser):
 
 def classify_setup_args(parser):
     parser.add_argument('model', help='name, URL, or path to model file')
-    parser.add_argument('files', type=argparse_check_dir,
-                        help='folder of FASTA files to classify')
+    parser.add_argument('files', type=argparse_check_input,
+                        help='folder of FASTA files to classify, or a '
+                             'multi-FASTA file (- for standard input) to '
+                             'classify each record of')
     parser.add_argument('urls_file', nargs='?', help='download URLs YAML file')
     parser.add_argument('--force-download', action='store_true',
                         help='if the model file has already been downloaded '
@@ -54,6 +63,43 @@ def classify_setup_args(parser):
     parser.add_argument('--disable-avx', action='store_true',
                         help='disable AVX optimizations, even if detected '
                              'as supported by your CPU')
+    parser.add_argument('-o', '--output',
+                        help='the results file (defaults to results.json, '
+                             'or results.jsonl for a multi-FASTA file, with '
+                             'one JSON object per line)')
+    parser.add_argument('--top-n', type=argparse_positive_int,
+                        help='only report the N most likely classes')
+    parser.add_argument('--chunk-size', type=argparse_positive_int,
+                        default=1000,
+                        help='for a multi-FASTA file, the number of records '
+                             'to classify at a time (defaults to 1000)')
+    parser.add_argument('--n-jobs', type=argparse_positive_int, default=1,
+                        help='for a multi-FASTA file, the number of '
+                             'processes classifying chunks (defaults to 1)')
+
+
+def serve_setup_args(parser):
+    parser.add_argument('models', nargs='+',
+                        help='names, URLs, or paths to model files')
+    parser.add_argument('--urls-file', help='download URLs YAML file')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='the address to listen on (defaults to '
+                             '127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='the port to listen on (defaults to 8000)')
+    parser.add_argument('--unix-socket',
+                        help='listen on this Unix socket instead of a port')
+    parser.add_argument('--max-batch-size', type=argparse_positive_int,
+                        default=256,
+                        help='the maximum number of sequences from '
+                             'concurrent requests to classify together '
+                             '(defaults to 256)')
+    parser.add_argument('--max-batch-wait', type=float, default=10,
+                        help='how long in milliseconds to wait for more '
+                             'requests to fill a batch (defaults to 10)')
+    parser.add_argument('--force-download', action='store_true',
+                        help='if a model file has already been downloaded '
+                             'and is in the cache, download it again anyway')
 
 
 subcommands = {
@@ -72,5 +118,11 @@ subcommands = {
         'module_name': 'classify',
         'setup_args': classify_setup_args,
         'description': 'Runs sequences through a trained model.'
+    },
+    'serve': {
+        'module_name': 'serve',
+        'setup_args': serve_setup_args,
+        'description': 'Keeps trained models loaded and classifies FASTA '
+                       'sequences sent over HTTP.'
     }
 }
@@ -1,57 +1,250 @@
 from __future__ import (
     absolute_import, division, print_function, unicode_literals)
 
-from backports import tempfile
+import itertools
 import json
-import kameris_formats
+import logging
+import multiprocessing
+import numpy as np
 import os
-import sklearn
-from sklearn.externals import joblib
+import sys
 from tabulate import tabulate
 
-from ..job_steps import backend
-from ..utils import download_utils, job_utils
+from ..job_steps import _cgr, _hashed_kmers
+from ..utils import job_utils, model_utils, process_utils
 
+# other dependencies are imported where needed, since importing everything
+#   takes longer than classifying small inputs
 
-def run(args):
-    # setup logging
-    log, _ = job_utils.setup_logging('', {})
 
-    # open the model file
-    if os.path.exists(args.model):
-        model_file = open(args.model, 'rb')
+def open_model(model, urls_file, force_download):
+    """Opens a model given its name, URL, or path."""
+
+    if os.path.exists(model):
+        return open(model, 'rb')
     else:
-        if download_utils.is_url(args.model):
-            model_url = args.model
+        from ..utils import download_utils
+
+        if download_utils.is_url(model):
+            model_url = model
         else:
-            model_url = download_utils.url_for_file(args.model + '.mm-model',
-                                                    args.urls_file, 'models')
-        model_file = download_utils.open_url_cached(model_url, 'rb',
-                                                    args.force_download)
+            model_url = download_utils.url_for_file(model + '.mm-model',
+                                                    urls_file, 'models')
+        return download_utils.open_url_cached(model_url, 'rb', force_download)
+
+
+def load_model(model_file):
+    # compiled predictors don't need scikit-learn
+    model_data = model_utils.load_model(model_file, prefer_compiled=True)
+    if 'predictor' not in model_data:
+        return model_data
+
+    import sklearn
+    if model_data['sklearn_version'] != sklearn.__version__:
+        logging.getLogger('kameris').warning(
+            'the version of scikit-learn installed now is different from the '
+            'one used during training (%s vs %s), you may experience issues',
+            model_data['sklearn_version'], sklearn.__version__
+        )
+    return model_data
+
+
+def model_predictor(model_data):
+    # linear models may also be saved as a single matrix product
+    if 'compiled_predictor' in model_data:
+        return model_data['compiled_predictor']
+    return model_data['predictor']
+
+
+def compute_cgrs(generation_options, fasta_dir, disable_avx):
+    """Returns the CGRs of the FASTA files in fasta_dir, in sorted filename
+    order."""
+
+    from backports import tempfile
+    from ..job_steps import backend
+    from ..utils import file_formats
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cgrs_file = os.path.join(temp_dir, 'cgrs.mm-repr')
+        options = dict(generation_options, fasta_output_dir=fasta_dir,
+                       output_file=cgrs_file, disable_avx=disable_avx)
+        backend.run_backend_kmers(options, {})
+
+        # not memory-mapped, since the temp dir is deleted right after
+        return file_formats.read_repr_matrix(cgrs_file, mmap=False)
+
+
+def predict(predictor, cgrs, top_n=None):
+    """Returns, for each CGR, a list of [class, probability] pairs by
+    decreasing probability (only the first top_n if given) if the predictor
+    supports it, otherwise just the predicted class."""
+
+    if hasattr(predictor, 'predict_proba'):
+        return [
+            sorted(([c, float(p)] for c, p in zip(predictor.classes_, probs)),
+                   reverse=True, key=lambda r: r[1])[:top_n]
+            for probs in predictor.predict_proba(cgrs)
+        ]
+    else:
+        return list(predictor.predict(cgrs))
+
+
+# streaming classification of multi-FASTA input, in chunks of records
+
+_stream_model = {}
+
+
+def _init_stream_worker(model_filename):
+    _stream_model['data'] = model_utils.load_model(model_filename,
+                                                   prefer_compiled=True)
+
+
+def classify_records(model_data, records, top_n=None):
+    """Returns a result dict for each (name, letter codes) record, computing
+    CGRs (or hashed k-mers) in-process."""
+
+    options = model_data['generation_options']
+    k = options['k']
+    results = [{'name': name} for name, _ in records]
+    sequence_indexes = [i for i, (_, codes) in enumerate(records)
+                        if codes is not None]
+    sequences_codes = [records[i][1] for i in sequence_indexes]
+    sparse_output = options.get('sparse', False)
+    if not sequences_codes:
+        cgrs = np.zeros((0, 0))
+    elif options['mode'] == 'hashed':
+        cgrs = _hashed_kmers.hashed_counts(
+            sequences_codes, k, options['num_buckets'],
+            options.get('canonical', False), sparse_output
+        )
+    else:
+        cgrs = _cgr.cgr_counts(sequences_codes, k,
+                               options['bits_per_element'], sparse_output)
+
+    # CGRs of sequences shorter than k are empty
+    if sparse_output and sequences_codes:
+        nonempty = np.diff(cgrs.indptr) > 0
+    else:
+        nonempty = cgrs.any(axis=1)
+    valid_indexes = [i for i, valid in zip(sequence_indexes, nonempty)
+                     if valid]
+    for i in set(range(len(records))) - set(valid_indexes):
+        results[i]['error'] = 'no k-mers found'
+    if not valid_indexes:
+        return results
+
+    cgrs = cgrs[nonempty]
+    if options['mode'] in {'frequencies', 'hashed'}:
+        cgrs = _cgr.frequencies(cgrs, _cgr.resolve_precision(
+            options.get('precision', 'auto'), k
+        ))
+    predictions = predict(model_predictor(model_data), cgrs, top_n)
+    for i, prediction in zip(valid_indexes, predictions):
+        results[i]['result'] = prediction
+    return results
+
+
+def records_chunk_size(generation_options):
+    """Returns the number of records classify_records may be given at once
+    for models with the given generation options, keeping memory use
+    bounded."""
+
+    return _cgr.max_batch_size(
+        generation_options['k'], generation_options.get('sparse', False),
+        generation_options['num_buckets']
+        if generation_options['mode'] == 'hashed' else None
+    )
+
+
+def _classify_chunk(args):
+    records, top_n = args
+    return classify_records(_stream_model['data'], records, top_n)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _NumpyJSONEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return json.JSONEncoder.default(self, obj)
+
+
+def run_streaming(args, model_file, model_data):
+    log = logging.getLogger('kameris')
+    top_n = args.top_n
+    n_jobs = args.n_jobs
+    chunk_size = min(args.chunk_size,
+                     records_chunk_size(model_data['generation_options']))
+    output_file = args.output or 'results.jsonl'
+
+    if args.files == '-':
+        infile = getattr(sys.stdin, 'buffer', sys.stdin)
+    else:
+        infile = open(args.files, 'rb')
+    chunks = ((chunk, top_n)
+              for chunk in _chunks(_cgr.read_records(infile), chunk_size))
+
+    if n_jobs > 1:
+        # workers memory-map the same model file
+        pool = multiprocessing.Pool(n_jobs, _init_stream_worker,
+                                    (model_file.name,))
+        chunk_results = process_utils.ordered_results(
+            pool, _classify_chunk, chunks, 2 * n_jobs
+        )
+    else:
+        pool = None
+        chunk_results = (classify_records(model_data, records, top_n)
+                         for records, top_n in chunks)
+
+    num_records = 0
+    num_errors = 0
+    with job_utils.log_step('classifying sequences'):
+        try:
+            with open(output_file, 'w') as outfile:
+                for results in chunk_results:
+                    for result in results:
+                        outfile.write(json.dumps(result,
+                                                 cls=_NumpyJSONEncoder))
+                        outfile.write('\n')
+                        num_errors += 'error' in result
+                    num_records += len(results)
+                    log.info('classified %s sequences', num_records)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if args.files != '-':
+                infile.close()
+
+    if num_errors:
+        log.warning('%s sequences could not be classified', num_errors)
+    log.info('wrote results to %s', output_file)
+
+
+def run(args):
+    # setup logging
+    log, _ = job_utils.setup_logging('', {})
 
     # load the model
+    model_file = open_model(args.model, args.urls_file, args.force_download)
     with job_utils.log_step('loading model'):
-        model_data = joblib.load(model_file)
-        if model_data['sklearn_version'] != sklearn.__version__:
-            log.warning('the version of scikit-learn installed now is '
-                        'different from the one used during training '
-                        '(%s vs %s), you may experience issues',
-                        model_data['sklearn_version'], sklearn.__version__)
+        model_data = load_model(model_file)
+
+    if not os.path.isdir(args.files):
+        run_streaming(args, model_file, model_data)
+        return
 
     # compute CGRs for inputs
     with job_utils.log_step('computing input CGRs'):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            cgrs_file = os.path.join(temp_dir, 'cgrs.mm-repr')
-            options = dict(model_data['generation_options'],
-                           fasta_output_dir=args.files, output_file=cgrs_file,
-                           disable_avx=args.disable_avx)
-            backend.run_backend_kmers(options, {})
-
-            cgrs = []
-            reader = kameris_formats.repr_reader(cgrs_file)
-            for i in range(reader.count):
-                cgrs.append(reader.read_matrix(i, flatten=True))
-            reader.file.close()
+        cgrs = compute_cgrs(model_data['generation_options'], args.files,
+                            args.disable_avx)
 
     # get list of input files
     filenames = sorted(f for f in os.listdir(args.files) if
@@ -59,24 +252,14 @@ def run(args):
 
     # run predictions
     with job_utils.log_step('running predictions'):
-        predictor = model_data['predictor']
-        if hasattr(predictor, 'predict_proba'):
-            results = predictor.predict_proba(cgrs)
-        else:
-            results = predictor.predict(cgrs)
+        results = dict(zip(filenames, predict(model_predictor(model_data),
+                                              cgrs, args.top_n)))
 
-    # build and write results
-    if hasattr(predictor, 'predict_proba'):
-        results = dict(zip(filenames, [
-            sorted(zip(predictor.classes_, result), reverse=True,
-                   key=lambda r: r[1])
-            for result in results
-        ]))
-    else:
-        results = dict(zip(filenames, results))
-    with open('results.json', 'w') as file:
-        json.dump(results, file)
-    log.info('wrote results to results.json')
+    # write results
+    output_file = args.output or 'results.json'
+    with open(output_file, 'w') as file:
+        json.dump(results, file, cls=_NumpyJSONEncoder)
+    log.info('wrote results to %s', output_file)
 
     # print results
     print()
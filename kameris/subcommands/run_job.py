@@ -15,7 +15,8 @@ import six
 from six import iteritems
 from six.moves import range
 
-from ..job_steps import step_runners
+from ..job_steps import step_runner
+from ..job_steps._classifiers import check_classifier_spec, classifier_spec
 from ..utils import download_utils, fs_utils, job_utils
 
 
@@ -36,6 +37,16 @@ def experiment_paths(local_dirs, job_name, exp_name, urls_file):
     }
 
 
+# options added to experiments by run_job itself
+_internal_exp_options = {'experiment_name', 'selection_copy_from',
+                         'derive_k_values'}
+
+
+def rerun_exp_options(exp_options):
+    return {key: value for key, value in iteritems(exp_options)
+            if key not in _internal_exp_options}
+
+
 def preprocess_experiments(experiments, select_copy_for_options):
     def inflate_expand_option(option_vals):
         if isinstance(option_vals, six.string_types):
@@ -76,8 +87,16 @@ def preprocess_experiments(experiments, select_copy_for_options):
                         if opts == expanded_options:
                             break
                         elif all(o in opts for o in sliced_options):
+                            copy_from = exp_name_with_options(exp_name, opts)
                             new_exp_options['selection_copy_from'] = \
-                                exp_name_with_options(exp_name, opts)
+                                copy_from
+
+                            # experiments with the same sequences get their
+                            #   k-mers from the first one
+                            if 'k' in new_exp_options:
+                                final_experiments[copy_from].setdefault(
+                                    'derive_k_values', []
+                                ).append(new_exp_options['k'])
                             break
 
                 final_experiments[new_exp_name] = new_exp_options
@@ -87,7 +106,7 @@ def preprocess_experiments(experiments, select_copy_for_options):
     return final_experiments
 
 
-def preprocess_steps(steps, paths, exp_options, disable_avx):
+def preprocess_steps(steps, paths, exp_options, disable_avx, cgr_cache=None):
     def make_output_paths(options, keys):
         for key in keys:
             if key in options and not os.path.isabs(options[key]):
@@ -100,11 +119,27 @@ def preprocess_steps(steps, paths, exp_options, disable_avx):
         elif step_options['type'] == 'kmers':
             step_options['fasta_output_dir'] = paths['fasta_output_dir']
             step_options['disable_avx'] = disable_avx
+            if cgr_cache:
+                step_options['cgr_cache'] = cgr_cache
             if step_options['k'] == 'from_options':
                 step_options['k'] = exp_options['k']
+                # unlike CGRs, hashed k-mers can't be derived from those at
+                #   another value of k
+                derivable = step_options['mode'] != 'hashed'
+                if derivable and 'derive_k_values' in exp_options:
+                    step_options['derive_k_values'] = \
+                        exp_options['derive_k_values']
+                elif derivable and 'selection_copy_from' in exp_options:
+                    step_options['derived_from_dir'] = os.path.join(
+                        paths['output_dir'], '..',
+                        exp_options['selection_copy_from']
+                    )
             make_output_paths(step_options, ['output_file'])
         elif step_options['type'] == 'distances':
+            step_options['fasta_output_dir'] = paths['fasta_output_dir']
             step_options['disable_avx'] = disable_avx
+            if cgr_cache:
+                step_options['cgr_cache'] = cgr_cache
             make_output_paths(step_options, ['input_file', 'output_prefix'])
         elif step_options['type'] == 'mds':
             make_output_paths(step_options, ['dists_file', 'output_file'])
@@ -119,7 +154,9 @@ def preprocess_steps(steps, paths, exp_options, disable_avx):
             if generation_opts:
                 step_options['generation_options'] = {
                     k: generation_opts[k] for k in
-                    {'mode', 'k', 'bits_per_element'}
+                    {'mode', 'k', 'bits_per_element', 'precision', 'sparse',
+                     'num_buckets', 'canonical'}
+                    if k in generation_opts
                 }
 
     return steps
@@ -159,6 +196,46 @@ def validate_job_options(options):
         if 'postprocess' in select_step:
             job_utils.parse_multiline_lambda_str(select_step['postprocess'])
 
+    # check kmers steps
+    for step in options['steps']:
+        if (step['type'] == 'kmers' and step['mode'] == 'hashed' and
+                'num_buckets' not in step):
+            raise Exception('kmers steps in hashed mode need num_buckets')
+
+    # check that distances steps computed by the distances binary have
+    #   dense input, the only kind it supports
+    sparse_files = {step['output_file'] for step in options['steps']
+                    if step['type'] == 'kmers' and step.get('sparse', False)}
+    for step in options['steps']:
+        if (step['type'] != 'distances' or
+                set(step['distances']) == {'minhash'}):
+            continue
+        if 'input_file' not in step:
+            raise Exception('distances steps need input_file, except for '
+                            'minhash distances')
+        if (step['input_file'] in sparse_files and
+                set(step['distances']) & {'manhat', 'info'}):
+            raise Exception('manhat and info distances need a dense input, '
+                            "got the sparse k-mers file '{}'"
+                            .format(step['input_file']))
+
+    # check classifiers under classify steps
+    for step in options['steps']:
+        if step['type'] != 'classify':
+            continue
+        specs = [classifier_spec(spec) for spec in step['classifiers']]
+        labels = [spec['label'] for spec in specs]
+        if len(set(labels)) != len(labels):
+            raise Exception('classifier labels in a classify step must be '
+                            'unique, got [{}]'.format(', '.join(labels)))
+        for spec in specs:
+            try:
+                check_classifier_spec(spec,
+                                      step.get('precomputed_kernels', False))
+            except ValueError as e:
+                raise Exception("invalid classifier '{}': {}"
+                                .format(spec['label'], e))
+
 
 def load_metadata(metadata_dir, urls_file, name):
     file_path = os.path.join(metadata_dir, name + '.json')
@@ -177,7 +254,7 @@ def run_experiment_steps(steps, exp_options):
         step_desc = "step '{}' ({}/{})".format(step_options['type'], i+1,
                                                len(steps))
         with job_utils.log_step(step_desc, start_stars=True):
-            step_runners[step_options['type']](step_options, exp_options)
+            step_runner(step_options['type'])(step_options, exp_options)
 
 
 def run(args):
@@ -232,7 +309,8 @@ def run(args):
             paths = experiment_paths(local_dirs, job_name, exp_name,
                                      args.urls_file)
             steps = preprocess_steps(job_options['steps'], paths, exp_options,
-                                     args.disable_avx)
+                                     args.disable_avx,
+                                     settings.get('cgr_cache'))
             if isinstance(exp_options['groups'], six.string_types):
                 metadata = None
                 if 'dataset' in exp_options and ('metadata' in
@@ -267,7 +345,7 @@ def run(args):
                     'name': job_name,
                     'random_seed': random_seed,
                     'experiments': {
-                        exp_name: exp_options
+                        exp_name: rerun_exp_options(exp_options)
                     },
                     'steps': job_options['steps']
                 }, rerun_file)
@@ -0,0 +1,357 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import collections
+import io
+import json
+import logging
+import os
+import stat
+import threading
+import timeit
+
+import six
+from six.moves import BaseHTTPServer, queue, range, socketserver, urllib
+
+from . import classify
+from ..job_steps import _cgr
+from ..utils import job_utils
+
+
+class _Request(object):
+    def __init__(self, records):
+        self.records = records
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ModelWorker(object):
+    """Runs predictions for one model, in a thread which groups the records
+    of concurrent requests into batches, so the predictor is called once per
+    batch. CGRs are computed in-process, as by classify for multi-FASTA
+    files."""
+
+    def __init__(self, model_data, max_batch_size, max_batch_wait, metrics):
+        self.model_data = model_data
+        self.chunk_size = classify.records_chunk_size(
+            model_data['generation_options']
+        )
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.metrics = metrics
+        self.requests = queue.Queue()
+
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def classify(self, records):
+        """Returns results for the given (name, letter codes) records, as
+        given by classify.classify_records, blocking until they are
+        available."""
+
+        request = _Request(records)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        batch_size = len(batch[0].records)
+        deadline = timeit.default_timer() + self.max_batch_wait
+        while batch_size < self.max_batch_size:
+            timeout = deadline - timeit.default_timer()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            batch_size += len(request.records)
+        return batch
+
+    def _predict(self, records):
+        results = []
+        for start in range(0, len(records), self.chunk_size):
+            results.extend(classify.classify_records(
+                self.model_data, records[start:start+self.chunk_size]
+            ))
+        return results
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            records = [r for request in batch for r in request.records]
+            try:
+                results = self._predict(records)
+            except Exception:
+                logging.getLogger('kameris').exception(
+                    'prediction failed for a batch of %s records, retrying '
+                    'each request separately', len(records)
+                )
+                results = None
+            self.metrics.record_batch(len(records))
+
+            start = 0
+            for request in batch:
+                end = start + len(request.records)
+                if results is not None:
+                    request.results = results[start:end]
+                else:
+                    # so a bad request doesn't fail the others in its batch
+                    try:
+                        request.results = self._predict(request.records)
+                    except Exception as e:
+                        request.error = e
+                request.done.set()
+                start = end
+
+
+class Metrics(object):
+    """Request counts, throughput and latency percentiles, the latter over
+    the most recent requests."""
+
+    def __init__(self, num_recent=1000):
+        self.lock = threading.Lock()
+        self.start_time = timeit.default_timer()
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=num_recent)
+
+    def record_request(self, num_sequences, latency, failed=False):
+        with self.lock:
+            self.counts['requests'] += 1
+            if failed:
+                self.counts['failed_requests'] += 1
+            else:
+                self.counts['sequences'] += num_sequences
+            self.latencies.append(latency)
+
+    def record_batch(self, num_sequences):
+        with self.lock:
+            self.counts['batches'] += 1
+            self.counts['batched_sequences'] += num_sequences
+
+    def summary(self):
+        with self.lock:
+            uptime = timeit.default_timer() - self.start_time
+            latencies = sorted(self.latencies)
+            counts = dict(self.counts)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1,
+                                 int(p / 100 * len(latencies)))]
+
+        batches = counts.get('batches', 0)
+        return {
+            'uptime_seconds': uptime,
+            'requests': counts.get('requests', 0),
+            'failed_requests': counts.get('failed_requests', 0),
+            'sequences': counts.get('sequences', 0),
+            'batches': batches,
+            'mean_batch_size': (counts.get('batched_sequences', 0) / batches
+                                if batches else None),
+            'sequences_per_second': counts.get('sequences', 0) / uptime,
+            'latency_seconds': {
+                'mean': (sum(latencies) / len(latencies)
+                         if latencies else None),
+                'p50': percentile(50),
+                'p90': percentile(90),
+                'p99': percentile(99)
+            }
+        }
+
+
+def parse_records(data):
+    """Returns a list of (name, letter codes) records from FASTA data (as
+    bytes), read like multi-FASTA files by classify, names being the first
+    word of each header. Data without headers is a single record named
+    'sequence'."""
+
+    records = list(_cgr.read_records(io.BytesIO(data)))
+    if len(records) == 1 and not data.lstrip().startswith(b'>'):
+        records = [('sequence', records[0][1])]
+    if any(codes is None for _, codes in records):
+        raise ValueError('every FASTA record must contain a sequence')
+
+    names = [name for name, _ in records]
+    if len(set(names)) != len(names):
+        raise ValueError('FASTA record names must be unique')
+    return records
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves:
+    - POST /classify[?model=name]: FASTA in the request body, returns the
+      same JSON as results.json keyed by record name
+    - GET /models: the loaded models and their generation options
+    - GET /metrics: request and latency statistics"""
+
+    def _send_json(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, code, message):
+        self._send_json(code, {'error': message})
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path == '/metrics':
+            self._send_json(200, self.server.metrics.summary())
+        elif path == '/models':
+            self._send_json(200, {
+                name: {
+                    'generation_options': worker.model_data[
+                        'generation_options'
+                    ],
+                    'compiled': 'compiled_predictor' in worker.model_data
+                } for name, worker in six.iteritems(self.server.workers)
+            })
+        else:
+            self._send_error(404, 'not found')
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/classify':
+            self._send_error(404, 'not found')
+            return
+
+        model_names = urllib.parse.parse_qs(url.query).get('model')
+        if model_names:
+            worker = self.server.workers.get(model_names[0])
+            if worker is None:
+                self._send_error(404, 'unknown model ' + model_names[0])
+                return
+        elif len(self.server.workers) == 1:
+            worker = next(six.itervalues(self.server.workers))
+        else:
+            self._send_error(400, 'a model must be given when more than '
+                                  'one is loaded')
+            return
+
+        start_time = timeit.default_timer()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            records = parse_records(self.rfile.read(length))
+            if not records:
+                raise ValueError('no sequences given')
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+
+        try:
+            results = worker.classify(records)
+        except Exception as e:
+            self.server.metrics.record_request(
+                len(records), timeit.default_timer() - start_time,
+                failed=True
+            )
+            self._send_error(500, '{}: {}'.format(type(e).__name__, e))
+            return
+
+        # sequences too short (or without valid letters) to classify
+        invalid_names = [result['name'] for result in results
+                         if 'error' in result]
+        self.server.metrics.record_request(
+            len(records), timeit.default_timer() - start_time,
+            failed=bool(invalid_names)
+        )
+        if invalid_names:
+            self._send_error(400, 'no k-mers found in records: ' +
+                             ', '.join(invalid_names))
+            return
+        self._send_json(200, {result['name']: result['result']
+                              for result in results})
+
+    def address_string(self):
+        # client addresses are empty strings for Unix sockets
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix-socket'
+
+    def log_message(self, format, *args):
+        logging.getLogger('kameris').info('%s - %s', self.address_string(),
+                                          format % args)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def model_name(model):
+    name = os.path.basename(model.rstrip('/'))
+    if name.endswith('.mm-model'):
+        name = name[:-len('.mm-model')]
+    return name
+
+
+def remove_stale_socket(path):
+    """Removes a socket left at path by an earlier server, refusing to remove
+    anything else."""
+
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise Exception('{} exists and is not a socket'.format(path))
+    os.remove(path)
+
+
+def run(args):
+    # setup logging
+    log, _ = job_utils.setup_logging('', {})
+    metrics = Metrics()
+    if args.unix_socket:
+        remove_stale_socket(args.unix_socket)
+
+    # load models
+    workers = collections.OrderedDict()
+    for model in args.models:
+        name = model_name(model)
+        if name in workers:
+            raise Exception('two models are named ' + name)
+
+        model_file = classify.open_model(model, args.urls_file,
+                                         args.force_download)
+        with job_utils.log_step("loading model '{}'".format(name)):
+            model_data = classify.load_model(model_file)
+        workers[name] = ModelWorker(model_data, args.max_batch_size,
+                                    args.max_batch_wait / 1000, metrics)
+
+    # start the server
+    if args.unix_socket:
+        server = ThreadingUnixHTTPServer(args.unix_socket, RequestHandler)
+        address = args.unix_socket
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+        address = 'http://{}:{}'.format(*server.server_address[:2])
+    server.workers = workers
+    server.metrics = metrics
+
+    log.info('serving models %s at %s', ', '.join(workers), address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info('stopping server')
+    finally:
+        server.server_close()
+        if args.unix_socket:
+            try:
+                os.remove(args.unix_socket)
+            except OSError:
+                pass
@@ -1,7 +1,11 @@
 from __future__ import absolute_import, division, unicode_literals
 
+import kameris_formats
+import numpy as np
+import os
 import re
-from six.moves import zip
+import scipy.sparse as sparse
+from six.moves import range, zip
 
 
 # FASTA
@@ -50,3 +54,181 @@ def write_fasta(outfile, sequences, headers=iter(str, 0)):
 def export_fasta(filename, sequences, **kwargs):
     with open(filename, 'w') as outfile:
         write_fasta(outfile, sequences, **kwargs)
+
+
+# mm-repr
+
+def _read_array(filename, dtype, offset, shape, mmap):
+    if mmap:
+        return np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                         shape=shape)
+    else:
+        with open(filename, 'rb') as infile:
+            infile.seek(offset)
+            return np.fromfile(infile, dtype=dtype,
+                               count=int(np.prod(shape))).reshape(shape)
+
+
+def read_repr_matrix(filename, mmap=True):
+    """Reads a whole mm-repr file as a single matrix with one flattened
+    matrix per row: a dense array, or a CSR matrix if the file is sparse.
+    If mmap is True, dense data is memory-mapped instead of read into
+    memory."""
+
+    reader = kameris_formats.repr_reader(filename)
+    # the reader leaves the file positioned just after the header
+    data_offset = reader.file.tell()
+    reader.file.close()
+    shape = (int(reader.count), int(reader.rows * reader.cols))
+
+    if reader.is_sparse:
+        # each entry is a (flattened index, value) pair, stored unaligned
+        entry_type = np.dtype([('key', reader.key_type),
+                               ('value', reader.value_type)])
+        indptr = np.concatenate([[0], np.cumsum(reader.sizes)])
+        entries = _read_array(filename, entry_type, data_offset,
+                              (int(indptr[-1]),), mmap)
+        return sparse.csr_matrix(
+            (entries['value'], entries['key'].astype(np.int64), indptr),
+            shape=shape
+        )
+    else:
+        return _read_array(filename, reader.value_type, data_offset, shape,
+                           mmap)
+
+
+# the header starts with the signature b'MMREPR\0', then whether the file
+#   is sparse
+_repr_is_sparse_offset = 7
+
+
+def iter_repr_chunks(filename, chunk_size):
+    """Yields the matrices of an mm-repr file chunk_size at a time, like
+    read_repr_matrix, so that memory use is bounded."""
+
+    reader = kameris_formats.repr_reader(filename)
+    num_cols = int(reader.rows * reader.cols)
+    entry_type = np.dtype([('key', reader.key_type),
+                           ('value', reader.value_type)])
+    with reader.file as infile:
+        # the reader leaves the file positioned just after the header
+        for start in range(0, int(reader.count), chunk_size):
+            num_rows = min(chunk_size, int(reader.count) - start)
+            if reader.is_sparse:
+                sizes = reader.sizes[start:start+num_rows]
+                entries = np.fromfile(infile, dtype=entry_type,
+                                      count=int(sizes.sum()))
+                yield sparse.csr_matrix((
+                    np.ascontiguousarray(entries['value']),
+                    entries['key'].astype(np.int64),
+                    np.concatenate([[0], np.cumsum(sizes)])
+                ), shape=(num_rows, num_cols))
+            else:
+                yield np.fromfile(
+                    infile, dtype=reader.value_type, count=num_rows * num_cols
+                ).reshape(num_rows, num_cols)
+
+
+class ReprRowsReader(object):
+    """Reads ranges of the vectors of an mm-repr file (flattened, one per
+    row) from a memory map of it, as a dense array or a CSR matrix if the
+    file is sparse, so that files larger than memory can be read in
+    pieces."""
+
+    def __init__(self, filename):
+        reader = kameris_formats.repr_reader(filename)
+        # the reader leaves the file positioned just after the header
+        data_offset = reader.file.tell()
+        reader.file.close()
+        self.count = int(reader.count)
+        self.num_cols = int(reader.rows * reader.cols)
+        self.is_sparse = reader.is_sparse
+
+        if self.is_sparse:
+            entry_type = np.dtype([('key', reader.key_type),
+                                   ('value', reader.value_type)])
+            sizes = np.asarray(reader.sizes, dtype=np.int64)
+            self.indptr = np.concatenate([[0], np.cumsum(sizes)])
+            # empty files can't be memory-mapped
+            self.data = _read_array(filename, entry_type, data_offset,
+                                    (int(self.indptr[-1]),),
+                                    mmap=self.indptr[-1] > 0)
+        else:
+            self.data = _read_array(filename, reader.value_type, data_offset,
+                                    (self.count, self.num_cols), mmap=True)
+
+    def rows(self, start, stop):
+        if not self.is_sparse:
+            return self.data[start:stop]
+        indptr = self.indptr[start:stop+1]
+        entries = self.data[indptr[0]:indptr[-1]]
+        return sparse.csr_matrix((
+            np.ascontiguousarray(entries['value']),
+            entries['key'].astype(np.int64), indptr - indptr[0]
+        ), shape=(len(indptr) - 1, self.num_cols))
+
+
+class ReprRowsWriter(object):
+    """Writes an mm-repr file of count vectors of num_cols values (stored as
+    1 by num_cols matrices), given in batches as matrices with one vector per
+    row, either dense or CSR. The file is sparse if is_sparse is True."""
+
+    def __init__(self, filename, value_type, num_cols, count,
+                 is_sparse=False):
+        self.value_type = np.dtype(value_type)
+        self.count = count
+        self.is_sparse = is_sparse
+        self.num_written = 0
+        self.entry_type = np.dtype([('key', '<u8'),
+                                    ('value', self.value_type)])
+
+        # the writer only uses the matrix for its shape and type, and can't
+        #   be given a sparse one, so sparse files get a dense header which
+        #   is then marked as sparse
+        matrix_type = np.broadcast_to(np.zeros(1, dtype=self.value_type),
+                                      (1, num_cols))
+        self.file = kameris_formats.repr_writer(filename, matrix_type, count,
+                                                create_file=True).file
+        self.sizes_offset = self.file.tell()
+        if is_sparse:
+            self.file.seek(_repr_is_sparse_offset)
+            self.file.write(b'\x01')
+            # followed by a table of vector sizes
+            self.file.seek(self.sizes_offset)
+            self.file.write(np.zeros(count, dtype='<u8').tobytes())
+
+    def write(self, rows):
+        if rows.dtype != self.value_type:
+            raise ValueError('rows must have type {}, not {}'.format(
+                self.value_type, rows.dtype
+            ))
+        if self.num_written + rows.shape[0] > self.count:
+            raise ValueError('more rows than given in the header')
+
+        if not self.is_sparse:
+            if sparse.issparse(rows):
+                rows = rows.toarray()
+            self.file.write(np.ascontiguousarray(rows).tobytes())
+        else:
+            # copied, since it is modified in place
+            rows = sparse.csr_matrix(rows, copy=True)
+            rows.eliminate_zeros()
+            rows.sort_indices()
+            self.file.seek(self.sizes_offset + 8 * self.num_written)
+            self.file.write(np.diff(rows.indptr).astype('<u8').tobytes())
+
+            entries = np.empty(rows.nnz, dtype=self.entry_type)
+            entries['key'] = rows.indices
+            entries['value'] = rows.data
+            self.file.seek(0, os.SEEK_END)
+            self.file.write(entries.tobytes())
+        self.num_written += rows.shape[0]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
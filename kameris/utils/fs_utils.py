@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, unicode_literals
 
 
+import contextlib
 import os
 import shutil
 import subprocess
@@ -34,3 +35,30 @@ def cp_r(src, dest):
         shutil.copytree(src, dest)
     else:
         shutil.copy(src, dest)
+
+
+def replace_file(src, dest):
+    if hasattr(os, 'replace'):
+        os.replace(src, dest)
+    else:
+        # python 2 has no atomic replace on Windows
+        if platform.system() == 'Windows' and os.path.exists(dest):
+            os.remove(dest)
+        os.rename(src, dest)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """Opens a temporary file which replaces path once it is written, so that
+    path is never left partially written."""
+
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temp_path, mode) as outfile:
+            yield outfile
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        replace_file(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
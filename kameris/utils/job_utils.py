@@ -1,14 +1,12 @@
 from __future__ import absolute_import, division, unicode_literals
 
 
-import boto3
 import contextlib
 import logging
 import re
 import sys
 import time
 import timeit
-import watchtower
 
 
 # 'multiline lambda' support
@@ -44,6 +42,10 @@ def setup_logging(job_name, settings):
                         remote_log_settings['destination'])
         return log, formatter
 
+        # only needed for remote logging, and slow to import
+        import boto3
+        import watchtower
+
         aws_session = boto3.session.Session(
             **_make_aws_args(remote_log_settings)
         )
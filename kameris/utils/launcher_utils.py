@@ -1,7 +1,6 @@
 from __future__ import (
     absolute_import, division, print_function, unicode_literals)
 
-from distutils import spawn
 import os
 import platform
 import psutil
@@ -50,6 +49,8 @@ def spawn_shell(message=''):
                                    for l in message.splitlines())
     unix_echo_command = '; '.join("echo '{}'".format(l)
                                   for l in message.splitlines())
+    # distutils is slow to import, and only needed here
+    from distutils import spawn
 
     if platform.system() == 'Windows':
         subprocess.Popen('start cmd.exe /k "{}"'.format(win_echo_command),
@@ -0,0 +1,217 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import io
+import json
+import numpy as np
+import six
+from six.moves import cPickle as pickle
+import struct
+import sys
+
+
+# model files: a small header, JSON metadata, then pickles of the predictors
+#   in which large arrays are replaced by references to page-aligned raw
+#   arrays following them, so they can be memory-mapped
+
+_magic = b'MMMODEL\0'
+_format_version = 1
+_pickled_keys = ['predictor', 'compiled_predictor']
+# magic, format version, metadata length, pickles length
+_header = struct.Struct('<8sIQQ')
+_alignment = 4096
+# smaller arrays are just pickled
+_min_external_array_bytes = 4096
+
+
+def _aligned(offset):
+    return -(-offset // _alignment) * _alignment
+
+
+def _model_metadata(model_data):
+    metadata = {k: v for k, v in six.iteritems(model_data)
+                if k not in _pickled_keys}
+    metadata['format_version'] = _format_version
+    metadata['python_version'] = sys.version_info.major
+    if hasattr(model_data['predictor'], 'classes_'):
+        metadata['classes'] = np.asarray(
+            model_data['predictor'].classes_
+        ).tolist()
+    return metadata
+
+
+def save_model(filename, model_data):
+    """Saves a dict with a 'predictor', optionally a 'compiled_predictor', and
+    JSON-serializable metadata (for example generation_options and
+    sklearn_version)."""
+
+    # pickle each predictor separately so they can be loaded separately,
+    #   setting large arrays aside
+    arrays = []
+    array_ids = {}
+
+    def persistent_id(obj):
+        if (isinstance(obj, np.ndarray) and obj.dtype != object and
+                obj.nbytes >= _min_external_array_bytes):
+            if id(obj) not in array_ids:
+                array_ids[id(obj)] = len(arrays)
+                arrays.append(obj)
+            return str(array_ids[id(obj)])
+        return None
+
+    metadata = _model_metadata(model_data)
+    metadata['pickles'] = {}
+    pickle_file = io.BytesIO()
+    for key in _pickled_keys:
+        if key not in model_data:
+            continue
+        start = pickle_file.tell()
+        pickler = pickle.Pickler(pickle_file, protocol=2)
+        pickler.persistent_id = persistent_id
+        pickler.dump(model_data[key])
+        metadata['pickles'][key] = [start, pickle_file.tell() - start]
+    pickle_data = pickle_file.getvalue()
+
+    # lay out arrays, offsets being relative to the first one
+    metadata['arrays'] = []
+    offset = 0
+    for array in arrays:
+        fortran_order = (array.flags.f_contiguous and
+                         not array.flags.c_contiguous)
+        metadata['arrays'].append({
+            'offset': offset,
+            'dtype': array.dtype.str,
+            'shape': array.shape,
+            'fortran_order': fortran_order
+        })
+        offset = _aligned(offset + array.nbytes)
+    metadata_data = json.dumps(metadata).encode('utf-8')
+
+    with open(filename, 'wb') as outfile:
+        outfile.write(_header.pack(_magic, _format_version,
+                                   len(metadata_data), len(pickle_data)))
+        outfile.write(metadata_data)
+        outfile.write(pickle_data)
+
+        arrays_start = _aligned(outfile.tell())
+        for array, array_info in zip(arrays, metadata['arrays']):
+            outfile.seek(arrays_start + array_info['offset'])
+            outfile.write(array.tobytes(
+                order='F' if array_info['fortran_order'] else 'C'
+            ))
+
+
+def _read_header(infile):
+    header_data = infile.read(_header.size)
+    if len(header_data) < _header.size:
+        return None
+    magic, version, metadata_len, pickle_len = _header.unpack(header_data)
+    if magic != _magic:
+        return None
+    elif version > _format_version:
+        raise RuntimeError('model file format version {} is not supported, '
+                           'please upgrade'.format(version))
+
+    metadata = json.loads(infile.read(metadata_len).decode('utf-8'))
+    return metadata, pickle_len
+
+
+def _open(model_file):
+    if isinstance(model_file, six.string_types):
+        return open(model_file, 'rb')
+    return model_file
+
+
+def _has_fileno(infile):
+    try:
+        infile.fileno()
+        return True
+    except (AttributeError, io.UnsupportedOperation):
+        return False
+
+
+def _joblib_load(infile):
+    # only needed for old files, and slow to import
+    from sklearn.externals import joblib
+    return joblib.load(infile)
+
+
+def read_model_metadata(model_file):
+    """Returns a model's metadata (generation_options, classes, versions),
+    without loading its predictors from files in the current format."""
+
+    infile = _open(model_file)
+    try:
+        start = infile.tell()
+        header = _read_header(infile)
+        if header is None:
+            infile.seek(start)
+            return _model_metadata(_joblib_load(infile))
+    finally:
+        if infile is not model_file:
+            infile.close()
+    return {k: v for k, v in six.iteritems(header[0])
+            if k not in {'arrays', 'pickles'}}
+
+
+def load_model(model_file, mmap=True, prefer_compiled=False):
+    """Loads a model dict, from either a file in the current format or a
+    joblib file from older versions. model_file is a filename or a file
+    opened in binary mode.
+    Large arrays are memory-mapped (copy-on-write) if mmap is True and the
+    model is in a regular file. If prefer_compiled is True and the model has
+    a 'compiled_predictor', the full 'predictor' isn't loaded if the file
+    format allows it, which avoids importing scikit-learn."""
+
+    infile = _open(model_file)
+    try:
+        return _load_model(infile, mmap, prefer_compiled)
+    finally:
+        # memory-mapped arrays don't need the file to stay open
+        if infile is not model_file:
+            infile.close()
+
+
+def _load_model(infile, mmap, prefer_compiled):
+    start = infile.tell()
+    header = _read_header(infile)
+    if header is None:
+        infile.seek(start)
+        return _joblib_load(infile)
+    metadata, pickle_len = header
+
+    pickle_data = infile.read(pickle_len)
+    arrays_start = _aligned(infile.tell() - start)
+
+    def persistent_load(array_index):
+        array_info = metadata['arrays'][int(array_index)]
+        dtype = np.dtype(str(array_info['dtype']))
+        shape = tuple(array_info['shape'])
+        order = 'F' if array_info['fortran_order'] else 'C'
+        offset = start + arrays_start + array_info['offset']
+        # arrays must be writable, since some scikit-learn code requires it
+        #   even though nothing is written
+        if mmap and _has_fileno(infile):
+            return np.memmap(infile, dtype=dtype, mode='c', offset=offset,
+                             shape=shape, order=order).view(np.ndarray)
+        else:
+            infile.seek(offset)
+            data = bytearray(infile.read(int(np.prod(shape)) * dtype.itemsize))
+            return np.frombuffer(data, dtype=dtype).reshape(shape,
+                                                            order=order)
+
+    def unpickle(offset, length):
+        data = pickle_data[offset:offset+length]
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+
+    model_data = {k: v for k, v in six.iteritems(metadata)
+                  if k not in {'arrays', 'format_version', 'python_version',
+                               'classes', 'pickles'}}
+    pickles = metadata['pickles']
+    for key, (offset, length) in six.iteritems(pickles):
+        if (prefer_compiled and key == 'predictor' and
+                'compiled_predictor' in pickles):
+            continue
+        model_data[key] = unpickle(offset, length)
+    return model_data
@@ -0,0 +1,179 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import collections
+import multiprocessing
+import os
+import psutil
+import time
+import timeit
+
+
+def _worker_main(conn, func, args):
+    try:
+        result = ('done', func(*args))
+    except Exception as e:
+        result = ('error', '{}: {}'.format(
+            type(e).__name__,
+            (e.message if hasattr(e, 'message') else '') or str(e)
+        ))
+    conn.send(result)
+    conn.close()
+
+
+def _process_tree(pid):
+    try:
+        proc = psutil.Process(pid)
+        return [proc] + proc.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def tree_memory_usage(pid):
+    """Returns the total resident memory in bytes used by the process with the
+    given pid and all of its children."""
+
+    total = 0
+    for proc in _process_tree(pid):
+        try:
+            total += proc.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def kill_tree(pid):
+    """Kills the process with the given pid and all of its children."""
+
+    for proc in reversed(_process_tree(pid)):
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
+class _Worker(object):
+    def __init__(self, name, func, args):
+        self.name = name
+        self.conn, child_conn = multiprocessing.Pipe(duplex=False)
+        # not a daemon, since workers may need their own process pools
+        self.process = multiprocessing.Process(
+            target=_worker_main, args=(child_conn, func, args)
+        )
+        self.process.start()
+        child_conn.close()
+        self.start_time = timeit.default_timer()
+
+    def elapsed(self):
+        return timeit.default_timer() - self.start_time
+
+    def kill(self):
+        kill_tree(self.process.pid)
+        self.finish()
+
+    def finish(self):
+        self.process.join()
+        self.conn.close()
+
+
+# read by BLAS and OpenMP libraries when they are loaded
+_thread_env_vars = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS']
+
+
+def limit_threads(num_threads):
+    """Limits the threads used by BLAS and OpenMP libraries in this process
+    and the processes it starts."""
+
+    for name in _thread_env_vars:
+        os.environ[name] = str(num_threads)
+
+    # libraries which are already loaded can only be limited by threadpoolctl
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(num_threads)
+
+
+def ordered_results(pool, func, tasks, max_pending):
+    """Like pool.imap, but without reading more than max_pending tasks ahead
+    of the results consumed, so memory use stays bounded."""
+
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def run_killable(tasks, max_workers=1, timeout=None, memory_limit=None,
+                 poll_interval=0.2):
+    """Runs each (name, func, args) task in its own process, at most
+    max_workers at a time.
+    Processes running longer than timeout seconds, or whose process tree uses
+    more than memory_limit bytes, are killed.
+
+    Yields (name, result, failure) tuples as tasks finish, where failure is
+    None on success or otherwise a dict describing why the task failed.
+    func, args and the return value must be picklable."""
+
+    pending = collections.deque(tasks)
+    running = []
+    try:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                running.append(_Worker(*pending.popleft()))
+
+            for worker in list(running):
+                result = None
+                failure = None
+                # checked first, since a worker may send its result and exit
+                #   right after the pipe is polled
+                alive = worker.process.is_alive()
+                if worker.conn.poll():
+                    try:
+                        status, result = worker.conn.recv()
+                    except EOFError:
+                        status, result = 'crashed', None
+                    if status == 'error':
+                        failure = {'reason': 'error', 'message': result}
+                        result = None
+                    elif status == 'crashed':
+                        failure = {'reason': 'crashed', 'message':
+                                   'worker process exited unexpectedly'}
+                    worker.finish()
+                elif not alive:
+                    failure = {
+                        'reason': 'crashed',
+                        'message': 'worker process exited with code {}'
+                                   .format(worker.process.exitcode)
+                    }
+                    worker.finish()
+                elif timeout is not None and worker.elapsed() > timeout:
+                    failure = {
+                        'reason': 'timeout',
+                        'message': 'timed out after ~{} seconds'
+                                   .format(timeout)
+                    }
+                    worker.kill()
+                elif (memory_limit is not None and
+                      tree_memory_usage(worker.process.pid) > memory_limit):
+                    failure = {
+                        'reason': 'memory',
+                        'message': 'exceeded the memory limit of {} MB'
+                                   .format(memory_limit // (1024*1024))
+                    }
+                    worker.kill()
+                else:
+                    continue
+
+                running.remove(worker)
+                yield worker.name, result, failure
+
+            if running:
+                time.sleep(poll_interval)
+    finally:
+        for worker in running:
+            worker.kill()
@@ -85,8 +85,8 @@ setup(
         'scikit-learn==0.19.1',
         'scipy',
         'six',
-        'stopit',
         'tabulate',
+        'threadpoolctl; python_version >= "3.5"',
         'tqdm',
         'watchtower',
         'x86cpu'
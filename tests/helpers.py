@@ -1,4 +1,12 @@
+import argparse
+import json
+import numpy as np
 import os
+import random
+import scipy.sparse as sparse
+
+from kameris.job_steps import _cgr, classify
+from kameris.utils import file_formats
 
 
 class chdir(object):
@@ -11,3 +19,106 @@ class chdir(object):
 
     def __exit__(self, *args):
         os.chdir(self.old_dir)
+
+
+def synthetic_features(num_classes=3, points_per_class=20, num_features=32,
+                       seed=0):
+    """Returns non-negative features with a different mean for each class,
+    and the class of each point."""
+
+    rng = np.random.RandomState(seed)
+    means = rng.uniform(0, 1, size=(num_classes, num_features))
+    point_classes = np.repeat(['class{}'.format(i)
+                               for i in range(num_classes)],
+                              points_per_class)
+    features = np.abs(np.repeat(means, points_per_class, axis=0) +
+                      rng.normal(0, 0.3, size=(len(point_classes),
+                                               num_features)))
+    return features, point_classes
+
+
+def write_features(filename, features):
+    is_sparse = sparse.issparse(features)
+    with file_formats.ReprRowsWriter(filename, features.dtype,
+                                     features.shape[1], features.shape[0],
+                                     is_sparse=is_sparse) as writer:
+        writer.write(features)
+
+
+def classify_options(directory, features, point_classes, **options):
+    """Writes the input files of a classify step in directory and returns the
+    step's options."""
+
+    features_file = os.path.join(directory, 'features.mm-repr')
+    write_features(features_file, features)
+    metadata_file = os.path.join(directory, 'metadata.json')
+    with open(metadata_file, 'w') as outfile:
+        json.dump([{'group': point_class} for point_class in point_classes],
+                  outfile)
+
+    return dict({
+        'features_file': features_file,
+        'metadata_file': metadata_file,
+        'output_file': os.path.join(directory, 'results.json'),
+        'validation_count': 3,
+        'classifiers': ['nearest-centroid-mean', 'logistic-regression']
+    }, **options)
+
+
+def run_classify(options):
+    # the step modifies its options
+    options = dict(options)
+    random.seed(0)
+    classify.run_classify_step(options, {})
+    with open(options['output_file'], 'r') as infile:
+        return json.load(infile)
+
+
+def without_times(results):
+    """Returns classify step results without the timings, which change from
+    run to run."""
+
+    if isinstance(results, dict):
+        return {key: without_times(value) for key, value in results.items()
+                if key not in ('train_time', 'test_time')}
+    elif isinstance(results, list):
+        return [without_times(value) for value in results]
+    else:
+        return results
+
+
+def random_sequence(rng, length, gc_content):
+    return ''.join(rng.choice(list('CGAT'), size=length, p=[
+        gc_content / 2, gc_content / 2,
+        (1 - gc_content) / 2, (1 - gc_content) / 2
+    ]))
+
+
+def sequence_model(k=2, seed=0):
+    """Returns model data for a classifier telling GC-rich ('gc') sequences
+    from AT-rich ('at') ones by their k-mer frequencies."""
+
+    from sklearn.linear_model import LogisticRegression
+
+    rng = np.random.RandomState(seed)
+    sequences = [random_sequence(rng, 200, gc_content)
+                 for gc_content in [0.8] * 20 + [0.2] * 20]
+    point_classes = np.array(['gc'] * 20 + ['at'] * 20)
+    features = _cgr.frequencies(_cgr.cgr_counts(
+        [_cgr.sequence_codes([s.encode('ascii')]) for s in sequences], k, 32
+    ), 'float64')
+    return {
+        'generation_options': {'mode': 'frequencies', 'k': k,
+                               'bits_per_element': 32},
+        'sklearn_version': 'test',
+        'predictor': LogisticRegression().fit(features, point_classes)
+    }
+
+
+def parse_args(setup_args, *args):
+    """Parses command line arguments with the parser of a subcommand, given
+    its setup_args function."""
+
+    parser = argparse.ArgumentParser()
+    setup_args(parser)
+    return parser.parse_args(args)
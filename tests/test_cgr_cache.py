@@ -0,0 +1,103 @@
+import logging
+import numpy as np
+import os
+import pytest
+import scipy.sparse as sparse
+
+from kameris.job_steps import _cgr, _cgr_cache, backend
+
+from .test_kmers import kmers_options, read_file, write_fasta_dir
+
+
+def test_save_load(tmpdir):
+    cache = _cgr_cache.CGRCache(str(tmpdir), 2**20)
+    cgr = sparse.csr_matrix(np.array([[0, 3, 0, 1] * 4], dtype=np.uint16))
+    key = _cgr_cache.sequence_key(np.array([0, 1, 2, 3], dtype=np.uint8))
+
+    assert not cache.contains(key, 2, 16)
+    assert cache.load(key, 2, 16) is None
+    cache.save(key, 2, 16, cgr)
+    assert cache.contains(key, 2, 16)
+    assert not cache.contains(key, 2, 32)
+    assert not cache.contains(key, 3, 16)
+    np.testing.assert_array_equal(cache.load(key, 2, 16).toarray(),
+                                  cgr.toarray())
+
+    # unreadable files, or ones with the wrong type, aren't used
+    os.makedirs(os.path.dirname(cache._filename(key, 2, 32)))
+    with open(cache._filename(key, 2, 32), 'wb') as outfile:
+        np.savez(outfile, indices=cgr.indices, counts=cgr.data)
+    assert cache.load(key, 2, 32) is None
+    with open(cache._filename(key, 2, 16), 'wb') as outfile:
+        outfile.write(b'not a file of CGRs')
+    assert cache.load(key, 2, 16) is None
+
+
+def test_evict(tmpdir):
+    cache = _cgr_cache.CGRCache(str(tmpdir), 0)
+    cgr = sparse.csr_matrix(np.arange(16, dtype=np.uint32).reshape(1, 16))
+    keys = [_cgr_cache.sequence_key(np.array([i], dtype=np.uint8))
+            for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.save(key, 2, 32, cgr)
+        os.utime(cache._filename(key, 2, 32), (1000 + i, 1000 + i))
+    # loading a CGR makes it the most recently used
+    cache.load(keys[0], 2, 32)
+
+    cache.max_size = 2 * os.path.getsize(cache._filename(keys[0], 2, 32))
+    cache.evict()
+    assert [cache.contains(key, 2, 32) for key in keys] == [
+        True, False, False, True
+    ]
+
+
+@pytest.mark.parametrize('mode', ['counts', 'frequencies'])
+@pytest.mark.parametrize('sparse_output', [False, True])
+def test_cached_kmers(tmpdir, caplog, mode, sparse_output):
+    fasta_dir = write_fasta_dir(str(tmpdir.join('fasta')))
+    uncached = kmers_options(tmpdir, 'uncached', mode=mode, engine='numpy',
+                             sparse=sparse_output)
+    backend.run_backend_kmers(uncached, {})
+    cache_options = {'dir': str(tmpdir.join('cache'))}
+    caplog.set_level(logging.INFO, logger='kameris')
+
+    # the first run only has misses, then only the changed sequence is
+    #   computed
+    for run, expected_hits in enumerate([0, 11]):
+        cached = kmers_options(tmpdir, 'cached{}'.format(run), mode=mode,
+                               engine='numpy', sparse=sparse_output,
+                               cgr_cache=cache_options)
+        backend.run_backend_kmers(cached, {})
+        assert (read_file(cached['output_file']) ==
+                read_file(uncached['output_file']))
+        assert ('CGR cache: {} of 12 sequences found'.format(expected_hits)
+                in caplog.text)
+
+        if run == 0:
+            # changing a sequence changes its key, so it's a miss
+            with open(os.path.join(fasta_dir, '000.fasta'), 'a') as outfile:
+                outfile.write('ACGTAAAA\n')
+            backend.run_backend_kmers(uncached, {})
+
+
+def test_cached_kmers_unreadable(tmpdir, caplog):
+    fasta_dir = write_fasta_dir(str(tmpdir.join('fasta')))
+    cache_options = {'dir': str(tmpdir.join('cache'))}
+    options = kmers_options(tmpdir, 'first', engine='numpy',
+                            cgr_cache=cache_options)
+    backend.run_backend_kmers(options, {})
+    expected = read_file(options['output_file'])
+
+    cache = _cgr_cache.CGRCache(cache_options['dir'], 0)
+    filename = _cgr.fasta_files(fasta_dir)[5]
+    key = _cgr_cache.sequence_key(_cgr.read_sequence(filename))
+    with open(cache._filename(key, 4, 32), 'wb') as outfile:
+        outfile.write(b'')
+
+    caplog.set_level(logging.INFO, logger='kameris')
+    options = kmers_options(tmpdir, 'second', engine='numpy',
+                            cgr_cache=cache_options)
+    backend.run_backend_kmers(options, {})
+    assert read_file(options['output_file']) == expected
+    assert 'recomputed 1 sequences' in caplog.text
+    assert cache.load(key, 4, 32) is not None
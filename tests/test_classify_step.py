@@ -0,0 +1,237 @@
+from __future__ import division
+
+import numpy as np
+import os
+import pytest
+import scipy.sparse as sparse
+
+from kameris.job_steps import _checkpoints, classify
+from kameris.job_steps._cgr import float32_min_k, resolve_precision
+from kameris.job_steps._classifiers import classifier_factory, classifier_spec
+
+from .helpers import (classify_options, run_classify, synthetic_features,
+                      without_times)
+
+
+def test_parallel_folds_match_serial(tmpdir):
+    features, point_classes = synthetic_features()
+    options = classify_options(str(tmpdir), features, point_classes,
+                               checkpoint=False)
+
+    serial = run_classify(dict(options, n_jobs=1))
+    parallel = run_classify(dict(
+        options, n_jobs=3,
+        output_file=os.path.join(str(tmpdir), 'parallel.json')
+    ))
+    assert without_times(parallel) == without_times(serial)
+    assert serial['logistic-regression']['top1']['accuracy'] > 0.9
+
+
+class FixedProbabilities(object):
+    # gives random probabilities with many ties
+    def fit(self, features, point_classes):
+        self.classes_ = np.unique(point_classes)
+
+    def predict_proba(self, features):
+        rng = np.random.RandomState(0)
+        return rng.randint(0, 3, size=(features.shape[0],
+                                       len(self.classes_))) / 2
+
+
+def test_topN_results_match_sorting():
+    point_classes = np.array(['a', 'b', 'c', 'd'] * 10)
+    features = np.zeros((len(point_classes), 1))
+    # class 'd' is only in the test set, so it's never predicted
+    train_indexes = np.where(point_classes != 'd')[0][:20]
+    test_indexes = np.setdiff1d(np.arange(len(point_classes)), train_indexes)
+    fold_data = {
+        'train_features': features[train_indexes],
+        'test_features': features[test_indexes],
+        'fit_time': 0,
+        'transform_time': 0
+    }
+    stats = classify.classification_run(
+        FixedProbabilities, fold_data, features, point_classes,
+        np.unique(point_classes), train_indexes, test_indexes, {}
+    )
+
+    classifier = FixedProbabilities()
+    classifier.fit(None, point_classes[train_indexes])
+    probabilities = classifier.predict_proba(features[test_indexes])
+    ranked = [[c for p, c in sorted(zip(probs, classifier.classes_),
+                                    reverse=True)]
+              for probs in probabilities]
+    assert sorted(stats['topN_results']) == ['top1', 'top2']
+    for n in (1, 2):
+        misclassified = [index for index, classes in zip(test_indexes, ranked)
+                         if point_classes[index] not in classes[:n]]
+        results = stats['topN_results']['top{}'.format(n)]
+        assert results['misclassified_indexes'] == misclassified
+        assert results['accuracy'] == 1 - len(misclassified)/len(test_indexes)
+
+
+def fail_preprocessing(*args):
+    raise MemoryError()
+
+
+def test_failed_shared_preprocessing_falls_back(tmpdir, monkeypatch):
+    features, point_classes = synthetic_features()
+    options = classify_options(str(tmpdir), features, point_classes,
+                               checkpoint=False)
+    shared = run_classify(options)
+
+    monkeypatch.setattr(classify, '_preprocess_shared', fail_preprocessing)
+    fallback = run_classify(dict(
+        options, output_file=os.path.join(str(tmpdir), 'fallback.json')
+    ))
+    assert without_times(fallback) == without_times(shared)
+
+
+def test_preprocessing_limits_record_failures(tmpdir):
+    features, point_classes = synthetic_features()
+    options = classify_options(str(tmpdir), features, point_classes,
+                               checkpoint=False, memory_limit=1)
+    results = run_classify(options)
+    for label in options['classifiers']:
+        assert results[label]['failure']['reason'] == 'memory'
+
+
+def test_stratified_sample_minimum():
+    point_classes = np.array(['a'] * 50 + ['b'] * 4 + ['c'] * 2)
+    sample = classify.stratified_sample(point_classes, 0.1, min_per_class=3)
+    assert len(sample) == len(np.unique(sample))
+    assert [np.sum(point_classes[sample] == c) for c in 'abc'] == [5, 3, 2]
+
+
+def test_racing_small_stages(tmpdir):
+    features, point_classes = synthetic_features(num_classes=2,
+                                                 points_per_class=30)
+    options = classify_options(
+        str(tmpdir), features, point_classes, checkpoint=False,
+        validation_count=5,
+        classifiers=['nearest-centroid-mean', 'logistic-regression',
+                     'decision-tree'],
+        racing={'initial_fraction': 0.01, 'keep_fraction': 0.5}
+    )
+    results = run_classify(options)
+
+    num_finished = 0
+    for label in options['classifiers']:
+        stages = results[label]['racing_stages']
+        assert stages[0]['num_points'] == 10
+        assert all('failure' not in stage for stage in stages)
+        if 'eliminated_at_stage' in results[label]:
+            assert not stages[-1]['advanced']
+        else:
+            num_finished += 1
+            assert 'top1' in results[label]
+    assert num_finished == 1
+
+
+def test_classifier_factory_threads():
+    spec = classifier_spec('random-forest')
+    assert classifier_factory(spec, n_jobs=3)().n_jobs == 3
+    spec = classifier_spec({'name': 'random-forest', 'label': 'forest',
+                            'params': {'n_jobs': 2, 'n_estimators': 5}})
+    assert spec['label'] == 'forest'
+    classifier = classifier_factory(spec, n_jobs=3)()
+    assert (classifier.n_jobs, classifier.n_estimators) == (2, 5)
+    # classifiers without n_jobs don't get it
+    assert 'n_jobs' not in classifier_factory(
+        classifier_spec('decision-tree'), n_jobs=3
+    )().get_params()
+
+    with pytest.raises(ValueError):
+        classifier_factory(classifier_spec('hist-gradient-boosting'))
+
+
+def test_checkpoints_resume(tmpdir):
+    features, point_classes = synthetic_features()
+    options = classify_options(str(tmpdir), features, point_classes,
+                               classifiers=['sgd'])
+    first = run_classify(options)
+    # timings are saved too, so they only match if nothing was rerun
+    assert run_classify(options) == first
+
+    # adding a classifier before it doesn't change its seed, so results
+    #   assembled from checkpoints are those of a fresh run
+    options['classifiers'] = ['logistic-regression', 'sgd']
+    resumed = run_classify(options)
+    assert resumed['sgd'] == first['sgd']
+    fresh = run_classify(dict(
+        options, checkpoint=False,
+        output_file=os.path.join(str(tmpdir), 'fresh.json')
+    ))
+    assert without_times(resumed) == without_times(fresh)
+
+
+def test_checkpoints_check_seed(tmpdir):
+    spec = classifier_spec('sgd')
+    checkpoints = _checkpoints.Checkpoints(str(tmpdir), {})
+    checkpoints.save('key', {'spec': spec, 'seed': 1, 'data': 'results'})
+    assert classify.load_checkpoint(checkpoints, 'key', spec, 1) == 'results'
+    assert classify.load_checkpoint(checkpoints, 'key', spec, 2) is None
+
+
+def test_resolve_precision():
+    assert resolve_precision('float64', k=12) == 'float64'
+    assert resolve_precision('auto', k=3, dtype=np.float64) == 'float64'
+    assert resolve_precision('auto', k=float32_min_k) == 'float32'
+    assert resolve_precision('auto', dtype=np.float32) == 'float32'
+
+
+def test_single_precision_pipeline(tmpdir):
+    features, point_classes = synthetic_features()
+    options = classify_options(str(tmpdir), features.astype(np.float32),
+                               point_classes, checkpoint=False)
+    assert [name for name, _ in classify.build_normalizers(
+        32, dict(options, precision='float32')
+    )] == ['precision', 'scaler', 'dim_reducer', 'reduced_precision']
+
+    # float32 features are used as float32 by default
+    single = run_classify(options)
+    double = run_classify(dict(
+        options, precision='float64',
+        output_file=os.path.join(str(tmpdir), 'double.json')
+    ))
+    for label in options['classifiers']:
+        assert (single[label]['confusion_matrix'] ==
+                double[label]['confusion_matrix'])
+        assert np.isclose(single[label]['average_reduced_variance_ratio'],
+                          double[label]['average_reduced_variance_ratio'],
+                          rtol=1e-4)
+
+
+def test_sparse_features_match_dense(tmpdir):
+    features, point_classes = synthetic_features()
+    features[np.abs(features) < 1] = 0
+    assert (classify.avg_num_nonzero_entries(sparse.csr_matrix(features)) ==
+            classify.avg_num_nonzero_entries(features))
+
+    results = []
+    for i, step_features in enumerate([features,
+                                       sparse.csr_matrix(features)]):
+        directory = tmpdir.mkdir(str(i))
+        results.append(run_classify(classify_options(
+            str(directory), step_features, point_classes, checkpoint=False
+        )))
+    for label in ('nearest-centroid-mean', 'logistic-regression'):
+        assert (results[1][label]['confusion_matrix'] ==
+                results[0][label]['confusion_matrix'])
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_folds_keep_only_reduced_variance(streaming):
+    features, _ = synthetic_features()
+    options = {'dim_reduce_fraction': 0.25, 'streaming': streaming}
+    train_indexes = np.arange(0, 60, 2)
+    fold_data = classify.preprocess_fold(features, 'features', train_indexes,
+                                         np.arange(1, 60, 2), 32, options)
+    assert 'normalizer' not in fold_data
+    assert 0 < fold_data['reduced_variance_ratio'] <= 1
+
+    full_data = classify.preprocess_fold(features, 'features', slice(None),
+                                         None, 32, options)
+    reducer = full_data['normalizer'].named_steps['dim_reducer']
+    assert (full_data['reduced_variance_ratio'] ==
+            np.sum(reducer.explained_variance_ratio_))
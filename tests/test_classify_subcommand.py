@@ -0,0 +1,122 @@
+import io
+import json
+import numpy as np
+import pytest
+
+from kameris.job_steps import _cgr
+from kameris.subcommands import classify, classify_setup_args
+from kameris.utils import model_utils
+
+from .helpers import chdir, parse_args, random_sequence, sequence_model
+from .test_kmers import needs_binary
+
+
+@pytest.fixture
+def model_file(tmpdir):
+    filename = str(tmpdir.join('model.mm-model'))
+    model_utils.save_model(filename, sequence_model())
+    return filename
+
+
+def classify_args(*args):
+    return parse_args(classify_setup_args, *args)
+
+
+def write_records(filename, num_records=7):
+    rng = np.random.RandomState(0)
+    with open(filename, 'w') as outfile:
+        for i in range(num_records):
+            gc_content = 0.8 if i % 2 else 0.2
+            # one record is too short to have any k-mers
+            sequence = ('A' if i == 3 else
+                        random_sequence(rng, 300, gc_content))
+            outfile.write('>seq{} description\n{}\n'.format(i, sequence))
+
+
+def read_results(filename):
+    with open(filename, 'r') as infile:
+        return [json.loads(line) for line in infile]
+
+
+def check_results(results, top_n):
+    assert [r['name'] for r in results] == ['seq{}'.format(i)
+                                            for i in range(7)]
+    for i, result in enumerate(results):
+        if i == 3:
+            assert result['error'] == 'no k-mers found'
+        else:
+            assert len(result['result']) == top_n
+            assert result['result'][0][0] == ('gc' if i % 2 else 'at')
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_stream_classify_file(tmpdir, model_file, n_jobs):
+    fasta_file = str(tmpdir.join('sequences.fasta'))
+    write_records(fasta_file)
+    output_file = str(tmpdir.join('results.jsonl'))
+    classify.run(classify_args(model_file, fasta_file, '-o', output_file,
+                               '--top-n', '1', '--chunk-size', '2',
+                               '--n-jobs', str(n_jobs)))
+    check_results(read_results(output_file), 1)
+
+
+def test_stream_classify_stdin(tmpdir, model_file, monkeypatch):
+    fasta_file = str(tmpdir.join('sequences.fasta'))
+    write_records(fasta_file)
+    with open(fasta_file, 'rb') as infile:
+        stdin = io.TextIOWrapper(io.BytesIO(infile.read()))
+    monkeypatch.setattr('sys.stdin', stdin)
+
+    with chdir(str(tmpdir)):
+        classify.run(classify_args(model_file, '-'))
+    check_results(read_results(str(tmpdir.join('results.jsonl'))), 2)
+    # stdin is left open
+    assert not stdin.buffer.closed
+
+
+@needs_binary
+def test_classify_directory_without_top_n(tmpdir, model_file):
+    fasta_dir = tmpdir.mkdir('fasta')
+    fasta_dir.join('a.fasta').write('>a\n' + 'GC' * 100 + '\n')
+    fasta_dir.join('b.fasta').write('>b\n' + 'AT' * 100 + '\n')
+    output_file = str(tmpdir.join('results.json'))
+    classify.run(classify_args(model_file, str(fasta_dir), '-o',
+                               output_file, '--disable-avx'))
+    with open(output_file, 'r') as infile:
+        results = json.load(infile)
+    assert results['a.fasta'][0][0] == 'gc'
+    assert len(results['b.fasta']) == 2
+
+
+def test_predict_top_n():
+    model_data = sequence_model()
+    features = np.full((3, 16), 1 / 16)
+    assert [len(r) for r in classify.predict(model_data['predictor'],
+                                             features)] == [2, 2, 2]
+    assert [len(r) for r in classify.predict(model_data['predictor'],
+                                             features, 1)] == [1, 1, 1]
+
+
+def test_classify_records_sparse():
+    rng = np.random.RandomState(1)
+    sequences = ['A', random_sequence(rng, 300, 0.8),
+                 random_sequence(rng, 300, 0.2), 'ACGTN' * 30]
+    records = [('seq{}'.format(i), _cgr.sequence_codes([s.encode('ascii')]))
+               for i, s in enumerate(sequences)]
+    model_data = sequence_model()
+    sparse_model_data = dict(model_data, generation_options=dict(
+        model_data['generation_options'], sparse=True
+    ))
+
+    results = classify.classify_records(model_data, records)
+    assert results[0]['error'] == 'no k-mers found'
+    assert [r['result'][0][0] for r in results[1:3]] == ['gc', 'at']
+    sparse_results = classify.classify_records(sparse_model_data, records)
+    assert [r['name'] for r in sparse_results] == [r['name'] for r in results]
+    assert sparse_results[0] == results[0]
+    for sparse_result, result in zip(sparse_results[1:], results[1:]):
+        assert [c for c, _ in sparse_result['result']] == [
+            c for c, _ in result['result']
+        ]
+        np.testing.assert_allclose([p for _, p in sparse_result['result']],
+                                   [p for _, p in result['result']])
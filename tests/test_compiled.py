@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import scipy.sparse as sparse
+from sklearn.decomposition import TruncatedSVD
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.neighbors import KNeighborsClassifier, NearestCentroid
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC, LinearSVC
+
+from kameris.job_steps._compiled import compile_pipeline
+from kameris.job_steps._kernels import KernelSVC
+
+from .helpers import synthetic_features
+
+
+def fitted_pipeline(classifier, num_classes):
+    features, point_classes = synthetic_features(num_classes=num_classes)
+    pipeline = Pipeline([('scaler', StandardScaler(with_mean=False)),
+                         ('dim_reducer', TruncatedSVD(n_components=5,
+                                                      random_state=0)),
+                         ('classifier', classifier)])
+    return pipeline.fit(features, point_classes), features
+
+
+@pytest.mark.parametrize('num_classes', [2, 4])
+@pytest.mark.parametrize('classifier', [
+    LogisticRegression(), SGDClassifier(random_state=0), LinearSVC(),
+    SVC(kernel='linear'), KernelSVC(kernel='linear'),
+    LinearDiscriminantAnalysis(), NearestCentroid()
+])
+def test_compile_linear_pipeline(classifier, num_classes):
+    if isinstance(classifier, NearestCentroid) and \
+            hasattr(classifier, 'predict_proba'):
+        pytest.skip('newer versions of NearestCentroid have probabilities '
+                    'which are not linear')
+    pipeline, features = fitted_pipeline(classifier, num_classes)
+    compiled = compile_pipeline(pipeline, features)
+    assert compiled is not None
+
+    for test_features in (features, sparse.csr_matrix(features)):
+        np.testing.assert_array_equal(compiled.predict(test_features),
+                                      pipeline.predict(features))
+    if hasattr(pipeline, 'predict_proba'):
+        np.testing.assert_allclose(compiled.predict_proba(features),
+                                   pipeline.predict_proba(features),
+                                   rtol=1e-4, atol=1e-6)
+    else:
+        assert not hasattr(compiled, 'predict_proba')
+
+
+@pytest.mark.parametrize('classifier', [
+    KNeighborsClassifier(), SVC(kernel='rbf'),
+    NearestCentroid(metric='manhattan')
+])
+def test_nonlinear_pipelines_are_not_compiled(classifier):
+    pipeline, features = fitted_pipeline(classifier, 3)
+    assert compile_pipeline(pipeline, features) is None
@@ -1,12 +1,13 @@
 from backports import tempfile
-import dotmap
 import json
 import os
 import zipfile
 
-from kameris.subcommands import classify, run_job, summarize
+from kameris.subcommands import (classify, classify_setup_args, run_job,
+                                 run_job_setup_args, summarize,
+                                 summarize_setup_args)
 
-from .helpers import chdir
+from .helpers import chdir, parse_args
 
 
 def check_classify_model(model, tempdir, check_results=True):
@@ -18,12 +19,8 @@ def check_classify_model(model, tempdir, check_results=True):
 
         # run classification
         with chdir(tempdir):
-            args = dotmap.DotMap({
-                'model': model,
-                'files': genomes_dir,
-                'disable_avx': True
-            })
-            classify.run(args)
+            classify.run(parse_args(classify_setup_args, model, genomes_dir,
+                                    '--disable-avx'))
 
             # check results
             with open('results.json', 'r') as f:
@@ -44,22 +41,17 @@ def test_classify_existing_model(shared_tempdir):
 def test_train_model(shared_tempdir):
     root_dir = os.getcwd()
     with chdir(shared_tempdir):
-        args = dotmap.DotMap({
-            'job_file': os.path.join(root_dir, 'tests', 'fixtures',
-                                     'hiv1-lanl-small.yml'),
-            'settings_file': os.path.join(root_dir, 'demo', 'settings.yml'),
-            'disable_avx': True
-        })
-        run_job.run(args)
+        run_job.run(parse_args(
+            run_job_setup_args,
+            os.path.join(root_dir, 'tests', 'fixtures', 'hiv1-lanl-small.yml'),
+            os.path.join(root_dir, 'demo', 'settings.yml'), '--disable-avx'
+        ))
 
 
 def test_summarize(shared_tempdir):
     with chdir(shared_tempdir):
-        args = dotmap.DotMap({
-            'job_dir': os.path.join('output', 'hiv1-lanl-whole'),
-            'top_n': 1
-        })
-        summarize.run(args)
+        summarize.run(parse_args(summarize_setup_args,
+                                 os.path.join('output', 'hiv1-lanl-whole')))
 
 
 def test_classify_new_model(shared_tempdir):
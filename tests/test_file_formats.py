@@ -0,0 +1,85 @@
+import kameris_formats
+import numpy as np
+import pytest
+import scipy.sparse as sparse
+
+from kameris.utils import file_formats
+
+from .helpers import write_features
+
+
+def test_read_repr_matrix_dense(tmpdir):
+    filename = str(tmpdir.join('features.mm-repr'))
+    features = np.random.RandomState(0).uniform(size=(7, 12))
+    write_features(filename, features)
+
+    reader = kameris_formats.repr_reader(filename)
+    rows = np.array([reader.read_matrix(i, flatten=True) for i in range(7)])
+    reader.file.close()
+
+    mapped = file_formats.read_repr_matrix(filename)
+    assert isinstance(mapped, np.memmap)
+    np.testing.assert_array_equal(mapped, rows)
+    np.testing.assert_array_equal(
+        file_formats.read_repr_matrix(filename, mmap=False), rows
+    )
+
+
+def sparse_features():
+    rng = np.random.RandomState(0)
+    features = rng.randint(1, 10, size=(9, 20)) * (rng.uniform(
+        size=(9, 20)) < 0.2)
+    # including vectors with no entries
+    features[[0, 4, 8]] = 0
+    return features.astype(np.uint32)
+
+
+def test_sparse_repr_files(tmpdir):
+    filename = str(tmpdir.join('features.mm-repr'))
+    features = sparse_features()
+    with file_formats.ReprRowsWriter(filename, np.uint32, 20, len(features),
+                                     is_sparse=True) as writer:
+        # given in batches, dense and sparse
+        writer.write(features[:2])
+        writer.write(sparse.csr_matrix(features[2:7]))
+        writer.write(features[7:])
+
+    reader = kameris_formats.repr_reader(filename)
+    reader.file.close()
+    assert reader.is_sparse
+    np.testing.assert_array_equal(reader.sizes,
+                                  np.count_nonzero(features, axis=1))
+
+    for mmap in (True, False):
+        matrix = file_formats.read_repr_matrix(filename, mmap=mmap)
+        assert sparse.isspmatrix_csr(matrix) and matrix.dtype == np.uint32
+        np.testing.assert_array_equal(matrix.toarray(), features)
+    for chunk_size in (1, 4, 100):
+        chunks = list(file_formats.iter_repr_chunks(filename, chunk_size))
+        assert all(sparse.isspmatrix_csr(chunk) for chunk in chunks)
+        np.testing.assert_array_equal(sparse.vstack(chunks).toarray(),
+                                      features)
+    rows_reader = file_formats.ReprRowsReader(filename)
+    for start, stop in [(0, 9), (0, 1), (3, 7), (4, 5), (8, 9)]:
+        np.testing.assert_array_equal(
+            rows_reader.rows(start, stop).toarray(), features[start:stop]
+        )
+
+
+def test_sparse_repr_file_without_entries(tmpdir):
+    filename = str(tmpdir.join('features.mm-repr'))
+    with file_formats.ReprRowsWriter(filename, np.float32, 8, 3,
+                                     is_sparse=True) as writer:
+        writer.write(np.zeros((3, 8), dtype=np.float32))
+    assert file_formats.ReprRowsReader(filename).rows(0, 3).nnz == 0
+    assert file_formats.read_repr_matrix(filename).shape == (3, 8)
+
+
+def test_repr_rows_writer_checks_rows(tmpdir):
+    filename = str(tmpdir.join('features.mm-repr'))
+    with file_formats.ReprRowsWriter(filename, np.float32, 4, 2) as writer:
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((1, 4), dtype=np.float64))
+        writer.write(np.zeros((2, 4), dtype=np.float32))
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((1, 4), dtype=np.float32))
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+import scipy.sparse as sparse
+
+from kameris.job_steps import _cgr, _hashed_kmers, backend
+from kameris.utils import file_formats
+
+from .helpers import random_sequence
+from .test_kmers import kmers_options, read_file, write_fasta_dir
+
+
+def sequence_codes(sequence):
+    if not sequence:
+        return np.zeros(0, dtype=np.uint8)
+    return _cgr.sequence_codes([sequence.encode('ascii')])
+
+
+def naive_hashes(codes, k):
+    kmers = []
+    for start in range(len(codes) - k + 1):
+        window = codes[start:start+k]
+        if (window == _cgr._invalid_code).any():
+            continue
+        kmers.append(sum(int(code) << (2 * i)
+                         for i, code in enumerate(window)))
+    return _hashed_kmers._mix(np.array(kmers, dtype=np.uint64))
+
+
+@pytest.mark.parametrize('k', [1, 2, 5, 12, 31, 32])
+def test_kmer_hashes(k):
+    rng = np.random.RandomState(k)
+    sequence = random_sequence(rng, 150, 0.5)
+    sequence = sequence[:40] + 'N' + sequence[40:90] + 'RY' + sequence[90:]
+    codes = sequence_codes(sequence)
+    np.testing.assert_array_equal(_hashed_kmers.kmer_hashes(codes, k),
+                                  naive_hashes(codes, k))
+    # too short sequences have no k-mers
+    assert len(_hashed_kmers.kmer_hashes(codes[:k-1], k)) == 0
+
+
+def test_canonical_kmer_hashes():
+    rng = np.random.RandomState(0)
+    sequence = random_sequence(rng, 200, 0.5)
+    complements = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N': 'N'}
+    sequence = sequence[:100] + 'N' + sequence[100:]
+    reverse_complement = ''.join(complements[letter]
+                                 for letter in reversed(sequence))
+
+    for k in (3, 15, 32):
+        hashes = _hashed_kmers.kmer_hashes(sequence_codes(sequence), k,
+                                           canonical=True)
+        reverse_hashes = _hashed_kmers.kmer_hashes(
+            sequence_codes(reverse_complement), k, canonical=True
+        )
+        np.testing.assert_array_equal(hashes, reverse_hashes[::-1])
+        assert not np.array_equal(
+            _hashed_kmers.kmer_hashes(sequence_codes(sequence), k),
+            _hashed_kmers.kmer_hashes(sequence_codes(reverse_complement),
+                                      k)[::-1]
+        )
+
+
+def test_hashed_counts():
+    rng = np.random.RandomState(0)
+    sequences_codes = [sequence_codes(random_sequence(rng, length, 0.5))
+                       for length in (0, 5, 100, 300)]
+    counts = _hashed_kmers.hashed_counts(sequences_codes, 20, 64)
+    assert counts.shape == (4, 64) and counts.dtype == np.uint32
+    np.testing.assert_array_equal(counts.sum(axis=1), [0, 0, 81, 281])
+    np.testing.assert_array_equal(
+        counts[3], np.bincount(_hashed_kmers.kmer_buckets(
+            sequences_codes[3], 20, 64
+        ), minlength=64)
+    )
+
+    sparse_counts = _hashed_kmers.hashed_counts(sequences_codes, 20, 64,
+                                                sparse_output=True)
+    assert sparse_counts.dtype == np.uint32
+    np.testing.assert_array_equal(sparse_counts.toarray(), counts)
+
+
+def test_hashed_kmers_step(tmpdir):
+    fasta_dir = write_fasta_dir(str(tmpdir.join('fasta')))
+    options = kmers_options(tmpdir, 'dense', mode='hashed', k=24,
+                            num_buckets=128)
+    backend.run_backend_kmers(options, {})
+
+    counts = _hashed_kmers.hashed_counts(
+        [_cgr.read_sequence(f) for f in _cgr.fasta_files(fasta_dir)], 24, 128
+    )
+    features = file_formats.read_repr_matrix(options['output_file'])
+    assert features.dtype == np.float32
+    # sequences shorter than k have no k-mers, and so all-zero rows
+    empty = counts.sum(axis=1) == 0
+    assert empty.any() and not empty.all()
+    assert not features[empty].any()
+    np.testing.assert_array_equal(
+        features[~empty], (counts[~empty] / counts[~empty].sum(
+            axis=1, keepdims=True
+        )).astype(np.float32)
+    )
+
+    parallel = kmers_options(tmpdir, 'parallel', mode='hashed', k=24,
+                             num_buckets=128, n_jobs=3)
+    backend.run_backend_kmers(parallel, {})
+    assert read_file(parallel['output_file']) == read_file(
+        options['output_file']
+    )
+    sparse_options = kmers_options(tmpdir, 'sparse', mode='hashed', k=24,
+                                   num_buckets=128, sparse=True)
+    backend.run_backend_kmers(sparse_options, {})
+    np.testing.assert_array_equal(
+        file_formats.read_repr_matrix(sparse_options['output_file']).toarray(),
+        features
+    )
+
+
+def test_frequencies_of_empty_rows():
+    counts = np.array([[0, 0, 0], [1, 3, 0]], dtype=np.uint32)
+    expected = np.array([[0, 0, 0], [0.25, 0.75, 0]], dtype=np.float32)
+    with np.errstate(all='raise'):
+        np.testing.assert_array_equal(_cgr.frequencies(counts, 'float32'),
+                                      expected)
+        np.testing.assert_array_equal(_cgr.frequencies(
+            sparse.csr_matrix(counts), 'float32'
+        ).toarray(), expected)
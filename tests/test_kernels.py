@@ -0,0 +1,54 @@
+import numpy as np
+import os
+import pytest
+import scipy.sparse as sparse
+from sklearn.svm import SVC
+
+from kameris.job_steps._kernels import InnerProducts, KernelSVC
+
+from .helpers import classify_options, run_classify, synthetic_features
+
+
+@pytest.mark.parametrize('params', [
+    {'kernel': 'linear'},
+    {'kernel': 'poly', 'degree': 2, 'gamma': 0.1, 'coef0': 1},
+    {'kernel': 'rbf', 'gamma': 0.05}
+])
+def test_kernel_svc_matches_svc(params):
+    features, point_classes = synthetic_features()
+    train, test = features[::2], features[1::2]
+    # the solver's tolerance is tight, so rounding doesn't change the result
+    params = dict(params, tol=1e-10)
+    expected = SVC(**params).fit(train, point_classes[::2])
+
+    for train_features in (train, sparse.csr_matrix(train)):
+        classifier = KernelSVC(**params).fit(InnerProducts(train_features),
+                                             point_classes[::2])
+        test_products = InnerProducts(test, train_features)
+        for test_features in (test_products, test):
+            np.testing.assert_allclose(
+                classifier.decision_function(test_features),
+                expected.decision_function(test), atol=1e-6
+            )
+            np.testing.assert_array_equal(classifier.predict(test_features),
+                                          expected.predict(test))
+
+
+def test_precomputed_kernels_step(tmpdir):
+    features, point_classes = synthetic_features()
+    options = classify_options(str(tmpdir), features, point_classes,
+                               checkpoint=False, classifiers=[
+                                   'linear-svm',
+                                   {'name': 'rbf-svm',
+                                    'params': {'gamma': 0.2}}
+                               ])
+    separate = run_classify(options)
+    shared = run_classify(dict(
+        options, precomputed_kernels=True,
+        output_file=os.path.join(str(tmpdir), 'shared.json')
+    ))
+    # iterations are only reported by some versions of SVC
+    for label in ('linear-svm', 'rbf-svm'):
+        for key in ('confusion_matrix', 'top1',
+                    'average_reduced_variance_ratio'):
+            assert shared[label][key] == separate[label][key]
@@ -0,0 +1,275 @@
+import numpy as np
+import os
+import pytest
+import scipy.sparse as sparse
+import shlex
+import threading
+import time
+
+from kameris.job_steps import _cgr, backend
+from kameris.utils import file_formats
+
+from .helpers import random_sequence
+
+
+def write_fasta_dir(directory, num_files=12, seed=0):
+    rng = np.random.RandomState(seed)
+    os.mkdir(directory)
+    for i in range(num_files):
+        sequence = random_sequence(rng, rng.randint(1, 400), 0.5)
+        if i % 3 == 0:
+            # other letters, also at the start
+            sequence = 'N' + sequence[:50] + 'RYN' + sequence[50:]
+        with open(os.path.join(directory, '{:03}.fasta'.format(i)),
+                  'w') as outfile:
+            outfile.write('>seq{}\n{}\n'.format(i, sequence))
+    return directory
+
+
+def native_binary_missing():
+    try:
+        return not os.path.exists(backend.binary_path('generation_cgr',
+                                                      False))
+    except ImportError:
+        return True
+
+
+needs_binary = pytest.mark.skipif(native_binary_missing(),
+                                  reason='the CGR binary is not available')
+
+
+def naive_cgr(sequence, k):
+    counts = np.zeros(4**k, dtype=np.uint32)
+    codes = ['CGAT'.index(letter) for letter in sequence]
+    for start in range(len(codes) - k + 1):
+        row = col = 0
+        for i, code in enumerate(codes[start:start+k]):
+            row |= (code >> 1) << i
+            col |= (code & 1) << i
+        counts[(row << k) | col] += 1
+    return counts
+
+
+@pytest.mark.parametrize('k', [1, 3, 5])
+def test_cgr_counts(k):
+    rng = np.random.RandomState(k)
+    sequences = [random_sequence(rng, length, 0.5)
+                 for length in (0, k - 1, k, 100, 257)]
+    codes = [_cgr.sequence_codes([s.encode('ascii')]) if s else
+             np.zeros(0, dtype=np.uint8) for s in sequences]
+    expected = np.array([naive_cgr(s, k) for s in sequences])
+    np.testing.assert_array_equal(_cgr.cgr_counts(codes, k, 32), expected)
+    np.testing.assert_array_equal(
+        _cgr.cgr_counts(codes, k, 32, sparse_output=True).toarray(), expected
+    )
+
+
+def kmers_options(tmpdir, name, **options):
+    return dict({
+        'fasta_output_dir': str(tmpdir.join('fasta')),
+        'output_file': str(tmpdir.join(name + '.mm-repr')),
+        'k': 4,
+        'bits_per_element': 32,
+        'mode': 'counts',
+        'disable_avx': True
+    }, **options)
+
+
+def read_file(filename):
+    with open(filename, 'rb') as infile:
+        return infile.read()
+
+
+@needs_binary
+@pytest.mark.parametrize('mode', ['counts', 'frequencies'])
+def test_numpy_engine_matches_binary(tmpdir, mode):
+    write_fasta_dir(str(tmpdir.join('fasta')))
+    native = kmers_options(tmpdir, 'native', mode=mode)
+    backend.run_backend_kmers(native, {})
+    numpy_engine = kmers_options(tmpdir, 'numpy', mode=mode, engine='numpy',
+                                 n_jobs=3)
+    backend.run_backend_kmers(numpy_engine, {})
+    assert (read_file(numpy_engine['output_file']) ==
+            read_file(native['output_file']))
+
+
+def test_numpy_engine(tmpdir):
+    fasta_dir = write_fasta_dir(str(tmpdir.join('fasta')))
+    options = kmers_options(tmpdir, 'numpy', engine='numpy')
+    backend.run_backend_kmers(options, {})
+    expected = [_cgr.cgr_counts([_cgr.read_sequence(f)], 4, 32)[0]
+                for f in _cgr.fasta_files(fasta_dir)]
+    np.testing.assert_array_equal(
+        file_formats.read_repr_matrix(options['output_file']), expected
+    )
+
+
+def test_map_file_batches_bounds_pending(tmpdir):
+    filenames = [str(tmpdir.join(str(i))) for i in range(40)]
+    for filename in filenames:
+        tmpdir.join(os.path.basename(filename)).write('>a\nACGT\n')
+
+    lock = threading.Lock()
+    finished = []
+
+    def func(batch):
+        with lock:
+            finished.append(batch)
+        return batch
+
+    consumed = 0
+    for batch in _cgr.map_file_batches(func, filenames, 1, n_jobs=2):
+        # give the threads time to run ahead
+        time.sleep(0.005)
+        consumed += 1
+        with lock:
+            assert len(finished) - consumed <= 4
+    assert consumed == 40
+
+
+@pytest.mark.parametrize('n_jobs', [1, 3])
+@pytest.mark.parametrize('sparse_output', [False, True])
+def test_rewrite_repr_file(tmpdir, n_jobs, sparse_output):
+    rng = np.random.RandomState(0)
+    counts = rng.randint(0, 5, size=(10, 64)).astype(np.uint32)
+    counts[:, 0] += 1
+    filename = str(tmpdir.join('counts.mm-repr'))
+    with file_formats.ReprRowsWriter(filename, np.uint32, 64,
+                                     len(counts)) as writer:
+        writer.write(counts)
+
+    backend._rewrite_repr_file(filename, 3, n_jobs, 'float32', sparse_output)
+    result = file_formats.read_repr_matrix(filename)
+    assert result.dtype == np.float32
+    assert sparse.issparse(result) == sparse_output
+    if sparse_output:
+        result = result.toarray()
+    np.testing.assert_array_equal(result,
+                                  _cgr.frequencies(counts, 'float32'))
+    assert tmpdir.listdir() == [tmpdir.join('counts.mm-repr')]
+
+
+def test_rewrite_repr_file_only_sparse(tmpdir):
+    counts = np.eye(5, 16, dtype=np.uint16) * 7
+    filename = str(tmpdir.join('counts.mm-repr'))
+    with file_formats.ReprRowsWriter(filename, np.uint16, 16,
+                                     len(counts)) as writer:
+        writer.write(counts)
+
+    backend._rewrite_repr_file(filename, 2, 1, sparse_output=True)
+    result = file_formats.read_repr_matrix(filename)
+    assert result.dtype == np.uint16 and result.nnz == 5
+    np.testing.assert_array_equal(result.toarray(), counts)
+
+
+def test_shard_files(tmpdir):
+    sizes = [100, 5, 5, 5, 300, 10, 10, 1, 1]
+    filenames = []
+    for i, size in enumerate(sizes):
+        filenames.append(str(tmpdir.join(str(i))))
+        tmpdir.join(str(i)).write('A' * size)
+
+    for num_shards in range(1, len(sizes) + 1):
+        shards = backend._shard_files(filenames, num_shards)
+        assert len(shards) == num_shards
+        assert all(shards)
+        assert sum(shards, []) == filenames
+    assert backend._shard_files(filenames, 2) == [filenames[:4],
+                                                  filenames[4:]]
+
+
+def fake_cgr_command(options, affinities):
+    # runs the NumPy engine instead of the binary, whose output it matches
+    def run_command_logged(command, **kwargs):
+        assert 'preexec_fn' not in kwargs
+        if hasattr(os, 'sched_getaffinity'):
+            affinities.append(os.sched_getaffinity(0))
+        fasta_dir, output_file = shlex.split(command)[2:4]
+        backend._run_numpy_kmers(dict(options, mode='counts',
+                                      fasta_output_dir=fasta_dir,
+                                      output_file=output_file))
+    return run_command_logged
+
+
+@pytest.mark.parametrize('mode', ['counts', 'frequencies'])
+def test_sharded_kmers(tmpdir, monkeypatch, mode):
+    write_fasta_dir(str(tmpdir.join('fasta')))
+    single = kmers_options(tmpdir, 'single', mode=mode, engine='numpy')
+    backend.run_backend_kmers(single, {})
+
+    options = kmers_options(tmpdir, 'sharded', mode=mode, shards=3)
+    affinities = []
+    monkeypatch.setattr(backend._command, 'run_command_logged',
+                        fake_cgr_command(options, affinities))
+    if hasattr(os, 'sched_setaffinity'):
+        cpus = os.sched_getaffinity(0)
+        shard_cpus = [{cpu} for cpu in sorted(cpus)[:1] * 3]
+        monkeypatch.setattr(backend, '_shard_cpus',
+                            lambda num_shards: shard_cpus)
+    backend.run_backend_kmers(options, {})
+    assert (read_file(options['output_file']) ==
+            read_file(single['output_file']))
+    if hasattr(os, 'sched_setaffinity'):
+        assert affinities == shard_cpus
+        assert os.sched_getaffinity(0) == cpus
+
+
+@needs_binary
+def test_sharded_kmers_match_binary(tmpdir):
+    write_fasta_dir(str(tmpdir.join('fasta')), num_files=20)
+    single = kmers_options(tmpdir, 'single')
+    backend.run_backend_kmers(single, {})
+    sharded = kmers_options(tmpdir, 'sharded', shards=4)
+    backend.run_backend_kmers(sharded, {})
+    assert (read_file(sharded['output_file']) ==
+            read_file(single['output_file']))
+
+
+def derived_options(tmpdir, exp_name, **options):
+    tmpdir.join(exp_name).ensure(dir=True)
+    return kmers_options(tmpdir, os.path.join(exp_name, 'kmers'),
+                         engine='numpy', **options)
+
+
+@pytest.mark.parametrize('mode', ['counts', 'frequencies'])
+def test_derived_kmers(tmpdir, mode):
+    write_fasta_dir(str(tmpdir.join('fasta')))
+    first = derived_options(tmpdir, 'first', mode=mode,
+                            derive_k_values=[2, 3])
+    backend.run_backend_kmers(first, {})
+    second = derived_options(tmpdir, 'second', mode=mode, k=3,
+                             derived_from_dir=str(tmpdir.join('first')))
+    backend.run_backend_kmers(second, {})
+    assert not tmpdir.join('first', 'derived-k3-kmers.mm-repr').exists()
+    assert not tmpdir.join('first', 'derived-k3-kmers.mm-repr.json').exists()
+
+    for options in (first, second):
+        direct = derived_options(tmpdir, 'direct', mode=mode,
+                                 k=options['k'])
+        backend.run_backend_kmers(direct, {})
+        assert (read_file(options['output_file']) ==
+                read_file(direct['output_file']))
+
+
+@pytest.mark.parametrize('change', ['sequences', 'options', 'stamp'])
+def test_stale_derived_kmers(tmpdir, change):
+    fasta_dir = write_fasta_dir(str(tmpdir.join('fasta')))
+    backend.run_backend_kmers(derived_options(tmpdir, 'first',
+                                              derive_k_values=[3]), {})
+    second_options = {}
+    if change == 'sequences':
+        with open(os.path.join(fasta_dir, '000.fasta'), 'a') as outfile:
+            outfile.write('ACGTACGT\n')
+    elif change == 'options':
+        second_options['bits_per_element'] = 16
+    else:
+        tmpdir.join('first', 'derived-k3-kmers.mm-repr.json').remove()
+
+    second = derived_options(tmpdir, 'second', k=3,
+                             derived_from_dir=str(tmpdir.join('first')),
+                             **second_options)
+    backend.run_backend_kmers(second, {})
+    direct = derived_options(tmpdir, 'direct', k=3, **second_options)
+    backend.run_backend_kmers(direct, {})
+    assert (read_file(second['output_file']) ==
+            read_file(direct['output_file']))
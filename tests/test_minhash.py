@@ -0,0 +1,139 @@
+import kameris_formats
+import numpy as np
+from multiprocessing.pool import ThreadPool
+import os
+import pytest
+
+from kameris.job_steps import _cgr, _hashed_kmers, _minhash, backend
+
+from .helpers import random_sequence
+
+
+def mutated(rng, sequence, rate):
+    letters = np.array(list(sequence))
+    positions = rng.uniform(size=len(letters)) < rate
+    letters[positions] = rng.choice(list('ACGT'), np.count_nonzero(positions))
+    return ''.join(letters)
+
+
+def related_sequences(num_sequences=8, length=3000, seed=0):
+    rng = np.random.RandomState(seed)
+    base = random_sequence(rng, length, 0.5)
+    return [mutated(rng, base, 0.005 * i) for i in range(num_sequences)]
+
+
+def sequence_codes(sequence):
+    return _cgr.sequence_codes([sequence.encode('ascii')])
+
+
+def brute_force_sketch(codes, k, size):
+    result = np.full(size, _minhash._empty, dtype=np.uint64)
+    for value in set(_hashed_kmers.kmer_hashes(codes, k, canonical=True)):
+        bin_index = int(value % np.uint64(size))
+        result[bin_index] = min(result[bin_index], value)
+    return result
+
+
+def sketch_distance(first, second, k):
+    both_empty = (first == _minhash._empty) & (second == _minhash._empty)
+    shared = np.count_nonzero((first == second) & ~both_empty)
+    jaccard = shared / max(len(first) - np.count_nonzero(both_empty), 1)
+    if jaccard == 0:
+        return 1
+    return min(-np.log(2 * jaccard / (1 + jaccard)) / k, 1)
+
+
+def test_sketch():
+    codes = sequence_codes(related_sequences(1, 500)[0])
+    for size in (1, 16, 1000):
+        np.testing.assert_array_equal(_minhash.sketch(codes, 11, size),
+                                      brute_force_sketch(codes, 11, size))
+    # too short sequences have empty sketches
+    assert (_minhash.sketch(codes[:10], 11, 16) == _minhash._empty).all()
+
+
+@pytest.mark.parametrize('n_jobs', [1, 3])
+def test_distance_rows(monkeypatch, n_jobs):
+    k = 11
+    sketches = np.array([_minhash.sketch(sequence_codes(s), k, 64)
+                         for s in related_sequences(length=400)] +
+                        [_minhash.sketch(sequence_codes('ACGT'), k, 64)])
+    # in many small blocks
+    monkeypatch.setattr(_minhash, '_max_block_dists', 20)
+    pool = ThreadPool(n_jobs) if n_jobs > 1 else None
+    try:
+        rows = list(_minhash.iter_distance_rows(sketches, k, pool, 2))
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    assert [len(row) for row in rows] == list(range(len(sketches) - 1,
+                                                    -1, -1))
+    for i, row in enumerate(rows):
+        assert row.dtype == np.float32
+        np.testing.assert_allclose(
+            row, [sketch_distance(sketches[i], sketches[j], k)
+                  for j in range(i + 1, len(sketches))], rtol=1e-6
+        )
+
+
+def test_jaccard_accuracy():
+    k = 15
+    codes = [sequence_codes(s) for s in related_sequences(seed=1)]
+    kmer_sets = [set(_hashed_kmers.kmer_hashes(c, k, canonical=True))
+                 for c in codes]
+    errors = {}
+    for size in (100, 1000):
+        sketches = [_minhash.sketch(c, k, size) for c in codes]
+        errors[size] = []
+        for i in range(len(codes)):
+            for j in range(i + 1, len(codes)):
+                exact = (len(kmer_sets[i] & kmer_sets[j]) /
+                         len(kmer_sets[i] | kmer_sets[j]))
+                distance = sketch_distance(sketches[i], sketches[j], k)
+                # the Jaccard index giving this Mash distance
+                estimate = 1 / (2 * np.exp(k * distance) - 1)
+                errors[size].append(abs(estimate - exact))
+    assert np.mean(errors[1000]) < 0.02
+    assert np.max(errors[1000]) < 0.06
+    assert np.mean(errors[1000]) < np.mean(errors[100])
+
+
+def test_minhash_step(tmpdir, monkeypatch):
+    fasta_dir = tmpdir.mkdir('fasta')
+    sequences = related_sequences(length=500)
+    for i, sequence in enumerate(sequences):
+        fasta_dir.join('{:03}.fasta'.format(i)).write(
+            '>seq{}\n{}\n'.format(i, sequence)
+        )
+    k = 13
+    sketches = np.array([_minhash.sketch(sequence_codes(s), k, 200)
+                         for s in sequences])
+    expected = np.zeros((len(sequences), len(sequences)))
+    for i in range(len(sequences)):
+        for j in range(i + 1, len(sequences)):
+            expected[i, j] = expected[j, i] = sketch_distance(
+                sketches[i], sketches[j], k
+            )
+
+    cache_options = {'dir': str(tmpdir.join('cache'))}
+    for run in range(2):
+        options = {
+            'distances': ['minhash'],
+            'fasta_output_dir': str(fasta_dir),
+            'output_prefix': str(tmpdir.join('dists{}'.format(run))),
+            'sketch_k': k,
+            'sketch_size': 200,
+            'n_jobs': 2,
+            'cgr_cache': cache_options
+        }
+        backend.run_backend_dists(options, {})
+        result = kameris_formats.dist_reader.read_matrix(
+            options['output_prefix'] + '-minhash.mm-dist'
+        )
+        np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+        # the second run uses the sketches saved in the cache
+        assert os.listdir(os.path.join(cache_options['dir'],
+                                       'minhash-k13-200'))
+        monkeypatch.setattr(_minhash, 'sketch', None)
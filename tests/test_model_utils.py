@@ -0,0 +1,139 @@
+import io
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from kameris.utils import model_utils
+
+from .helpers import synthetic_features
+
+
+def fitted_model():
+    # enough features for the coefficients to be stored as a raw array
+    features, point_classes = synthetic_features(num_features=400)
+    pipeline = Pipeline([('scaler', StandardScaler()),
+                         ('classifier', LogisticRegression())])
+    pipeline.fit(features, point_classes)
+    model_data = {
+        'generation_options': {'k': 3},
+        'sklearn_version': 'test',
+        'predictor': pipeline,
+        'compiled_predictor': {'weights': np.arange(10)}
+    }
+    return model_data, features
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_model_round_trip(tmpdir, mmap):
+    model_data, features = fitted_model()
+    filename = str(tmpdir.join('model.mm-model'))
+    model_utils.save_model(filename, model_data)
+
+    loaded = model_utils.load_model(filename, mmap=mmap)
+    assert loaded['generation_options'] == {'k': 3}
+    assert loaded['sklearn_version'] == 'test'
+    np.testing.assert_array_equal(loaded['compiled_predictor']['weights'],
+                                  np.arange(10))
+    np.testing.assert_array_equal(
+        loaded['predictor'].predict_proba(features),
+        model_data['predictor'].predict_proba(features)
+    )
+    coefs = loaded['predictor'].named_steps['classifier'].coef_
+    assert isinstance(coefs.base, np.memmap) == mmap
+
+
+def test_load_model_from_file_objects(tmpdir):
+    model_data, features = fitted_model()
+    outfile = io.BytesIO()
+    filename = str(tmpdir.join('model.mm-model'))
+    model_utils.save_model(filename, model_data)
+    with open(filename, 'rb') as infile:
+        outfile.write(infile.read())
+    outfile.seek(0)
+
+    loaded = model_utils.load_model(outfile)
+    np.testing.assert_array_equal(loaded['predictor'].predict(features),
+                                  model_data['predictor'].predict(features))
+
+
+def test_load_model_prefer_compiled(tmpdir):
+    model_data, _ = fitted_model()
+    filename = str(tmpdir.join('model.mm-model'))
+    model_utils.save_model(filename, model_data)
+    loaded = model_utils.load_model(filename, prefer_compiled=True)
+    assert 'predictor' not in loaded
+    assert 'compiled_predictor' in loaded
+
+    del model_data['compiled_predictor']
+    model_utils.save_model(filename, model_data)
+    loaded = model_utils.load_model(filename, prefer_compiled=True)
+    assert 'predictor' in loaded
+
+
+def test_load_old_joblib_model(tmpdir):
+    joblib = pytest.importorskip('sklearn.externals.joblib')
+    model_data, features = fitted_model()
+    filename = str(tmpdir.join('model.mm-model'))
+    joblib.dump(model_data, filename)
+    loaded = model_utils.load_model(filename)
+    np.testing.assert_array_equal(loaded['predictor'].predict(features),
+                                  model_data['predictor'].predict(features))
+
+
+def test_read_model_metadata(tmpdir, monkeypatch):
+    model_data, _ = fitted_model()
+    filename = str(tmpdir.join('model.mm-model'))
+    model_utils.save_model(filename, model_data)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('only the metadata should be read')
+
+    with monkeypatch.context() as patched:
+        patched.setattr(model_utils.pickle, 'Unpickler', fail)
+        patched.setattr(model_utils.np, 'memmap', fail)
+        patched.setattr(model_utils, '_joblib_load', fail)
+        metadata = model_utils.read_model_metadata(filename)
+    assert metadata['generation_options'] == {'k': 3}
+    assert metadata['sklearn_version'] == 'test'
+    assert metadata['classes'] == model_data['predictor'].classes_.tolist()
+    assert metadata['format_version'] == model_utils._format_version
+    assert 'predictor' not in metadata and 'arrays' not in metadata
+
+
+def test_read_old_joblib_model_metadata(tmpdir):
+    joblib = pytest.importorskip('sklearn.externals.joblib')
+    model_data, _ = fitted_model()
+    filename = str(tmpdir.join('model.mm-model'))
+    joblib.dump(model_data, filename)
+    metadata = model_utils.read_model_metadata(filename)
+    assert metadata['generation_options'] == {'k': 3}
+    assert metadata['classes'] == model_data['predictor'].classes_.tolist()
+
+
+def test_load_model_closes_files(tmpdir, monkeypatch):
+    model_data, features = fitted_model()
+    filename = str(tmpdir.join('model.mm-model'))
+    model_utils.save_model(filename, model_data)
+
+    opened = []
+
+    def tracking_open(*args, **kwargs):
+        opened.append(open(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(model_utils, 'open', tracking_open, raising=False)
+    for load in (model_utils.load_model, model_utils.read_model_metadata):
+        loaded = load(filename)
+        assert opened[-1].closed
+    # memory-mapped arrays are still readable
+    np.testing.assert_array_equal(
+        model_utils.load_model(filename)['predictor'].predict(features),
+        model_data['predictor'].predict(features)
+    )
+
+    with open(filename, 'rb') as infile:
+        loaded = model_utils.load_model(infile)
+        assert not infile.closed
+    assert 'predictor' in loaded
@@ -0,0 +1,102 @@
+from multiprocessing.pool import ThreadPool
+import os
+import pytest
+import time
+
+from kameris.utils import process_utils
+
+
+def succeed(value):
+    return value * 2
+
+
+def fail():
+    raise ValueError('bad value')
+
+
+def crash():
+    os._exit(3)
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+def run(tasks, **kwargs):
+    return {name: (result, failure) for name, result, failure
+            in process_utils.run_killable(tasks, **kwargs)}
+
+
+def test_run_killable_results():
+    results = run([('ok', succeed, (21,)), ('error', fail, ()),
+                   ('crash', crash, ())], max_workers=2)
+    assert results['ok'] == (42, None)
+    assert results['error'][1]['reason'] == 'error'
+    assert 'bad value' in results['error'][1]['message']
+    assert results['crash'][1]['reason'] == 'crashed'
+
+
+def test_run_killable_timeout():
+    results = run([('slow', sleep, (30,)), ('fast', succeed, (1,))],
+                  max_workers=2, timeout=1, poll_interval=0.05)
+    assert results['slow'][1]['reason'] == 'timeout'
+    assert results['fast'] == (2, None)
+
+
+class LatePipe(object):
+    # a pipe whose worker always sends its result and exits just after the
+    #   first poll finding it empty
+    def __init__(self, conn, process):
+        self.conn = conn
+        self.process = process
+        self.polled = False
+
+    def poll(self):
+        if self.conn.poll():
+            return True
+        if not self.polled:
+            self.polled = True
+            self.process.join()
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_run_killable_keeps_results_of_exited_workers(monkeypatch):
+    worker_init = process_utils._Worker.__init__
+
+    def init(self, *args):
+        worker_init(self, *args)
+        self.conn = LatePipe(self.conn, self.process)
+    monkeypatch.setattr(process_utils._Worker, '__init__', init)
+
+    results = run([('late', sleep, (0.5,))], poll_interval=0.01)
+    assert results == {'late': (None, None)}
+
+
+def test_ordered_results():
+    pool = ThreadPool(3)
+    try:
+        results = list(process_utils.ordered_results(pool, succeed,
+                                                     range(20), 4))
+    finally:
+        pool.terminate()
+    assert results == [2 * i for i in range(20)]
+
+
+def blas_threads(num_threads):
+    from threadpoolctl import threadpool_info
+    process_utils.limit_threads(num_threads)
+    return ([pool['num_threads'] for pool in threadpool_info()],
+            os.environ['OMP_NUM_THREADS'])
+
+
+def test_limit_threads():
+    pytest.importorskip('threadpoolctl')
+    import numpy  # noqa: F401 (loads BLAS)
+    results = run([('limited', blas_threads, (1,))])
+    assert results['limited'][1] is None
+    pool_threads, env_threads = results['limited'][0]
+    assert set(pool_threads) <= {1}
+    assert env_threads == '1'
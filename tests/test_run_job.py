@@ -0,0 +1,93 @@
+import importlib
+import os
+import pytest
+import subprocess
+import sys
+
+from kameris.job_steps import _classifiers, lazy_module_names
+from kameris.subcommands import run_job
+
+
+def job_options(classifiers, **step_options):
+    step = {'type': 'classify', 'features_file': 'features.mm-repr',
+            'output_file': 'results.json', 'validation_count': 3,
+            'classifiers': classifiers}
+    step.update(step_options)
+    return {'name': 'test', 'experiments': {'exp': {'groups': {}}},
+            'steps': [step]}
+
+
+def test_validate_classifiers():
+    run_job.validate_job_options(job_options([
+        'logistic-regression',
+        {'name': 'rbf-svm', 'label': 'svm', 'params': {'C': 10}}
+    ]))
+    run_job.validate_job_options(job_options(
+        [{'name': 'rbf-svm', 'params': {'cache_size': 500}}],
+        precomputed_kernels=True
+    ))
+
+    invalid_classifiers = [
+        ['no-such-classifier'],
+        [{'name': 'rbf-svm', 'params': {'no_such_param': 1}}],
+        [{'name': 'rbf-svm', 'params': {'shrinking': False}}]
+    ]
+    for classifiers in invalid_classifiers:
+        with pytest.raises(Exception, match='invalid classifier'):
+            run_job.validate_job_options(job_options(
+                classifiers, precomputed_kernels=True
+            ))
+
+
+def test_validation_does_not_import_sklearn():
+    code = '\n'.join([
+        'import sys',
+        'from kameris.subcommands import run_job',
+        'from tests.test_run_job import job_options',
+        "run_job.validate_job_options(job_options(['logistic-regression', "
+        "'random-forest', 'multilayer-perceptron']))",
+        "print(sorted(m for m in sys.modules if m.startswith('sklearn')))"
+    ])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+    assert output.decode().strip() == '[]'
+
+
+def test_params_match_sklearn():
+    sklearn = pytest.importorskip('sklearn')
+    if sklearn.__version__ != '0.19.1':
+        pytest.skip('parameters are listed for scikit-learn 0.19.1')
+
+    for factories in (_classifiers.classifiers_by_name,
+                      _classifiers.kernel_classifiers_by_name):
+        for factory in factories.values():
+            class_name = factory.args[1]
+            assert (sorted(_classifiers._class_params[class_name]) ==
+                    sorted(factory().get_params()))
+
+
+def test_lazy_module_names():
+    names = lazy_module_names()
+    assert 'kameris.job_steps.classify' in names
+    assert 'kameris.job_steps._kernels' in names
+    assert 'sklearn.linear_model' in names
+    for name in names:
+        importlib.import_module(name)
+
+
+def test_rerun_exp_options():
+    experiments = run_job.preprocess_experiments({'exp': {
+        'groups': {'a': {}}, 'expand_options': {'k': '1..3'}
+    }}, ['k'])
+    assert experiments['exp-k=1']['derive_k_values'] == [2, 3]
+    assert experiments['exp-k=3']['selection_copy_from'] == 'exp-k=1'
+
+    for exp_name, exp_options in experiments.items():
+        exp_options = dict(exp_options, experiment_name=exp_name)
+        rerun_options = run_job.rerun_exp_options(exp_options)
+        assert rerun_options == {'groups': {'a': {}},
+                                 'k': experiments[exp_name]['k']}
+        rerun_experiments = run_job.preprocess_experiments(
+            {exp_name: rerun_options}, ['k']
+        )
+        assert rerun_experiments == {exp_name: rerun_options}
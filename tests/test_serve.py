@@ -0,0 +1,150 @@
+import json
+import numpy as np
+import os
+import pytest
+import socket
+import threading
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import urlopen
+
+from kameris.job_steps import _cgr
+from kameris.subcommands import classify, serve
+
+from .helpers import random_sequence, sequence_model
+
+
+@pytest.fixture(scope='module')
+def server():
+    metrics = serve.Metrics()
+    server = serve.ThreadingHTTPServer(('127.0.0.1', 0), serve.RequestHandler)
+    server.workers = {'model': serve.ModelWorker(sequence_model(), 256, 0.05,
+                                                 metrics)}
+    server.metrics = metrics
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://{}:{}'.format(*server.server_address[:2])
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, data):
+    try:
+        response = urlopen(url + '/classify', data)
+        return response.getcode(), json.loads(response.read().decode())
+    except HTTPError as e:
+        return e.code, json.loads(e.read().decode())
+
+
+def test_classify(server):
+    rng = np.random.RandomState(1)
+    fasta = '>first\n{}\n>second\n{}\n'.format(random_sequence(rng, 300, 0.8),
+                                               random_sequence(rng, 300, 0.2))
+    code, results = post(server, fasta.encode())
+    assert code == 200
+    assert [results[name][0][0] for name in ('first', 'second')] == \
+        ['gc', 'at']
+
+    code, results = post(server, b'GGCCGCGCTA\n')
+    assert code == 200 and list(results) == ['sequence']
+
+
+def test_invalid_requests(server):
+    assert post(server, b'>a\nACGT\n>a\nACGT\n')[0] == 400
+    assert post(server, b'>a\n>b\nACGT\n')[0] == 400
+    assert post(server, b'')[0] == 400
+
+    code, result = post(server, b'>short\nA\n>ok\nACGTACGT\n>n\nNNNN\n')
+    assert code == 400
+    assert result['error'].endswith('short, n')
+
+
+def test_bad_requests_dont_fail_batches(server):
+    # requests are sent together so they are likely batched
+    responses = {}
+
+    def send(name, data):
+        responses[name] = post(server, data)
+    threads = [threading.Thread(target=send, args=(name, data))
+               for name, data in [('short', b'>short\nA\n'),
+                                  ('ok', b'>ok\nGCGCGCGCTT\n')] * 5]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert responses['short'][0] == 400
+    assert responses['ok'][0] == 200
+
+
+def test_parse_records_like_classify():
+    fasta = b'>a desc\nNACGTNNAC\nGTRYA\n\n>b\nacgtAC\n'
+    records = serve.parse_records(fasta)
+    assert [name for name, _ in records] == ['a', 'b']
+    for (_, codes), (_, expected) in zip(records, _cgr.read_records(
+            iter(fasta.splitlines(True)))):
+        np.testing.assert_array_equal(codes, expected)
+
+    # other letters are kept, since they count differently from nothing
+    #   at the start of a sequence
+    model_data = sequence_model()
+    expected = classify.classify_records(
+        model_data, [('a', _cgr.sequence_codes([b'NACGTNNACGTRYA']))]
+    )
+    assert classify.classify_records(model_data, records[:1]) == expected
+    assert expected != classify.classify_records(
+        model_data, [('a', _cgr.sequence_codes([b'ACGTACGTA']))]
+    )
+
+
+def test_models_and_metrics(server):
+    models = json.loads(urlopen(server + '/models').read().decode())
+    assert models['model']['generation_options']['k'] == 2
+    metrics = json.loads(urlopen(server + '/metrics').read().decode())
+    assert metrics['requests'] >= 0
+
+
+def test_failed_batches_are_retried_per_request(monkeypatch):
+    classify_records = classify.classify_records
+
+    def fail_bad(model_data, records):
+        if any(name == 'bad' for name, _ in records):
+            raise ValueError('bad record')
+        return classify_records(model_data, records)
+    monkeypatch.setattr(classify, 'classify_records', fail_bad)
+    worker = serve.ModelWorker(sequence_model(), 256, 0.5, serve.Metrics())
+
+    responses = {}
+
+    def send(name):
+        try:
+            responses[name] = worker.classify(
+                [(name, _cgr.sequence_codes([b'GCGCGCGCTT']))]
+            )
+        except ValueError as e:
+            responses[name] = e
+    threads = [threading.Thread(target=send, args=(name,))
+               for name in ('bad', 'ok')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert isinstance(responses['bad'], ValueError)
+    assert responses['ok'][0]['result'][0][0] == 'gc'
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                    reason='unix sockets are not supported')
+def test_remove_stale_socket(tmpdir):
+    socket_path = str(tmpdir.join('server.sock'))
+    serve.remove_stale_socket(socket_path)
+    server = serve.ThreadingUnixHTTPServer(socket_path, serve.RequestHandler)
+    server.server_close()
+    assert os.path.exists(socket_path)
+    serve.remove_stale_socket(socket_path)
+    assert not os.path.exists(socket_path)
+
+    results_path = tmpdir.join('results.json')
+    results_path.write('[]')
+    with pytest.raises(Exception, match='not a socket'):
+        serve.remove_stale_socket(str(results_path))
+    assert results_path.read() == '[]'
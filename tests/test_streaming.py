@@ -0,0 +1,86 @@
+import numpy as np
+import scipy.sparse as sparse
+from sklearn.decomposition import TruncatedSVD
+
+from kameris.job_steps import _streaming, classify
+
+from .helpers import classify_options, run_classify, synthetic_features
+
+
+def low_rank_features(rank=4):
+    rng = np.random.RandomState(0)
+    return rng.uniform(size=(50, rank)).dot(rng.uniform(size=(rank, 20)))
+
+
+def test_incremental_svd_matches_truncated_svd():
+    # with as many components as the rank of the data, nothing is lost by
+    #   fitting in batches
+    features = low_rank_features()
+    exact = TruncatedSVD(n_components=4, algorithm='arpack').fit(features)
+
+    for batches in (features, sparse.csr_matrix(features)):
+        reducer = _streaming.IncrementalTruncatedSVD(n_components=4)
+        for start in range(0, 50, 7):
+            reducer.partial_fit(batches[start:start+7])
+        np.testing.assert_allclose(np.abs(reducer.transform(batches)),
+                                   np.abs(exact.transform(features)),
+                                   atol=1e-8)
+        np.testing.assert_allclose(reducer.explained_variance_ratio_,
+                                   exact.explained_variance_ratio_)
+
+
+def test_incremental_svd_bounds_dense_rows(monkeypatch):
+    features = sparse.csr_matrix(low_rank_features())
+    monkeypatch.setattr(_streaming, '_max_dense_bytes', 8 * 20 * 3)
+    chunked = _streaming.IncrementalTruncatedSVD(n_components=4).fit(features)
+    whole = _streaming.IncrementalTruncatedSVD(n_components=4)
+    monkeypatch.undo()
+    whole.fit(features)
+    np.testing.assert_allclose(np.abs(chunked.components_),
+                               np.abs(whole.components_), atol=1e-8)
+
+
+def test_streaming_keeps_sparse_batches():
+    features = sparse.csr_matrix(low_rank_features())
+    rows = _streaming.BatchedRows(np.arange(50), 8)
+    assert all(sparse.issparse(batch) for _, batch in rows.batches(features))
+
+
+def test_streaming_applies_precision():
+    features = low_rank_features()
+    rows = _streaming.BatchedRows(np.arange(50), 8)
+    options = {'precision': 'float32', 'dim_reduce_fraction': 0.2}
+    normalizer = _streaming.fit_normalizer(
+        features, rows,
+        classify.build_normalizers(20, options, streaming=True)
+    )
+    assert [name for name, _ in normalizer.steps] == [
+        'precision', 'scaler', 'dim_reducer', 'reduced_precision'
+    ]
+    assert normalizer.transform(features).dtype == np.float32
+
+    normalizer = _streaming.fit_normalizer(
+        features, rows, classify.build_normalizers(
+            20, dict(options, skip_normalization=True), streaming=True
+        )
+    )
+    assert normalizer.transform(features).dtype == np.float32
+
+
+def test_streaming_step(tmpdir):
+    features, point_classes = synthetic_features()
+    options = classify_options(str(tmpdir), features, point_classes,
+                               classifiers=['sgd'], checkpoint=False,
+                               streaming=True, streaming_batch_size=10,
+                               streaming_epochs=5)
+    results = run_classify(options)
+    assert results['sgd']['top1']['accuracy'] > 0.8
+
+    # sparse batches are kept sparse, which only changes rounding
+    sparse_results = run_classify(classify_options(
+        str(tmpdir), sparse.csr_matrix(features), point_classes, **options
+    ))
+    assert (sparse_results['sgd']['confusion_matrix'] ==
+            results['sgd']['confusion_matrix'])
+    assert np.isclose(sparse_results['sgd']['average_reduced_variance_ratio'],
+                      results['sgd']['average_reduced_variance_ratio'])
@@ -0,0 +1,184 @@
+import kameris_formats
+import numpy as np
+import os
+import pytest
+import scipy.sparse as sparse
+from scipy.spatial.distance import pdist, squareform
+
+from kameris.job_steps import _tiled_dists, backend
+
+from .helpers import write_features
+
+
+scipy_metrics = {'euclid': 'euclidean', 'cosine': 'cosine',
+                 'correlation': 'correlation'}
+
+
+def random_features(num_vectors=11, num_features=30, seed=0):
+    rng = np.random.RandomState(seed)
+    features = rng.uniform(size=(num_vectors, num_features))
+    features[rng.uniform(size=features.shape) < 0.7] = 0
+    # no vector is empty or constant, for which scipy gives no distances
+    features[:, 0] = 1
+    features[:, 1] = 0
+    return features
+
+
+def output_files(directory, name):
+    return {metric: os.path.join(directory,
+                                 '{}-{}.mm-dist'.format(name, metric))
+            for metric in _tiled_dists.metrics}
+
+
+def read_dists(output_files):
+    return {metric: kameris_formats.dist_reader.read_matrix(filename)
+            for metric, filename in output_files.items()}
+
+
+@pytest.mark.parametrize('is_sparse', [False, True])
+@pytest.mark.parametrize('tile_size,n_jobs', [(None, 1), (3, 1), (4, 3),
+                                              (1, 2)])
+def test_distances_match_pdist(tmpdir, is_sparse, tile_size, n_jobs):
+    features = random_features()
+    input_file = str(tmpdir.join('features.mm-repr'))
+    write_features(input_file, sparse.csr_matrix(features) if is_sparse
+                   else features)
+    outputs = output_files(str(tmpdir), 'dists')
+    _tiled_dists.compute_distances(input_file, outputs, tile_size, n_jobs)
+
+    for metric, dists in read_dists(outputs).items():
+        np.testing.assert_allclose(
+            dists, squareform(pdist(features, scipy_metrics[metric])),
+            rtol=1e-5, atol=1e-6
+        )
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        ['features.mm-repr'] + [os.path.basename(f)
+                                for f in outputs.values()]
+    )
+
+
+def test_distances_of_empty_vectors(tmpdir):
+    features = np.zeros((3, 4))
+    features[1, 2] = 2
+    input_file = str(tmpdir.join('features.mm-repr'))
+    write_features(input_file, features)
+    outputs = output_files(str(tmpdir), 'dists')
+    _tiled_dists.compute_distances(input_file, outputs, 2)
+
+    dists = read_dists(outputs)
+    np.testing.assert_allclose(dists['euclid'],
+                               squareform(pdist(features)))
+    # empty vectors are taken to be unrelated to all others
+    for metric in ('cosine', 'correlation'):
+        np.testing.assert_array_equal(dists[metric],
+                                      1 - np.eye(3))
+
+
+def test_single_vector(tmpdir):
+    input_file = str(tmpdir.join('features.mm-repr'))
+    write_features(input_file, np.ones((1, 4)))
+    outputs = output_files(str(tmpdir), 'dists')
+    _tiled_dists.compute_distances(input_file, outputs)
+    for dists in read_dists(outputs).values():
+        assert dists.shape == (1, 1)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_resume_from_checkpoints(tmpdir, monkeypatch):
+    features = random_features(num_vectors=20)
+    input_file = str(tmpdir.join('features.mm-repr'))
+    write_features(input_file, features)
+    outputs = output_files(str(tmpdir), 'dists')
+    checkpoints_dir = str(tmpdir.join('checkpoints'))
+    monkeypatch.setattr(_tiled_dists, '_checkpoint_interval', 0)
+
+    # tiles of 4 vectors give 15 tiles, of which 6 are finished
+    run_tile = _tiled_dists._run_tile
+    finished = []
+
+    def interrupted_run_tile(tile):
+        if len(finished) == 6:
+            raise Interrupted()
+        finished.append(tile[0])
+        return run_tile(tile)
+
+    monkeypatch.setattr(_tiled_dists, '_run_tile', interrupted_run_tile)
+    with pytest.raises(Interrupted):
+        _tiled_dists.compute_distances(input_file, outputs, 4,
+                                       checkpoints_dir=checkpoints_dir)
+    assert not any(os.path.exists(f) for f in outputs.values())
+
+    resumed = []
+
+    def counted_run_tile(tile):
+        resumed.append(tile[0])
+        return run_tile(tile)
+
+    monkeypatch.setattr(_tiled_dists, '_run_tile', counted_run_tile)
+    _tiled_dists.compute_distances(input_file, outputs, 4,
+                                   checkpoints_dir=checkpoints_dir)
+    assert sorted(finished + resumed) == list(range(15))
+    assert not os.path.exists(checkpoints_dir)
+    for metric, dists in read_dists(outputs).items():
+        np.testing.assert_allclose(
+            dists, squareform(pdist(features, scipy_metrics[metric])),
+            rtol=1e-5, atol=1e-6
+        )
+
+
+def test_checkpoints_of_other_input_are_discarded(tmpdir, monkeypatch):
+    input_file = str(tmpdir.join('features.mm-repr'))
+    write_features(input_file, random_features(num_vectors=8))
+    outputs = output_files(str(tmpdir), 'dists')
+    checkpoints_dir = str(tmpdir.join('checkpoints'))
+    monkeypatch.setattr(_tiled_dists, '_checkpoint_interval', 0)
+
+    run_tile = _tiled_dists._run_tile
+
+    def interrupted_run_tile(tile):
+        if tile[0] == 2:
+            raise Interrupted()
+        return run_tile(tile)
+
+    monkeypatch.setattr(_tiled_dists, '_run_tile', interrupted_run_tile)
+    with pytest.raises(Interrupted):
+        _tiled_dists.compute_distances(input_file, outputs, 2,
+                                       checkpoints_dir=checkpoints_dir)
+    monkeypatch.setattr(_tiled_dists, '_run_tile', run_tile)
+
+    features = random_features(num_vectors=8, seed=1)
+    write_features(input_file, features)
+    _tiled_dists.compute_distances(input_file, outputs, 2,
+                                   checkpoints_dir=checkpoints_dir)
+    for metric, dists in read_dists(outputs).items():
+        np.testing.assert_allclose(
+            dists, squareform(pdist(features, scipy_metrics[metric])),
+            rtol=1e-5, atol=1e-6
+        )
+
+
+def test_tiled_distances_step(tmpdir):
+    features = random_features()
+    input_file = str(tmpdir.join('features.mm-repr'))
+    write_features(input_file, sparse.csr_matrix(features))
+    options = {
+        'distances': ['euclid', 'correlation'],
+        'input_file': input_file,
+        'output_prefix': str(tmpdir.join('dists')),
+        'tile_size': 5,
+        'n_jobs': 2
+    }
+    backend.run_backend_dists(options, {})
+    for metric in options['distances']:
+        dists = kameris_formats.dist_reader.read_matrix(
+            '{}-{}.mm-dist'.format(options['output_prefix'], metric)
+        )
+        np.testing.assert_allclose(
+            dists, squareform(pdist(features, scipy_metrics[metric])),
+            rtol=1e-5, atol=1e-6
+        )
+    assert not tmpdir.join('dists.checkpoints').exists()
+    assert not tmpdir.join('dists-cosine.mm-dist').exists()